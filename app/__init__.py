@@ -1,21 +1,35 @@
 # app/__init__.py
+import logging
 import os
+import time
+import click
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
-from flask_migrate import Migrate
 from flask_mail import Mail
 from flask_login import LoginManager
 from dotenv import load_dotenv
 
-# Import password hashing ONLY IF doing auto-admin creation in init
-from werkzeug.security import generate_password_hash # <--- NEW import here
+from app.database import RoutingSession
 
-db = SQLAlchemy()
-migrate = Migrate()
+# RoutingSession sends reads inside read_replica() blocks to DATABASE_REPLICA_URL.
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 mail = Mail()
 login_manager = LoginManager()
 
+logger = logging.getLogger(__name__)
+
+def init_migrations(app):
+    """Register Flask-Migrate and the `flask db` commands (once per app).
+
+    Importing it pulls in alembic, a few hundred milliseconds that web workers
+    never need, so create_app() only does this for the CLI and release tasks.
+    """
+    if 'migrate' not in app.extensions:
+        from flask_migrate import Migrate
+        Migrate(app, db)
+
 def create_app():
+    started = time.perf_counter()
     project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
     static_folder_path = os.path.join(project_root, 'static')
     
@@ -25,70 +39,88 @@ def create_app():
     from config import Config
     app.config.from_object(Config)
 
+    # Structured logs for every app.* logger (LOG_FORMAT=json in production).
+    from app.logging_setup import configure_logging
+    configure_logging(app)
+
+    # Pool sizing/timeouts and the optional read replica (app/database.py).
+    from app.database import configure_engines, label_pools, remember_writes
+    configure_engines(app)
     db.init_app(app)
-    migrate.init_app(app, db)
+    label_pools(db, app)
+    if app.config.get('DATABASE_REPLICA_URL'):
+        app.after_request(remember_writes(db))
+    # The flask CLI loads the app inside a click context; gunicorn doesn't.
+    if click.get_current_context(silent=True) is not None or app.config.get('RUN_RELEASE_ON_STARTUP'):
+        init_migrations(app)
     mail.init_app(app)
     login_manager.init_app(app)
     login_manager.login_view = 'main.login'
     login_manager.login_message_category = 'info'
 
+    # Local ASN/country range table for network features (before the model is loaded).
+    from app.ai.ipinfo import ip_ranges
+    ip_ranges.init_app(app)
+
+    # Load the anomaly model once per worker instead of once per login.
+    from app.ai.model_registry import model_registry
+    model_registry.init_app(app)
+
+    # Candidate models scored next to the live one, off the request thread.
+    from app.ai.shadow import shadow_models
+    shadow_models.init_app(app)
+
+    # Streaming detector that learns from every login (ANOMALY_ONLINE_MODE).
+    from app.ai.online import online_detector
+    online_detector.init_app(app)
+
+    # Cached per-user login history used as anomaly features.
+    from app.profiles import profile_store
+    profile_store.init_app(app)
+
+    # Login throttling, checked before any password hash is computed.
+    from app.ratelimit import limiter
+    limiter.init_app(app)
+
+    # Password hashing runs in a bounded process pool, not on the request thread.
+    from app.hashing import password_hasher
+    password_hasher.init_app(app)
+
+    # Signed, single-use password reset tokens with a cached serializer.
+    from app.tokens import reset_tokens
+    reset_tokens.init_app(app)
+
+    # Query timing hooks and gauges behind /metrics.
+    from app import metrics
+    metrics.init_app(app)
+
+    # current_user is rebuilt from a short-lived per-worker cache, not a query per request.
+    from app.user_cache import user_cache
+    user_cache.init_app(app)
+
     @login_manager.user_loader
     def load_user(user_id):
-        from app.models import User
-        return User.query.get(int(user_id))
+        return user_cache.load(int(user_id))
 
     # Import blueprints AFTER extensions are initialized
     from app.routes import main as main_blueprint
     app.register_blueprint(main_blueprint)
 
-    # <--- NEW: Automated Database Initialization and Admin Creation --->
-    # This block will run when the app starts. It ensures migrations are applied
-    # and an initial admin user is created IF the database is empty.
-    # It will only run ONCE on a fresh database.
-    with app.app_context():
-        # Import models here to avoid circular imports at module level
-        from app.models import User, LoginActivity
-        
-        # Apply database migrations
-        # This command will check for new migrations and apply them.
-        # It's safe to run multiple times; it only applies unapplied migrations.
-        # Ensure 'flask_migrate' is installed.
-        try:
-            from flask.cli import current_app
-            from flask_migrate import upgrade as db_upgrade # Import upgrade function
-            print("Attempting to run database migrations...")
-            db_upgrade() # Run all pending migrations
-            print("Database migrations checked/applied.")
-        except Exception as e:
-            print(f"Error during database migration: {e}")
-            # In production, you might want more robust error logging or alerting
-            # but for a small app, this print is fine.
-
-        # Create a default admin user if one doesn't already exist.
-        # This is a simple way to ensure you always have an admin for initial access.
-        default_admin_email = os.environ.get('DEFAULT_ADMIN_EMAIL') or 'admin@example.com' # Use env var or default
-        default_admin_password = os.environ.get('DEFAULT_ADMIN_PASSWORD') or 'StrongPassword123!' # Use env var or default
-        default_admin_username = os.environ.get('DEFAULT_ADMIN_USERNAME') or 'admin' # Use env var or default
-
-        admin_user = User.query.filter_by(email=default_admin_email).first()
-        if not admin_user:
-            print(f"Creating default admin user: {default_admin_email}")
-            hashed_password = generate_password_hash(default_admin_password)
-            new_admin = User(
-                username=default_admin_username,
-                email=default_admin_email,
-                password=hashed_password,
-                is_admin=True
-            )
-            db.session.add(new_admin)
-            try:
-                db.session.commit()
-                print("Default admin user created successfully.")
-            except Exception as e:
-                db.session.rollback()
-                print(f"Error creating default admin user: {e}")
-        else:
-            print(f"Admin user '{default_admin_email}' already exists.")
-    # <--- END NEW Section --->
+    from app.cli import register_commands
+    register_commands(app)
+
+    # Migrations and the default admin are a release step (`flask release`), not
+    # something every worker does on boot. RUN_RELEASE_ON_STARTUP=1 restores the
+    # old behaviour for local development; it is serialised by a lock.
+    if app.config.get('RUN_RELEASE_ON_STARTUP'):
+        from app.release import run_release
+        with app.app_context():
+            run_release()
+
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    app.extensions['startup'] = {'create_app_ms': round(elapsed_ms, 1)}
+    budget_ms = app.config.get('COLD_START_BUDGET_MS')
+    if budget_ms and elapsed_ms > budget_ms:
+        logger.warning("create_app() took %.0f ms, over the %.0f ms cold-start budget", elapsed_ms, budget_ms)
 
     return app
@@ -0,0 +1,121 @@
+# app/activity.py
+# Keyset ("seek") pagination over LoginActivity for the activity log views.
+# Pages are ordered newest first by (timestamp, id) and the cursor is the
+# (timestamp, id) of the last row shown, so fetching page N costs the same
+# index range scan as page 1 no matter how large the table gets, unlike
+# OFFSET, which reads and discards every earlier row.
+import base64
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, tuple_
+
+from app import db
+from app.models import LoginActivity
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+
+class ActivityQueryError(ValueError):
+    # Raised for malformed filters or cursors; the message is safe to show users.
+    pass
+
+
+def encode_cursor(timestamp, row_id):
+    raw = f'{timestamp.isoformat()}|{row_id}'.encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode('utf-8')
+        timestamp, row_id = raw.split('|')
+        return datetime.fromisoformat(timestamp), int(row_id)
+    except (ValueError, UnicodeDecodeError):
+        raise ActivityQueryError('Invalid cursor.')
+
+
+def _parse_date(value, name):
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        raise ActivityQueryError(f"'{name}' must be an ISO date or datetime, e.g. 2025-06-22.")
+
+
+def parse_filters(args):
+    """Build a filter dict from request args (username, ip, suspicious, since, until)."""
+    filters = {}
+    if args.get('username'):
+        filters['username'] = args['username'].strip()
+    if args.get('ip'):
+        filters['ip_address'] = args['ip'].strip()
+    suspicious = (args.get('suspicious') or '').strip().lower()
+    if suspicious in ('1', 'true', 'yes'):
+        filters['is_suspicious'] = True
+    elif suspicious in ('0', 'false', 'no'):
+        filters['is_suspicious'] = False
+    elif suspicious:
+        raise ActivityQueryError("'suspicious' must be true or false.")
+    if args.get('since'):
+        filters['since'] = _parse_date(args['since'], 'since')
+    if args.get('until'):
+        until = _parse_date(args['until'], 'until')
+        # A bare date means "through the end of that day".
+        if len(args['until'].strip()) == 10:
+            until += timedelta(days=1)
+        filters['until'] = until
+    return filters
+
+
+def parse_page_size(value, default=DEFAULT_PAGE_SIZE, maximum=MAX_PAGE_SIZE):
+    if not value:
+        return default
+    try:
+        size = int(value)
+    except ValueError:
+        raise ActivityQueryError("'limit' must be a number.")
+    return max(1, min(size, maximum))
+
+
+def apply_filters(query, filters):
+    """Add the WHERE clauses for a parse_filters() dict to a LoginActivity query."""
+    if 'username' in filters:
+        query = query.where(LoginActivity.username == filters['username'])
+    if 'ip_address' in filters:
+        query = query.where(LoginActivity.ip_address == filters['ip_address'])
+    if 'is_suspicious' in filters:
+        query = query.where(LoginActivity.is_suspicious.is_(filters['is_suspicious']))
+    if 'since' in filters:
+        query = query.where(LoginActivity.timestamp >= filters['since'])
+    if 'until' in filters:
+        query = query.where(LoginActivity.timestamp < filters['until'])
+    return query
+
+
+def activity_page(filters=None, cursor=None, limit=DEFAULT_PAGE_SIZE):
+    """Return (rows, next_cursor) for one page of activity, newest first.
+
+    next_cursor is None on the last page.
+    """
+    query = apply_filters(select(LoginActivity), filters or {})
+    if cursor:
+        query = query.where(tuple_(LoginActivity.timestamp, LoginActivity.id) < decode_cursor(cursor))
+
+    # One extra row tells us whether there is another page without a COUNT(*).
+    query = query.order_by(LoginActivity.timestamp.desc(), LoginActivity.id.desc()).limit(limit + 1)
+    rows = db.session.execute(query).scalars().all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].timestamp, rows[-1].id)
+    return rows, next_cursor
+
+
+def activity_to_dict(row):
+    return {
+        'id': row.id,
+        'timestamp': row.timestamp.isoformat() if row.timestamp else None,
+        'username': row.username,
+        'ip_address': row.ip_address,
+        'is_suspicious': bool(row.is_suspicious),
+    }
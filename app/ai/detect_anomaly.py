@@ -1,21 +1,61 @@
-import pickle
-import pandas as pd
+import logging
+import numpy as np
+from flask import current_app
 
-def detect_anomaly(username, ip_address):
+from app.ai.model_registry import model_registry
+from app.ai.shadow import shadow_models
+from app.metrics import ERRORS, phase
+from app.profiles import profile_store
+
+logger = logging.getLogger(__name__)
+
+def detect_anomaly(username, ip_address, recent_failures=0):
+    # recent_failures: rejected/failed login attempts for this username or IP in
+    # the rate limiter's window. A burst of them right before a success is
+    # suspicious on its own, whatever the model thinks.
+    threshold = current_app.config.get('ANOMALY_FAILURE_THRESHOLD', 0)
+    if threshold and recent_failures >= threshold:
+        return True
     try:
-        with open('app/ai/model/model.pkl', 'rb') as f:
-            model = pickle.load(f)
+        # The registry keeps the model in memory and only reloads it when model.pkl changes.
+        loaded = model_registry.get()
 
-        data = pd.DataFrame([{
-            'username': username,
-            'ip_address': ip_address
-        }])
-        data['ip_encoded'] = data['ip_address'].astype('category').cat.codes
-        data['user_encoded'] = data['username'].astype('category').cat.codes
-        features = data[['ip_encoded', 'user_encoded']]
+        # History features come from the cached profile: no extra query on a cache hit.
+        # Shadows that need a profile load it on their own thread.
+        profile = None
+        if loaded.encoder.use_profile:
+            profile = profile_store.get(username).features(ip_address)
 
-        prediction = model.predict(features)
-        return prediction[0] == -1  # -1 means anomaly
-    except Exception as e:
-        print(f"[ERROR] Detection failed: {e}")
+        # Encode with the vocabulary saved at training time so the same user/IP
+        # always gets the same features, even when scoring a single login.
+        features = loaded.encoder.encode(username, ip_address, profile)
+
+        with phase('model_inference'):
+            # Same verdict as predict() == -1, plus the score shadow models are compared on.
+            score = loaded.model.decision_function(features)
+        shadow_models.submit([username], [ip_address], [profile], loaded.version, score)
+        return bool(score[0] < 0) and not loaded.observe_only
+    except Exception:
+        logger.exception("Detection failed for %s", username)
+        ERRORS.inc(component='detect_anomaly')
         return False
+
+def score_batch(usernames, ip_addresses, loaded=None, profiles=None, return_scores=False):
+    # Vectorized version of detect_anomaly: one model call for the whole batch.
+    # Returns a boolean array, True where the login looks anomalous. Unlike
+    # detect_anomaly this raises on failure, since callers are batch jobs.
+    # Pass `loaded` to pin one model version across several batches, and
+    # `profiles` (ProfileState.features() tuples) for models that use history.
+    # With return_scores, returns (flags, decision_function scores) instead.
+    # An observe-only (dummy-trained) model scores but flags nothing.
+    loaded = loaded or model_registry.get()
+    features = loaded.encoder.encode_many(usernames, ip_addresses, profiles)
+    if len(features) == 0:
+        scores = np.zeros(0)
+    else:
+        with phase('model_inference'):
+            scores = loaded.model.decision_function(features)
+    flags = scores < 0
+    if loaded.observe_only:
+        flags = np.zeros(len(scores), dtype=bool)
+    return (flags, scores) if return_scores else flags
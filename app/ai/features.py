@@ -0,0 +1,223 @@
+# app/ai/features.py
+# Turns (username, ip_address) pairs into fixed numeric feature vectors.
+# The encoding is learned once at training time and saved next to the model,
+# so the same username/IP always maps to the same numbers at inference time
+# (unlike per-frame pandas category codes, which collapse a single row to 0).
+import ipaddress
+import json
+import math
+import os
+from datetime import datetime
+
+import numpy as np
+
+from app.ai.ipinfo import ip_ranges
+
+ENCODER_FORMAT_VERSION = 1
+FEATURE_NAMES = ['user_code', 'ip_octet1', 'ip_octet2', 'ip_octet3', 'ip_octet4']
+# Feature value used for IP octets that can't be parsed.
+INVALID_IP = (-1.0, -1.0, -1.0, -1.0)
+
+# Per-user history features, appended when the encoder is fitted with use_profile.
+PROFILE_FEATURE_NAMES = ['ip_known', 'subnet_known', 'hour_share',
+                         'log_seconds_since_last', 'log_login_count', 'recent_login_rate']
+# What a user with no history looks like.
+NEW_USER_PROFILE = (0.0, 0.0, 0.0, -1.0, 0.0, 0.0)
+# Network features from the local IP range table (app/ai/ipinfo.py), appended
+# after the profile features when the encoder is fitted with use_ipinfo.
+IPINFO_FEATURE_NAMES = ['ip_private', 'ip_datacenter', 'ip_asn', 'ip_country']
+# Most recently used IPs remembered per user.
+DEFAULT_MAX_KNOWN_IPS = 16
+# recent_login_rate is a login count that decays with this time constant (seconds).
+RATE_DECAY_SECONDS = 3600.0
+
+
+def encoder_path_for(model_path):
+    """Where the encoder for a given model file lives (model.pkl -> model.encoder.json)."""
+    return os.path.splitext(model_path)[0] + '.encoder.json'
+
+
+def ip_octets(ip_address):
+    """Return an IP address as four numbers that keep neighbouring addresses close.
+
+    IPv4 gives its four octets. IPv6 addresses that wrap an IPv4 address are
+    unwrapped; other IPv6 addresses use the first four bytes (their /32 prefix).
+    """
+    try:
+        ip = ipaddress.ip_address((ip_address or '').strip())
+    except ValueError:
+        return INVALID_IP
+    if ip.version == 6:
+        mapped = ip.ipv4_mapped or ip.sixtofour
+        if mapped is not None:
+            ip = mapped
+    packed = ip.packed
+    return (float(packed[0]), float(packed[1]), float(packed[2]), float(packed[3]))
+
+
+def subnet_of(ip_address):
+    # The /24 an IPv4 address belongs to, as a string key ('' if not IPv4-like).
+    octets = ip_octets(ip_address)
+    if octets == INVALID_IP:
+        return ''
+    return '%d.%d.%d' % octets[:3]
+
+
+class ProfileState:
+    # Compact summary of one user's login history. observe() folds in a login;
+    # features() describes a new login relative to the history so far.
+    __slots__ = ('login_count', 'first_seen', 'last_seen', 'known_ips', 'hour_counts', 'recent_rate')
+
+    def __init__(self, login_count=0, first_seen=None, last_seen=None, known_ips=None,
+                 hour_counts=None, recent_rate=0.0):
+        self.login_count = login_count
+        self.first_seen = first_seen
+        self.last_seen = last_seen
+        self.known_ips = list(known_ips or [])  # most recent first
+        self.hour_counts = list(hour_counts or [0] * 24)
+        self.recent_rate = recent_rate
+
+    def copy(self):
+        return ProfileState(self.login_count, self.first_seen, self.last_seen,
+                            self.known_ips, self.hour_counts, self.recent_rate)
+
+    def _decayed_rate(self, when):
+        if self.last_seen is None:
+            return 0.0
+        elapsed = max((when - self.last_seen).total_seconds(), 0.0)
+        return self.recent_rate * math.exp(-elapsed / RATE_DECAY_SECONDS)
+
+    def features(self, ip_address, when=None):
+        if self.login_count == 0:
+            return NEW_USER_PROFILE
+        when = when or datetime.utcnow()
+        subnet = subnet_of(ip_address)
+        since_last = max((when - self.last_seen).total_seconds(), 0.0)
+        return (
+            1.0 if ip_address in self.known_ips else 0.0,
+            1.0 if subnet and any(subnet_of(ip) == subnet for ip in self.known_ips) else 0.0,
+            self.hour_counts[when.hour] / self.login_count,
+            math.log1p(since_last),
+            math.log1p(self.login_count),
+            self._decayed_rate(when),
+        )
+
+    def observe(self, ip_address, when=None, max_known_ips=DEFAULT_MAX_KNOWN_IPS):
+        when = when or datetime.utcnow()
+        self.recent_rate = self._decayed_rate(when) + 1.0
+        self.login_count += 1
+        self.first_seen = self.first_seen or when
+        self.last_seen = when
+        self.hour_counts[when.hour] += 1
+        if ip_address in self.known_ips:
+            self.known_ips.remove(ip_address)
+        self.known_ips.insert(0, ip_address)
+        del self.known_ips[max_known_ips:]
+
+
+def replay_profiles(rows, states):
+    """Profile features for (username, ip_address, timestamp) rows in time order:
+    each login is described by the history *before* it, then folded in.
+    states maps username -> ProfileState and is updated in place.
+    """
+    profiles = []
+    for username, ip, when in rows:
+        state = states.get(username)
+        if state is None:
+            state = states[username] = ProfileState()
+        profiles.append(state.features(ip, when))
+        state.observe(ip, when)
+    return profiles
+
+
+class FeatureEncoder:
+    def __init__(self, user_vocab=None, model_sha256=None, use_profile=False, use_ipinfo=False):
+        # username -> dense code, assigned in sorted order at fit time.
+        self.user_vocab = dict(user_vocab or {})
+        # Whether per-user history features (ProfileState.features) follow the base features.
+        self.use_profile = bool(use_profile)
+        # Whether ASN/country/network-kind features (ip_ranges.features) come last.
+        self.use_ipinfo = bool(use_ipinfo)
+        self.feature_names = (list(FEATURE_NAMES) + (list(PROFILE_FEATURE_NAMES) if use_profile else [])
+                              + (list(IPINFO_FEATURE_NAMES) if use_ipinfo else []))
+        # Hash of the model file this encoder was saved with, if recorded.
+        self.model_sha256 = model_sha256
+
+    @classmethod
+    def fit(cls, usernames, use_profile=False, use_ipinfo=False):
+        """Build the username vocabulary from every username seen in training data."""
+        vocab = {name: code for code, name in enumerate(sorted(set(usernames)))}
+        return cls(vocab, use_profile=use_profile, use_ipinfo=use_ipinfo)
+
+    def encode_user(self, username):
+        code = self.user_vocab.get(username)
+        if code is not None:
+            return float(code)
+        # Every user the model never saw shares one code in the middle of the
+        # trained range. A code past the vocabulary would isolate (and flag)
+        # anyone who signed up after training; the profile features are what
+        # tell a new user's logins apart.
+        return (len(self.user_vocab) - 1) / 2.0 if self.user_vocab else 0.0
+
+    def encode(self, username, ip_address, profile=None):
+        """Feature vector for a single login, shaped (1, n_features) for model.predict.
+
+        profile is the ProfileState.features() tuple for this login; it is only
+        used by encoders fitted with use_profile, and defaults to a new user.
+        """
+        row = (self.encode_user(username),) + ip_octets(ip_address)
+        if self.use_profile:
+            row += profile or NEW_USER_PROFILE
+        if self.use_ipinfo:
+            row += ip_ranges.features(ip_address)
+        return np.array([row], dtype=np.float64)
+
+    def encode_many(self, usernames, ip_addresses, profiles=None):
+        """Feature matrix for many logins, shaped (n, n_features)."""
+        rows = [(self.encode_user(u),) + ip_octets(ip) for u, ip in zip(usernames, ip_addresses)]
+        if self.use_profile:
+            if profiles is None:
+                profiles = [NEW_USER_PROFILE] * len(rows)
+            rows = [row + tuple(profile) for row, profile in zip(rows, profiles)]
+        if not rows:
+            return np.empty((0, len(self.feature_names)), dtype=np.float64)
+        X = np.array(rows, dtype=np.float64)
+        if self.use_ipinfo:
+            X = np.hstack([X, ip_ranges.features_many(list(ip_addresses))])
+        return X
+
+    def to_dict(self):
+        return {
+            'format_version': ENCODER_FORMAT_VERSION,
+            'feature_names': self.feature_names,
+            'user_vocab': self.user_vocab,
+            'model_sha256': self.model_sha256,
+            'use_profile': self.use_profile,
+            'use_ipinfo': self.use_ipinfo,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        if data.get('format_version') != ENCODER_FORMAT_VERSION:
+            raise ValueError(f"Unsupported encoder format: {data.get('format_version')!r}")
+        # Encoders saved before unknown users shared a code also carry hash_buckets; it is ignored.
+        return cls(data['user_vocab'], data.get('model_sha256'),
+                   data.get('use_profile', False), data.get('use_ipinfo', False))
+
+    def save(self, path, model_sha256=None):
+        if model_sha256 is not None:
+            self.model_sha256 = model_sha256
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.to_dict(), f, sort_keys=True)
+        # Atomic on POSIX, so a worker never reads a half-written encoder.
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            return cls.from_dict(json.load(f))
+
+    @classmethod
+    def loads(cls, raw):
+        return cls.from_dict(json.loads(raw))
@@ -0,0 +1,218 @@
+# app/ai/forest.py
+# A pickle-free, memory-mappable form of the IsolationForest and a pure-NumPy
+# scorer for it. Every tree is flattened into shared contiguous arrays
+# (feature, threshold, children, leaf path length) and written as an
+# uncompressed .npz next to model.pkl. Loading maps those arrays straight from
+# the file: no unpickling, no scikit-learn import, nothing copied onto the
+# worker's heap, and every gunicorn worker on the host shares the same pages.
+#
+# Scores match IsolationForest.score_samples/decision_function/predict (up to
+# float rounding); check with verify_against().
+import hashlib
+import os
+import pickle
+import struct
+import zipfile
+
+import numpy as np
+
+FORMAT_VERSION = 1
+# Rows scored per traversal; bounds the (rows x trees) index arrays.
+SCORE_CHUNK_ROWS = 1024
+_ARRAYS = ('feature', 'threshold', 'children', 'value', 'roots')
+
+
+def forest_path_for(model_path):
+    """Where the flattened forest for a given model file lives (model.pkl -> model.forest.npz)."""
+    return os.path.splitext(model_path)[0] + '.forest.npz'
+
+
+def average_path_length(n_samples):
+    # c(n): expected path length of an unsuccessful BST search among n points,
+    # the normaliser used by Liu et al. (and by scikit-learn).
+    n = np.asarray(n_samples, dtype=np.float64)
+    result = np.zeros_like(n)
+    result[n == 2] = 1.0
+    big = n > 2
+    result[big] = 2.0 * (np.log(n[big] - 1.0) + np.euler_gamma) - 2.0 * (n[big] - 1.0) / n[big]
+    return result
+
+
+def flatten_isolation_forest(model):
+    """Turn a fitted IsolationForest into a dict of flat NumPy arrays."""
+    features, thresholds, children, values, roots = [], [], [], [], []
+    offset = 0
+    max_depth = 0
+    for estimator, columns in zip(model.estimators_, model.estimators_features_):
+        tree = estimator.tree_
+        n_nodes = tree.node_count
+        is_leaf = tree.children_left == -1
+
+        depth = np.zeros(n_nodes, dtype=np.int64)
+        for node in range(n_nodes):  # children always come after their parent
+            if not is_leaf[node]:
+                depth[tree.children_left[node]] = depth[node] + 1
+                depth[tree.children_right[node]] = depth[node] + 1
+        max_depth = max(max_depth, int(depth.max()))
+
+        node_ids = np.arange(n_nodes)
+        # Trees are fitted on a column subset: map back to the model's input columns.
+        features.append(np.where(is_leaf, 0, np.asarray(columns)[np.maximum(tree.feature, 0)]).astype(np.int32))
+        thresholds.append(np.where(is_leaf, 0.0, tree.threshold))
+        # (left, right) per node, interleaved so one gather picks the next node.
+        # Leaves point at themselves so a fixed number of steps lands every row on a leaf.
+        children.append(np.stack([np.where(is_leaf, node_ids, tree.children_left),
+                                  np.where(is_leaf, node_ids, tree.children_right)], axis=1) + offset)
+        values.append(np.where(is_leaf, depth + average_path_length(tree.n_node_samples), 0.0))
+        roots.append(offset)
+        offset += n_nodes
+
+    return {
+        'feature': np.concatenate(features),
+        'threshold': np.concatenate(thresholds).astype(np.float64),
+        'children': np.concatenate(children).astype(np.int32),
+        'value': np.concatenate(values).astype(np.float64),
+        'roots': np.asarray(roots, dtype=np.int32),
+        'format_version': np.asarray(FORMAT_VERSION),
+        'max_depth': np.asarray(max_depth),
+        'n_features': np.asarray(model.n_features_in_),
+        'path_norm': np.asarray(float(average_path_length([model.max_samples_])[0])),
+        'offset': np.asarray(float(model.offset_)),
+    }
+
+
+def save_forest(path, model, model_sha256=''):
+    """Write the flattened forest atomically. model_sha256 ties it to its model.pkl."""
+    arrays = flatten_isolation_forest(model)
+    arrays['model_sha256'] = np.asarray(model_sha256 or '')
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, **arrays)  # savez stores members uncompressed, which load_forest relies on
+    os.replace(tmp_path, path)
+    return path
+
+
+def mmap_npz(path, names):
+    # np.load ignores mmap_mode for .npz, but uncompressed members are plain
+    # .npy files at a fixed offset inside the zip, so map them directly.
+    arrays = {}
+    with zipfile.ZipFile(path) as archive, open(path, 'rb') as f:
+        for name in names:
+            info = archive.getinfo(name + '.npy')
+            if info.compress_type != zipfile.ZIP_STORED:
+                raise ValueError(f'{name} is compressed and cannot be memory-mapped')
+            f.seek(info.header_offset)
+            local_header = f.read(30)
+            name_length, extra_length = struct.unpack('<HH', local_header[26:30])
+            f.seek(info.header_offset + 30 + name_length + extra_length)
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+            arrays[name] = np.memmap(path, dtype=dtype, mode='r', offset=f.tell(), shape=shape,
+                                     order='F' if fortran_order else 'C')
+    return arrays
+
+
+class ForestScorer:
+    # Drop-in for the parts of IsolationForest the app uses: predict,
+    # decision_function and score_samples, on the flattened arrays.
+
+    def __init__(self, arrays, path=None):
+        self.path = path
+        # Plain ndarray views (still backed by the mapping): fancy indexing on
+        # np.memmap itself pays subclass overhead on every gather.
+        self.feature = arrays['feature'].view(np.ndarray)
+        self.threshold = arrays['threshold'].view(np.ndarray)
+        self.children = arrays['children'].view(np.ndarray).reshape(-1)
+        self.value = arrays['value'].view(np.ndarray)
+        self.roots = np.asarray(arrays['roots'])
+        self.max_depth = int(arrays['max_depth'])
+        self.n_features_in_ = int(arrays['n_features'])
+        self.path_norm = float(arrays['path_norm'])
+        self.offset_ = float(arrays['offset'])
+        self.model_sha256 = str(arrays['model_sha256'])
+
+    def _mean_path_length(self, X):
+        # scikit-learn's trees compare float32 features against float64 thresholds; do the same.
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        if X.ndim != 2 or X.shape[1] != self.n_features_in_:
+            raise ValueError(f'expected {self.n_features_in_} features, got shape {X.shape}')
+        result = np.empty(len(X), dtype=np.float64)
+        for start in range(0, len(X), SCORE_CHUNK_ROWS):
+            chunk = X[start:start + SCORE_CHUNK_ROWS]
+            flat = chunk.ravel()
+            row_base = (np.arange(len(chunk), dtype=np.intp) * chunk.shape[1])[:, None]
+            nodes = np.broadcast_to(self.roots.astype(np.intp), (len(chunk), len(self.roots)))
+            # All trees and rows step down one level at a time; rows already on a
+            # leaf stay there (leaves are their own children).
+            for _ in range(self.max_depth):
+                go_right = flat[row_base + self.feature[nodes]] > self.threshold[nodes]
+                nodes = self.children[2 * nodes + go_right]
+            result[start:start + len(chunk)] = self.value[nodes].mean(axis=1)
+        return result
+
+    def score_samples(self, X):
+        depths = self._mean_path_length(X)
+        if self.path_norm == 0:  # fitted on a single sample; scikit-learn scores everything 2**-1
+            return np.full(len(depths), -0.5)
+        return -np.power(2.0, -depths / self.path_norm)
+
+    def decision_function(self, X):
+        return self.score_samples(X) - self.offset_
+
+    def predict(self, X):
+        return np.where(self.decision_function(X) < 0, -1, 1)
+
+
+def load_forest(path, mmap=True):
+    """Load a flattened forest; with mmap the big arrays stay in the page cache."""
+    with np.load(path, allow_pickle=False) as data:
+        small = {name: data[name] for name in data.files if name not in _ARRAYS}
+        arrays = dict(small, **(mmap_npz(path, _ARRAYS) if mmap else {name: data[name] for name in _ARRAYS}))
+    if int(arrays['format_version']) != FORMAT_VERSION:
+        raise ValueError(f'unsupported forest format {int(arrays["format_version"])}')
+    return ForestScorer(arrays, path)
+
+
+def verify_against(model, scorer, X, tolerance=1e-9):
+    """Max absolute score difference between model and scorer on X, and whether predictions agree."""
+    expected = model.score_samples(X)
+    actual = scorer.score_samples(X)
+    diff = float(np.max(np.abs(expected - actual))) if len(X) else 0.0
+    same_predictions = bool(np.array_equal(model.predict(X), scorer.predict(X)))
+    return {'max_abs_diff': diff, 'same_predictions': same_predictions, 'ok': diff <= tolerance and same_predictions}
+
+
+def _probe_rows(scorer, n_rows, seed=0):
+    # Random rows spanning every split threshold, so verification exercises both
+    # sides of most nodes without needing real login data.
+    children = scorer.children.reshape(-1, 2)
+    internal = children[:, 0] != np.arange(len(children))
+    low = np.zeros(scorer.n_features_in_)
+    high = np.zeros(scorer.n_features_in_)
+    np.minimum.at(low, scorer.feature[internal], scorer.threshold[internal])
+    np.maximum.at(high, scorer.feature[internal], scorer.threshold[internal])
+    rng = np.random.default_rng(seed)
+    return rng.uniform(low - 1.0, high + 1.0, size=(n_rows, scorer.n_features_in_))
+
+
+def export_model(model_path, verify_rows=10000):
+    """Write the forest for an existing pickled model and check it scores the same.
+
+    The export only replaces model.forest.npz once it matches the pickle.
+    """
+    with open(model_path, 'rb') as f:
+        raw_model = f.read()
+    model = pickle.loads(raw_model)
+    path = forest_path_for(model_path)
+    candidate = save_forest(path + '.candidate', model, hashlib.sha256(raw_model).hexdigest())
+    scorer = load_forest(candidate, mmap=False)
+    result = verify_against(model, scorer, _probe_rows(scorer, verify_rows))
+    if result['ok']:
+        os.replace(candidate, path)
+    else:
+        os.remove(candidate)
+    result.update(path=path, rows=verify_rows)
+    return result
@@ -0,0 +1,348 @@
+# app/ai/ipinfo.py
+# Local IP enrichment: which network (ASN), country and kind of network
+# (private/reserved, datacenter) an address belongs to. No network lookups:
+# `flask build-ipinfo ranges.csv` compiles a CIDR table into sorted, non-
+# overlapping range arrays in <instance>/ipinfo.npz, which every worker
+# memory-maps and answers with a binary search (np.searchsorted).
+#
+# Source CSV, with a header row; more specific networks win over the ones
+# that contain them:
+#
+#   network,asn,country,datacenter
+#   203.0.113.0/24,64500,NL,1
+#   2001:db8::/32,64501,DE,0
+#
+# (start,end columns with first/last addresses can be given instead of network.)
+# IPv6 is indexed by /64, which is as fine as routing data gets.
+#
+# Like the model, the file is re-read when its mtime changes (checked at most
+# every ANOMALY_MODEL_CHECK_INTERVAL seconds) and swapped in as one reference.
+# The model registry checks that the table matches what the model was trained
+# with (see ModelRegistry.ipinfo_problem).
+import csv
+import hashlib
+import ipaddress
+import logging
+import os
+import socket
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime
+
+import numpy as np
+
+from app.ai.forest import mmap_npz
+
+logger = logging.getLogger(__name__)
+
+FORMAT_VERSION = 1
+FAMILIES = ('v4', 'v6')
+_COLUMNS = ('start', 'end', 'asn', 'country', 'flags')
+FLAG_DATACENTER = 1
+
+# is_private, is_datacenter, asn, country; -1 where unknown.
+UNKNOWN_FEATURES = (0.0, 0.0, -1.0, -1.0)
+INVALID_FEATURES = (-1.0, -1.0, -1.0, -1.0)
+
+IPInfo = namedtuple('IPInfo', ['asn', 'country', 'is_private', 'is_datacenter'])
+
+# Private, loopback, link-local, documentation, multicast and reserved space
+# (IANA special-purpose registries). Checked with the same binary search as the
+# range file, because ipaddress's is_global costs ~20us per address.
+_NON_GLOBAL_NETWORKS = {
+    'v4': ['0.0.0.0/8', '10.0.0.0/8', '100.64.0.0/10', '127.0.0.0/8', '169.254.0.0/16', '172.16.0.0/12',
+           '192.0.0.0/24', '192.0.2.0/24', '192.168.0.0/16', '198.18.0.0/15', '198.51.100.0/24',
+           '203.0.113.0/24', '224.0.0.0/3'],
+    'v6': ['::/64', '64:ff9b:1::/48', '100::/64', '2001::/23', '2001:db8::/32', 'fc00::/7',
+           'fe80::/10', 'ff00::/8'],
+}
+_IPV4_MAPPED_PREFIX = bytes(10) + b'\xff\xff'
+_SIX_TO_FOUR_PREFIX = b'\x20\x02'
+
+
+def _parse(ip_address):
+    # (family, key): key is the integer address for IPv4 and the /64 prefix for
+    # IPv6. IPv4 wrapped in IPv6 is unwrapped, as in features.ip_octets.
+    text = (ip_address or '').strip()
+    try:
+        return 'v4', int.from_bytes(socket.inet_pton(socket.AF_INET, text), 'big')
+    except OSError:
+        pass
+    try:
+        packed = socket.inet_pton(socket.AF_INET6, text)
+    except OSError:
+        return None
+    if packed[:12] == _IPV4_MAPPED_PREFIX:
+        return 'v4', int.from_bytes(packed[12:], 'big')
+    if packed[:2] == _SIX_TO_FOUR_PREFIX:
+        return 'v4', int.from_bytes(packed[2:6], 'big')
+    return 'v6', int.from_bytes(packed[:8], 'big')
+
+
+def _key_range(network):
+    network = ipaddress.ip_network(network, strict=False)
+    first, last = int(network.network_address), int(network.broadcast_address)
+    return (first, last) if network.version == 4 else (first >> 64, last >> 64)
+
+
+def _find(table, keys):
+    # Index of the (start, end) range holding each key, or -1.
+    keys = np.asarray(keys, dtype=np.uint64)
+    if table is None or len(table['start']) == 0:
+        return np.full(len(keys), -1)
+    index = np.searchsorted(table['start'], keys, side='right') - 1
+    found = index >= 0
+    found[found] &= keys[found] <= table['end'][index[found]]
+    return np.where(found, index, -1)
+
+
+def _find_one(table, key):
+    # _find for a single key, without the array set-up (a lookup per login).
+    if table is None or len(table['start']) == 0:
+        return -1
+    key = np.uint64(key)
+    index = int(table['start'].searchsorted(key, side='right')) - 1
+    return index if index >= 0 and key <= table['end'][index] else -1
+
+
+_NON_GLOBAL = {
+    family: dict(zip(('start', 'end'), np.asarray(sorted(map(_key_range, networks)), dtype=np.uint64).T))
+    for family, networks in _NON_GLOBAL_NETWORKS.items()
+}
+
+
+def country_code(country):
+    """Two-letter country -> stable small integer (0 when unknown)."""
+    country = (country or '').strip().upper()
+    if len(country) != 2 or not country.isalpha() or not country.isascii():
+        return 0
+    return (ord(country[0]) - 64) * 32 + (ord(country[1]) - 64)
+
+
+def country_name(code):
+    code = int(code)
+    return chr(code // 32 + 64) + chr(code % 32 + 64) if code else None
+
+
+def _flatten(ranges):
+    # Nested/disjoint (start, end, attrs) ranges -> sorted non-overlapping ones,
+    # the innermost range winning where they nest.
+    out = []
+    stack = []
+    cursor = 0
+
+    def emit(low, high, attrs):
+        if low <= high:
+            out.append((low, high) + attrs)
+
+    for start, end, attrs in sorted(ranges, key=lambda r: (r[0], -r[1])):
+        while stack and stack[-1][1] < start:
+            _, top_end, top_attrs = stack.pop()
+            emit(cursor, top_end, top_attrs)
+            cursor = max(cursor, top_end + 1)
+        if stack:
+            emit(cursor, start - 1, stack[-1][2])
+        stack.append((start, end, attrs))
+        cursor = start
+    while stack:
+        _, top_end, top_attrs = stack.pop()
+        emit(cursor, top_end, top_attrs)
+        cursor = max(cursor, top_end + 1)
+    return out
+
+
+def _read_ranges(source_path):
+    ranges = {family: [] for family in FAMILIES}
+    with open(source_path, newline='') as f:
+        for line_number, row in enumerate(csv.DictReader(f), start=2):
+            try:
+                if row.get('network'):
+                    network = ipaddress.ip_network(row['network'].strip(), strict=False)
+                    first, last = network.network_address, network.broadcast_address
+                else:
+                    first = ipaddress.ip_address(row['start'].strip())
+                    last = ipaddress.ip_address(row['end'].strip())
+                    if first.version != last.version or last < first:
+                        raise ValueError('start and end do not form a range')
+                asn = int(row.get('asn') or 0)
+            except (KeyError, AttributeError, ValueError) as e:
+                raise ValueError(f'{source_path}:{line_number}: {e}') from None
+            flags = FLAG_DATACENTER if (row.get('datacenter') or '').strip().lower() in ('1', 'true', 'yes') else 0
+            attrs = (asn, country_code(row.get('country')), flags)
+            if first.version == 4:
+                ranges['v4'].append((int(first), int(last), attrs))
+            else:
+                ranges['v6'].append((int(first) >> 64, int(last) >> 64, attrs))
+    return ranges
+
+
+def build_ip_ranges(source_path, output_path):
+    """Compile a CIDR CSV into the range file IPRangeDB loads. Returns row counts."""
+    with open(source_path, 'rb') as f:
+        source_sha256 = hashlib.sha256(f.read()).hexdigest()
+    arrays = {}
+    counts = {}
+    for family, ranges in _read_ranges(source_path).items():
+        flat = _flatten(ranges)
+        counts[family] = len(flat)
+        columns = list(zip(*flat)) if flat else [()] * len(_COLUMNS)
+        arrays[f'{family}_start'] = np.asarray(columns[0], dtype=np.uint64)
+        arrays[f'{family}_end'] = np.asarray(columns[1], dtype=np.uint64)
+        arrays[f'{family}_asn'] = np.asarray(columns[2], dtype=np.uint32)
+        arrays[f'{family}_country'] = np.asarray(columns[3], dtype=np.uint16)
+        arrays[f'{family}_flags'] = np.asarray(columns[4], dtype=np.uint8)
+    arrays['format_version'] = np.asarray(FORMAT_VERSION)
+    arrays['source_sha256'] = np.asarray(source_sha256)
+    arrays['built_at'] = np.asarray(datetime.utcnow().isoformat(timespec='seconds') + 'Z')
+
+    tmp_path = output_path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, **arrays)  # uncompressed, so the range arrays can be memory-mapped
+    os.replace(tmp_path, output_path)
+    return counts
+
+
+class IPRangeDB:
+    # Read-only view of a compiled range file. Without one every lookup is
+    # "unknown" (private/reserved addresses are still recognised).
+
+    def __init__(self, path=None, check_interval=5.0):
+        self.path = path
+        self.check_interval = check_interval
+        # (tables, meta, file signature), swapped as one reference on reload.
+        self._state = ({}, {}, None)
+        self._next_check = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def available(self):
+        return bool(self._state[0])
+
+    @property
+    def source_sha256(self):
+        """Hash of the CSV the loaded table was built from, or None."""
+        return self._state[1].get('source_sha256')
+
+    def init_app(self, app):
+        self.check_interval = float(app.config.get('ANOMALY_MODEL_CHECK_INTERVAL', self.check_interval))
+        self.load(app.config.get('IPINFO_PATH') or os.path.join(app.instance_path, 'ipinfo.npz'))
+        app.extensions['ipinfo'] = self
+
+    def load(self, path):
+        self.path = path
+        self._next_check = time.monotonic() + self.check_interval
+        if not os.path.exists(path):
+            logger.info("No IP range file at %s; ASN/country enrichment disabled", path)
+            self._state = ({}, {}, None)
+            return
+        state = self._read(path)
+        self._state = state if state is not None else ({}, {}, None)
+
+    def _read(self, path):
+        # New (tables, meta, signature), or None if the file can't be used.
+        try:
+            stat = os.stat(path)
+            with np.load(path, allow_pickle=False) as data:
+                if int(data['format_version']) != FORMAT_VERSION:
+                    raise ValueError(f"unsupported format {int(data['format_version'])}")
+                meta = {'source_sha256': str(data['source_sha256']), 'built_at': str(data['built_at'])}
+            arrays = mmap_npz(path, [f'{family}_{column}' for family in FAMILIES for column in _COLUMNS])
+        except Exception as e:
+            # Enrichment is optional; a bad file must not stop the app from booting.
+            logger.error("Could not load IP ranges from %s: %s", path, e)
+            return None
+        tables = {
+            family: {column: arrays[f'{family}_{column}'].view(np.ndarray) for column in _COLUMNS}
+            for family in FAMILIES
+        }
+        return tables, meta, (stat.st_mtime_ns, stat.st_size)
+
+    def refresh(self):
+        """Re-read the file if its mtime or size changed. Returns True if a new table was loaded."""
+        with self._lock:
+            now = time.monotonic()
+            if now < self._next_check:
+                return False
+            self._next_check = now + self.check_interval
+            try:
+                stat = os.stat(self.path)
+            except (OSError, TypeError):
+                return False  # missing (e.g. mid-deploy): keep what we have
+            if (stat.st_mtime_ns, stat.st_size) == self._state[2]:
+                return False
+            state = self._read(self.path)
+            if state is None:
+                return False  # half-written or broken: keep the old table
+            self._state = state
+        logger.info("Loaded IP ranges %s", self.path, extra={'source_sha256': self.source_sha256})
+        return True
+
+    def _check(self):
+        if time.monotonic() >= self._next_check:
+            self.refresh()
+
+    def lookup(self, ip_address):
+        """IPInfo for one address, or None if it isn't a valid IP."""
+        self._check()
+        parsed = _parse(ip_address)
+        if parsed is None:
+            return None
+        family, key = parsed
+        table = self._state[0].get(family)  # one table throughout, even if a reload swaps it
+        index = _find_one(table, key)
+        is_private = _find_one(_NON_GLOBAL[family], key) >= 0
+        if index < 0:
+            return IPInfo(None, None, is_private, False)
+        return IPInfo(int(table['asn'][index]) or None, country_name(table['country'][index]),
+                      is_private, bool(table['flags'][index] & FLAG_DATACENTER))
+
+    def features(self, ip_address):
+        """(is_private, is_datacenter, asn, country) as floats, for the feature encoder."""
+        info = self.lookup(ip_address)
+        if info is None:
+            return INVALID_FEATURES
+        return (float(info.is_private), float(info.is_datacenter),
+                float(info.asn or -1), float(country_code(info.country) or -1))
+
+    def features_many(self, ip_addresses):
+        """features() for many addresses, shaped (n, 4); one binary search per family."""
+        self._check()
+        tables = self._state[0]
+        result = np.tile(np.asarray(INVALID_FEATURES), (len(ip_addresses), 1))
+        positions = {family: [] for family in FAMILIES}
+        keys = {family: [] for family in FAMILIES}
+        for i, ip_address in enumerate(ip_addresses):
+            parsed = _parse(ip_address)
+            if parsed is None:
+                continue
+            family, key = parsed
+            result[i] = UNKNOWN_FEATURES
+            positions[family].append(i)
+            keys[family].append(key)
+        for family in FAMILIES:
+            if not positions[family]:
+                continue
+            rows = np.asarray(positions[family])
+            result[rows, 0] = _find(_NON_GLOBAL[family], keys[family]) >= 0
+            table = tables.get(family)
+            if table is None:
+                continue
+            index = _find(table, keys[family])
+            hit = index >= 0
+            rows, index = rows[hit], index[hit]
+            result[rows, 1] = (table['flags'][index] & FLAG_DATACENTER) > 0
+            asn = table['asn'][index].astype(np.float64)
+            result[rows, 2] = np.where(asn > 0, asn, -1.0)
+            country = table['country'][index].astype(np.float64)
+            result[rows, 3] = np.where(country > 0, country, -1.0)
+        return result
+
+    def info(self):
+        tables, meta, _ = self._state
+        return dict(meta, path=self.path, available=bool(tables),
+                    ranges={family: len(table['start']) for family, table in tables.items()})
+
+
+# Process-wide range table, configured by create_app() like the other extensions.
+ip_ranges = IPRangeDB()
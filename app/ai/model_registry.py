@@ -0,0 +1,237 @@
+# app/ai/model_registry.py
+# Keeps the anomaly model (and its feature encoder) in memory for the lifetime
+# of a worker process. The files are only re-read when their mtime changes AND
+# their content hash differs from what we already hold, and the swap is a single
+# reference assignment so requests that already grabbed a model keep using it.
+#
+# When a flattened forest (model.forest.npz, see app/ai/forest.py) sits next to
+# model.pkl it is loaded instead: memory-mapped, no unpickling and no
+# scikit-learn import. ANOMALY_MODEL_FORMAT=pickle turns that off, =forest
+# makes it mandatory.
+#
+# A model trained with network features (encoder.use_ipinfo) is refused while
+# no IP range table is loaded, since every address would encode as unknown.
+# If the table differs from the one recorded in the model's metadata, the
+# mismatch is logged and reported by info() until the two agree again.
+#
+# The model shipped in app/ai/model/ is trained on a handful of made-up rows
+# (train_model.train_and_save_model). Its metadata says so, and it is loaded
+# observe-only: it still scores, but flags nothing until `flask train-model`
+# publishes a model trained on real activity.
+import logging
+import hashlib
+import json
+import os
+import pickle
+import threading
+import time
+from collections import namedtuple
+
+from app.ai.features import FeatureEncoder, encoder_path_for
+from app.ai.forest import forest_path_for, load_forest
+from app.ai.ipinfo import ip_ranges
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'model', 'model.pkl')
+# metadata['source'] of a model trained on generate_dummy_data().
+DUMMY_SOURCE = 'dummy_data'
+
+# An immutable snapshot of one loaded artifact. Never mutated after creation;
+# a reload builds a new one and swaps it in.
+LoadedModel = namedtuple('LoadedModel', [
+    'model',         # the estimator: a ForestScorer or the unpickled IsolationForest
+    'encoder',       # FeatureEncoder saved next to the model
+    'path',          # model file it was loaded from
+    'version',       # short content hash, identical across workers for the same files
+    'sha256',        # full content hash of model + encoder
+    'signature',     # (mtime_ns, size) of each file at load time
+    'loaded_at',     # wall-clock time the load finished
+    'load_seconds',  # how long reading + unpickling took
+    'format',        # 'forest' or 'pickle'
+    'ipinfo_sha256', # source hash of the IP range table it was trained with, if recorded
+    'observe_only',  # scores are computed but never turned into flags (dummy-trained model)
+])
+
+
+def _read_metadata(model_path):
+    # The <model>.meta.json written next to the model by train_model, or {}.
+    try:
+        with open(os.path.splitext(model_path)[0] + '.meta.json') as f:
+            metadata = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return metadata if isinstance(metadata, dict) else {}
+
+
+class ModelRegistry:
+    def __init__(self, path=None, check_interval=5.0, model_format='auto'):
+        self.path = path or DEFAULT_MODEL_PATH
+        # 'auto' (forest if present), 'forest' or 'pickle'.
+        self.model_format = model_format
+        # Minimum number of seconds between two stat() checks of the model files.
+        self.check_interval = check_interval
+        self._current = None
+        self._next_check = 0.0
+        self._lock = threading.Lock()
+        # (model sha256, table hash) last checked by _check_ipinfo, and what it found.
+        self._ipinfo_checked = None
+        self._ipinfo_problem = None
+
+    def init_app(self, app):
+        self.path = app.config.get('ANOMALY_MODEL_PATH') or self.path
+        self.check_interval = float(app.config.get('ANOMALY_MODEL_CHECK_INTERVAL', self.check_interval))
+        self.model_format = app.config.get('ANOMALY_MODEL_FORMAT') or self.model_format
+        # Drop anything loaded from a previous configuration.
+        self._current = None
+        self._next_check = 0.0
+        app.extensions['model_registry'] = self
+        if app.config.get('ANOMALY_MODEL_PRELOAD'):
+            try:
+                self.get()
+            except Exception as e:
+                # A missing/corrupt model must not stop the app from booting;
+                # detect_anomaly already degrades to "not suspicious".
+                logger.error("Preload of %s failed: %s", self.path, e)
+
+    def get(self):
+        """Return the current LoadedModel, reloading it first if the file changed."""
+        current = self._current
+        if current is None or time.monotonic() >= self._next_check:
+            current = self._refresh()
+        if self._ipinfo_checked != (current.sha256, ip_ranges.source_sha256):
+            self._check_ipinfo(current)
+        return current
+
+    @staticmethod
+    def ipinfo_problem(loaded):
+        """Why the loaded IP range table doesn't suit this model, or None."""
+        if not loaded.encoder.use_ipinfo:
+            return None
+        if not ip_ranges.available:
+            return 'the model uses network features but no IP range file is loaded'
+        if loaded.ipinfo_sha256 and loaded.ipinfo_sha256 != ip_ranges.source_sha256:
+            return (f'the model was trained with IP ranges {loaded.ipinfo_sha256[:12]} '
+                    f'but {(ip_ranges.source_sha256 or "?")[:12]} is loaded')
+        return None
+
+    def _check_ipinfo(self, loaded):
+        # Runs when the model or the range table changes, not on every call.
+        self._ipinfo_checked = (loaded.sha256, ip_ranges.source_sha256)
+        problem = self.ipinfo_problem(loaded)
+        if problem and problem != self._ipinfo_problem:
+            logger.error("Model %s: %s; network features will be skewed", loaded.version, problem)
+        self._ipinfo_problem = problem
+
+    def reload(self):
+        """Force a stat/hash check right now, regardless of check_interval."""
+        self._next_check = 0.0
+        return self._refresh()
+
+    def info(self):
+        """Describe the loaded model so operators can compare workers."""
+        current = self._current
+        if current is None:
+            return {'loaded': False, 'path': self.path, 'pid': os.getpid()}
+        return {
+            'loaded': True,
+            'path': current.path,
+            'format': current.format,
+            'version': current.version,
+            'sha256': current.sha256,
+            'loaded_at': current.loaded_at,
+            'load_seconds': round(current.load_seconds, 6),
+            'ipinfo_problem': self.ipinfo_problem(current),
+            'observe_only': current.observe_only,
+            'pid': os.getpid(),
+        }
+
+    def _refresh(self):
+        with self._lock:
+            current = self._current
+            now = time.monotonic()
+            # Another thread may have refreshed while we waited for the lock.
+            if current is not None and now < self._next_check:
+                return current
+            self._next_check = now + self.check_interval
+
+            encoder_path = encoder_path_for(self.path)
+            forest_path = forest_path_for(self.path)
+            use_forest = self.model_format == 'forest' or (
+                self.model_format != 'pickle' and os.path.exists(forest_path))
+            try:
+                signature = tuple(
+                    (stat.st_mtime_ns, stat.st_size)
+                    for stat in (os.stat(forest_path if use_forest else self.path), os.stat(encoder_path))
+                )
+            except OSError:
+                if current is None:
+                    raise
+                # File temporarily missing (e.g. mid-deploy): keep serving the old model.
+                return current
+
+            if current is not None and signature == current.signature:
+                return current
+
+            try:
+                started = time.perf_counter()
+                with open(encoder_path, 'rb') as f:
+                    raw_encoder = f.read()
+                encoder = FeatureEncoder.loads(raw_encoder)
+                forest = None
+                if use_forest:
+                    # Only maps the file; the arrays are paged in as they are used.
+                    forest = load_forest(forest_path)
+                    if encoder.model_sha256 and forest.model_sha256 != encoder.model_sha256:
+                        if self.model_format == 'forest':
+                            raise ValueError('forest and encoder files do not belong together')
+                        # Stale export (or mid-publish): the pickle is still authoritative.
+                        logger.warning("%s does not match the encoder, loading %s instead", forest_path, self.path)
+                        forest = None
+                with open(self.path if forest is None else forest_path, 'rb') as f:
+                    raw_model = f.read()
+                digest = hashlib.sha256(raw_model + raw_encoder).hexdigest()
+                metadata = _read_metadata(self.path)
+                if current is not None and digest == current.sha256:
+                    # Touched but not changed: remember the new mtime so we don't hash it again.
+                    self._current = current._replace(signature=signature)
+                    return self._current
+                if forest is None and encoder.model_sha256 and \
+                        encoder.model_sha256 != hashlib.sha256(raw_model).hexdigest():
+                    # Caught between the encoder and model renames of a publish; try again next check.
+                    raise ValueError('model and encoder files do not belong together')
+                loaded = LoadedModel(
+                    model=forest if forest is not None else pickle.loads(raw_model),
+                    encoder=encoder,
+                    path=self.path,
+                    version=digest[:12],
+                    sha256=digest,
+                    signature=signature,
+                    loaded_at=time.time(),
+                    load_seconds=time.perf_counter() - started,
+                    format='pickle' if forest is None else 'forest',
+                    ipinfo_sha256=(metadata.get('ipinfo') or {}).get('source_sha256'),
+                    observe_only=metadata.get('source') == DUMMY_SOURCE,
+                )
+                if loaded.encoder.use_ipinfo and not ip_ranges.available:
+                    # Every address would encode as "unknown": refuse it like a broken file.
+                    raise ValueError(self.ipinfo_problem(loaded))
+            except Exception as e:
+                if current is None:
+                    raise
+                # A half-written or broken file must not take down a working model.
+                logger.error("Reload of %s failed (%s), keeping version %s", self.path, e, current.version)
+                return current
+
+            # Single reference assignment: in-flight requests keep the object they already hold.
+            self._current = loaded
+            logger.info("Loaded model %s", self.path, extra={
+                'version': loaded.version, 'format': loaded.format, 'load_ms': round(loaded.load_seconds * 1000, 1), 'pid': os.getpid()})
+            if loaded.observe_only:
+                logger.warning("Model %s was trained on dummy data and flags nothing; "
+                               "run `flask train-model` to train one on real logins", loaded.version)
+            return loaded
+
+
+# Process-wide registry, configured by create_app() like the other extensions.
+model_registry = ModelRegistry()
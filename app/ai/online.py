@@ -0,0 +1,411 @@
+# app/ai/online.py
+# Streaming anomaly detector that keeps learning from live logins, next to the
+# IsolationForest, which only changes when someone retrains it. New users and
+# new office IP ranges stop looking anomalous once they become common, with no
+# batch retrain.
+#
+# The model is Half-Space Trees (Tan, Ting & Liu, 2011): a fixed ensemble of
+# random full binary trees over a fixed feature box. Each node counts the logins
+# that fell into it during the previous window (reference mass) and the current
+# one (latest mass); when a window fills up, latest becomes reference. A login
+# is scored by how much reference mass its region held, scaled by depth, so
+# memory is constant (trees x 2^depth counters) and the model tracks drift
+# within two windows.
+#
+# The score is a relative density whose scale depends on the random trees and
+# on how concentrated the traffic is, so there is no fixed cut-off. Instead a
+# login is flagged when it scores below the ANOMALY_ONLINE_QUANTILE quantile of
+# the scores of the previous window's logins: roughly that share of logins is
+# flagged, and they are the ones in the sparsest regions.
+#
+# Every scored login is also learnt. Each process keeps its own copy and writes
+# it to ANOMALY_ONLINE_PATH every ANOMALY_ONLINE_CHECKPOINT_SECONDS and at exit;
+# a process starts from the newest checkpoint. With several web workers the
+# last writer wins, which is harmless since they all see the same traffic mix
+# (the login-event-worker is a single consumer and has no such overlap).
+#
+# ANOMALY_ONLINE_MODE decides what the verdicts are used for:
+#   off      - not run
+#   observe  - scored and learnt, but the IsolationForest verdict stands
+#   confirm  - an IsolationForest flag only counts if the online model agrees
+#   replace  - the online verdict is used instead (once it has a threshold)
+import atexit
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+
+from app.ai.features import NEW_USER_PROFILE, PROFILE_FEATURE_NAMES, ip_octets
+from app.ai.ipinfo import ip_ranges
+from app.metrics import ERRORS
+
+logger = logging.getLogger(__name__)
+
+FORMAT_VERSION = 1
+MODES = ('off', 'observe', 'confirm', 'replace')
+
+# The last octet is left out: host numbers inside a network carry no signal and
+# would only spend splits.
+ONLINE_FEATURE_NAMES = (['ip_octet1', 'ip_octet2', 'ip_octet3', 'hour_of_day'] + PROFILE_FEATURE_NAMES
+                        + ['ip_private', 'ip_datacenter', 'ip_country'])
+# Fixed [low, high] box per feature; values are scaled into [0, 1] and clipped.
+# Unknown values (-1) clip to 0.
+_LOW = np.array([0, 0, 0, 0, 0, 0, 0, -1, 0, 0, 0, 0, 0], dtype=np.float64)
+_HIGH = np.array([255, 255, 255, 24,
+                  1, 1, 1, np.log1p(365 * 86400.0), np.log1p(1e5), 20,
+                  1, 1, 26 * 32 + 26], dtype=np.float64)
+
+
+def online_features(ip_addresses, timestamps, profiles=None):
+    """Feature matrix for the online model, scaled to [0, 1] and shaped (n, 13)."""
+    if profiles is None:
+        profiles = [NEW_USER_PROFILE] * len(ip_addresses)
+    rows = [ip_octets(ip)[:3] + (when.hour + when.minute / 60.0,) + tuple(profile or NEW_USER_PROFILE)
+            for ip, when, profile in zip(ip_addresses, timestamps, profiles)]
+    if not rows:
+        return np.empty((0, len(ONLINE_FEATURE_NAMES)))
+    network = ip_ranges.features_many(list(ip_addresses))  # private, datacenter, asn, country
+    X = np.hstack([np.array(rows, dtype=np.float64), network[:, [0, 1, 3]]])
+    return np.clip((X - _LOW) / (_HIGH - _LOW), 0.0, 1.0)
+
+
+class HalfSpaceTrees:
+    # Trees are complete and stored implicitly: node i has children 2i+1 and
+    # 2i+2, so a tree is just its split feature/value per internal node and two
+    # mass counters per node.
+
+    def __init__(self, n_features, n_trees=25, depth=10, window_size=1000, seed=None):
+        self.n_features = n_features
+        self.n_trees = n_trees
+        self.depth = depth
+        self.window_size = window_size
+        # Below this reference mass a node is too sparse to refine the estimate.
+        self.size_limit = 0.1 * window_size
+        n_internal = 2 ** depth - 1
+        n_nodes = 2 ** (depth + 1) - 1
+        self.feature = np.zeros((n_trees, n_internal), dtype=np.int16)
+        self.split = np.zeros((n_trees, n_internal), dtype=np.float64)
+        self.reference = np.zeros((n_trees, n_nodes), dtype=np.int32)
+        self.latest = np.zeros((n_trees, n_nodes), dtype=np.int32)
+        self.window_count = 0   # logins learnt in the current window
+        self.windows = 0        # completed windows
+        self.seen = 0
+        # Scores of the current window's logins, and those of the last full
+        # window that had a reference (sorted), which sets the threshold.
+        self.window_scores = np.full(window_size, np.nan)
+        self.calibration = np.empty(0)
+        if seed is not False:
+            self._build(np.random.default_rng(seed))
+
+    def _build(self, rng):
+        for tree in range(self.n_trees):
+            # Random work space per tree: each dimension's [0, 1] range sits
+            # somewhere inside a box twice its size (Tan et al., section 3).
+            centre = rng.uniform(size=self.n_features)
+            half = 2.0 * np.maximum(centre, 1.0 - centre)
+            low = np.empty((2 ** self.depth - 1, self.n_features))
+            high = np.empty_like(low)
+            low[0], high[0] = centre - half, centre + half
+            for node in range(2 ** self.depth - 1):
+                dim = rng.integers(self.n_features)
+                mid = (low[node, dim] + high[node, dim]) / 2.0
+                self.feature[tree, node] = dim
+                self.split[tree, node] = mid
+                for child, child_low, child_high in ((2 * node + 1, low[node, dim], mid),
+                                                     (2 * node + 2, mid, high[node, dim])):
+                    if child < len(low):
+                        low[child], high[child] = low[node], high[node]
+                        low[child, dim], high[child, dim] = child_low, child_high
+
+    @property
+    def ready(self):
+        return self.windows > 0
+
+    def threshold(self, quantile):
+        """The given quantile of the last calibrated window's scores, NaN until there is one."""
+        if not len(self.calibration):
+            return np.nan
+        return float(self.calibration[int(quantile * (len(self.calibration) - 1))])
+
+    def _paths(self, X):
+        # Node index at every depth, shaped (rows, trees, depth + 1). Gathers go
+        # through flat indices: much cheaper than 2-D fancy indexing for the
+        # one-login batches of inline mode.
+        flat = np.ascontiguousarray(X).ravel()
+        row_base = (np.arange(len(X)) * X.shape[1])[:, None]
+        tree_base = np.arange(self.n_trees) * self.feature.shape[1]
+        feature, split = self.feature.ravel(), self.split.ravel()
+        paths = np.zeros((len(X), self.n_trees, self.depth + 1), dtype=np.intp)
+        nodes = paths[:, :, 0]
+        for level in range(self.depth):
+            index = tree_base + nodes
+            go_right = flat[row_base + feature[index]] >= split[index]
+            nodes = 2 * nodes + 1 + go_right
+            paths[:, :, level + 1] = nodes
+        return paths
+
+    def _node_index(self, paths):
+        # paths -> indices into the flattened (trees, nodes) mass arrays.
+        return (np.arange(self.n_trees) * self.reference.shape[1])[:, None] + paths
+
+    def _density(self, paths):
+        # Reference mass of the first node on each path holding fewer than
+        # size_limit logins, times 2^level, over the window size; combined as a
+        # geometric mean over trees (+1 keeps empty nodes finite), so a region
+        # that is empty in a few trees isn't averaged away by the dense ones.
+        mass = self.reference.ravel()[self._node_index(paths)]
+        sparse = mass < self.size_limit
+        sparse[..., -1] = True
+        level = sparse.argmax(axis=2)
+        node_mass = np.take_along_axis(mass, level[..., None], axis=2)[..., 0]
+        return np.exp((np.log1p(node_mass) + level * np.log(2.0)).mean(axis=1)) / self.window_size
+
+    def _learn(self, paths):
+        index = self._node_index(paths)
+        latest = self.latest.ravel()  # a view: updates land in self.latest
+        if len(paths) == 1:
+            latest[index] += 1  # one path per tree: no repeated nodes
+        else:
+            latest += np.bincount(index.ravel(), minlength=latest.size).astype(np.int32)
+
+    def score(self, X):
+        """Density of each row's region in the reference window (low = anomalous), NaN before the first window."""
+        if not self.ready:
+            return np.full(len(X), np.nan)
+        return self._density(self._paths(np.asarray(X, dtype=np.float64)))
+
+    def score_learn(self, X):
+        """Score each row against the reference window, then learn it. Rows are taken in order."""
+        X = np.asarray(X, dtype=np.float64)
+        scores = np.full(len(X), np.nan)
+        start = 0
+        while start < len(X):
+            # Never let a chunk straddle a window boundary.
+            stop = start + min(len(X) - start, self.window_size - self.window_count)
+            paths = self._paths(X[start:stop])
+            if self.ready:
+                scores[start:stop] = self._density(paths)
+                self.window_scores[self.window_count:self.window_count + stop - start] = scores[start:stop]
+            self._learn(paths)
+            self.window_count += stop - start
+            self.seen += stop - start
+            if self.window_count >= self.window_size:
+                self.reference, self.latest = self.latest, np.zeros_like(self.latest)
+                scored = self.window_scores[~np.isnan(self.window_scores)]
+                if len(scored):
+                    self.calibration = np.sort(scored)
+                self.window_scores = np.full(self.window_size, np.nan)
+                self.window_count = 0
+                self.windows += 1
+            start = stop
+        return scores
+
+    def state(self):
+        return {
+            'format_version': np.asarray(FORMAT_VERSION),
+            'params': np.asarray([self.n_features, self.n_trees, self.depth, self.window_size]),
+            'counters': np.asarray([self.window_count, self.windows, self.seen]),
+            'feature': self.feature, 'split': self.split,
+            'reference': self.reference.copy(), 'latest': self.latest.copy(),
+            'window_scores': self.window_scores.copy(), 'calibration': self.calibration.copy(),
+        }
+
+    @classmethod
+    def from_state(cls, state):
+        if int(state['format_version']) != FORMAT_VERSION:
+            raise ValueError(f"unsupported online model format {int(state['format_version'])}")
+        n_features, n_trees, depth, window_size = (int(v) for v in state['params'])
+        model = cls(n_features, n_trees, depth, window_size, seed=False)
+        model.window_count, model.windows, model.seen = (int(v) for v in state['counters'])
+        for name in ('feature', 'split', 'reference', 'latest'):
+            setattr(model, name, np.array(state[name], dtype=getattr(model, name).dtype))
+        # Older checkpoints have no scores: the threshold is set after the next window.
+        for name in ('window_scores', 'calibration'):
+            if name in state:
+                setattr(model, name, np.array(state[name], dtype=np.float64))
+        return model
+
+
+def save_checkpoint(path, state):
+    # Workers checkpoint to the same path: give each writer its own temp file.
+    tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, **state)
+    os.replace(tmp_path, path)
+
+
+def load_checkpoint(path):
+    with np.load(path, allow_pickle=False) as data:
+        return HalfSpaceTrees.from_state({name: data[name] for name in data.files})
+
+
+class OnlineDetector:
+    # Process-wide wrapper: loads the checkpoint on first use in each process
+    # (so forked workers start from disk, not from the master's copy), scores
+    # and learns under a lock, and checkpoints on a timer and at exit.
+
+    def __init__(self):
+        self.mode = 'off'
+        self.path = None
+        self.n_trees = 25
+        self.depth = 10
+        self.window_size = 1000
+        self.quantile = 0.02
+        self.checkpoint_interval = 300.0
+        self._model = None
+        self._pid = None
+        self._next_checkpoint = 0.0
+        self._lock = threading.Lock()
+        self.counters = {'scored': 0, 'flagged': 0, 'checkpoints': 0}
+
+    def init_app(self, app):
+        config = app.config
+        self.mode = config.get('ANOMALY_ONLINE_MODE') or 'off'
+        if self.mode not in MODES:
+            raise ValueError(f"ANOMALY_ONLINE_MODE must be one of {', '.join(MODES)}, not {self.mode!r}")
+        self.path = config.get('ANOMALY_ONLINE_PATH') or os.path.join(app.instance_path, 'online_model.npz')
+        self.n_trees = int(config.get('ANOMALY_ONLINE_TREES', 25))
+        self.depth = int(config.get('ANOMALY_ONLINE_DEPTH', 10))
+        self.window_size = int(config.get('ANOMALY_ONLINE_WINDOW', 1000))
+        self.quantile = float(config.get('ANOMALY_ONLINE_QUANTILE', 0.02))
+        if not 0.0 < self.quantile < 1.0:
+            raise ValueError(f'ANOMALY_ONLINE_QUANTILE must be between 0 and 1, not {self.quantile}')
+        self.checkpoint_interval = float(config.get('ANOMALY_ONLINE_CHECKPOINT_SECONDS', 300))
+        self._model = None
+        self._pid = None
+        app.extensions['online_detector'] = self
+
+    @property
+    def enabled(self):
+        return self.mode != 'off'
+
+    def _get_model(self):
+        # Called with the lock held.
+        if self._model is not None and self._pid == os.getpid():
+            return self._model
+        model = None
+        if os.path.exists(self.path):
+            try:
+                model = load_checkpoint(self.path)
+                if (model.n_features, model.n_trees, model.depth, model.window_size) != \
+                        (len(ONLINE_FEATURE_NAMES), self.n_trees, self.depth, self.window_size):
+                    logger.warning("Online model checkpoint %s has different parameters; starting over", self.path)
+                    model = None
+            except Exception as e:
+                logger.error("Could not load online model from %s: %s", self.path, e)
+                model = None
+        if model is None:
+            model = HalfSpaceTrees(len(ONLINE_FEATURE_NAMES), self.n_trees, self.depth, self.window_size)
+        if self._pid != os.getpid():
+            atexit.register(self.checkpoint)
+        self._model = model
+        self._pid = os.getpid()
+        self._next_checkpoint = time.monotonic() + self.checkpoint_interval
+        return model
+
+    def load(self):
+        """This process's model, read from the checkpoint (or built empty) on first use."""
+        with self._lock:
+            return self._get_model()
+
+    def score_learn(self, ip_addresses, timestamps, profiles=None):
+        """Score logins (in time order) and learn them. Returns (flags, scores), or None when off.
+
+        scores are NaN, and flags False, until the model has a threshold: the
+        first window has no reference and the second one sets the threshold.
+        """
+        if not self.enabled:
+            return None
+        X = online_features(ip_addresses, timestamps, profiles)
+        with self._lock:
+            model = self._get_model()
+            # Set by the last full window; a batch crossing into the next one keeps it.
+            threshold = model.threshold(self.quantile)
+            scores = model.score_learn(X)
+            if np.isnan(threshold):
+                scores[:] = np.nan
+            flags = scores < threshold  # NaN compares False
+            self.counters['scored'] += int(np.count_nonzero(~np.isnan(scores)))
+            self.counters['flagged'] += int(np.count_nonzero(flags))
+            due = time.monotonic() >= self._next_checkpoint
+        if due:
+            self.checkpoint()
+        return flags, scores
+
+    def combine(self, flags, online):
+        """Apply ANOMALY_ONLINE_MODE to the IsolationForest flags."""
+        if online is None or self.mode == 'observe':
+            return flags
+        online_flags, scores = online
+        ready = ~np.isnan(scores)
+        if self.mode == 'confirm':
+            return np.where(ready, flags & online_flags, flags)
+        return np.where(ready, online_flags, flags)
+
+    def checkpoint(self):
+        """Write the model to ANOMALY_ONLINE_PATH (atomically). Never raises."""
+        with self._lock:
+            if self._model is None or self._pid != os.getpid():
+                return
+            state = self._model.state()
+            self._next_checkpoint = time.monotonic() + self.checkpoint_interval
+        try:
+            save_checkpoint(self.path, state)
+            with self._lock:
+                self.counters['checkpoints'] += 1
+        except Exception:
+            logger.exception("Could not checkpoint the online model to %s", self.path)
+            ERRORS.inc(component='online_detector')
+
+    def reset(self):
+        """Forget everything learnt and remove the checkpoint."""
+        with self._lock:
+            self._model = HalfSpaceTrees(len(ONLINE_FEATURE_NAMES), self.n_trees, self.depth, self.window_size)
+            self._pid = os.getpid()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def replay(self, since_days=7, chunk_size=10000):
+        """Start over and learn the last since_days of LoginActivity, in time order, then checkpoint.
+
+        Profiles are rebuilt from the replayed rows only, so users look newer
+        than they are for the first logins of the replay. Returns the row count.
+        """
+        from datetime import datetime, timedelta
+        from sqlalchemy import select
+        from app import db
+        from app.ai.features import replay_profiles
+        from app.models import LoginActivity
+
+        self.reset()
+        states = {}
+        rows = 0
+        result = db.session.execute(
+            select(LoginActivity.username, LoginActivity.ip_address, LoginActivity.timestamp)
+            .where(LoginActivity.timestamp >= datetime.utcnow() - timedelta(days=since_days))
+            .order_by(LoginActivity.timestamp, LoginActivity.id)
+            .execution_options(stream_results=True, yield_per=chunk_size)
+        )
+        for partition in result.partitions(chunk_size):
+            profiles = replay_profiles(partition, states)
+            _, ips, timestamps = zip(*partition)
+            X = online_features(ips, timestamps, profiles)
+            with self._lock:
+                self._get_model().score_learn(X)
+            rows += len(partition)
+        result.close()
+        self.checkpoint()
+        return rows
+
+    def info(self):
+        model = self._model if self._pid == os.getpid() else None
+        info = dict(self.counters, mode=self.mode, path=self.path, quantile=self.quantile, loaded=model is not None)
+        if model is not None:
+            info.update(ready=model.ready, threshold=model.threshold(self.quantile), windows=model.windows, window_size=model.window_size,
+                        window_count=model.window_count, seen=model.seen, trees=model.n_trees, depth=model.depth)
+        return info
+
+
+online_detector = OnlineDetector()
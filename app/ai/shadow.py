@@ -0,0 +1,240 @@
+# app/ai/shadow.py
+# Shadow models: candidate models that score the same live logins as the
+# primary one without affecting any verdict. The request path only hands the
+# logins it already scored (inputs plus the primary model's decision scores) to
+# a bounded in-memory queue; a daemon thread in each worker loads any profiles
+# a shadow needs that the primary model didn't, scores the logins with
+# every shadow model and writes one compact ShadowVerdict row per login and
+# shadow. `flask shadow-report` then compares alert rates and disagreement
+# before a candidate is published as model.pkl.
+#
+# Configure with ANOMALY_SHADOW_MODELS="name=path/to/model.pkl,..." (the name
+# defaults to the file name); each shadow is loaded from its own files and
+# reloaded on change, exactly like the primary model.
+import atexit
+import logging
+import os
+import queue
+import random
+import threading
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+import numpy as np
+from sqlalchemy import case, delete, func, insert, select
+
+from app import db
+from app.ai.model_registry import ModelRegistry
+from app.metrics import ERRORS
+from app.models import ShadowVerdict
+from app.profiles import profile_store
+
+logger = logging.getLogger(__name__)
+
+# Logins scored by the primary model, waiting for the shadows.
+ShadowJob = namedtuple('ShadowJob', ['usernames', 'ips', 'profiles', 'primary_version', 'primary_scores', 'created_at'])
+
+
+class ShadowModels:
+    # Like the login event pipeline, the thread starts lazily and is restarted
+    # after a fork; queued jobs are best-effort and dropped when the queue is full.
+
+    def __init__(self):
+        self.registries = {}  # shadow name -> ModelRegistry
+        self.sample_rate = 1.0
+        self.queue_size = 1000
+        self._lock = threading.Lock()
+        self._queue = None
+        self._thread = None
+        self._pid = None
+        self.counters = {'submitted': 0, 'sampled_out': 0, 'dropped': 0, 'scored': 0, 'failed': 0}
+
+    def init_app(self, app):
+        self.registries = {}
+        for entry in (app.config.get('ANOMALY_SHADOW_MODELS') or '').split(','):
+            name, _, path = entry.strip().rpartition('=')
+            if not path:
+                continue
+            name = name or os.path.splitext(os.path.basename(path))[0]
+            registry = ModelRegistry(path, float(app.config.get('ANOMALY_MODEL_CHECK_INTERVAL', 5)),
+                                     app.config.get('ANOMALY_MODEL_FORMAT') or 'auto')
+            self.registries[name[:64]] = registry
+        self.sample_rate = float(app.config.get('ANOMALY_SHADOW_SAMPLE_RATE', 1.0))
+        self.queue_size = int(app.config.get('ANOMALY_SHADOW_QUEUE_SIZE', 1000))
+        app.extensions['shadow_models'] = self
+
+    @property
+    def enabled(self):
+        return bool(self.registries)
+
+    def submit(self, usernames, ips, profiles, primary_version, primary_scores):
+        """Queue logins the primary model just scored. Never raises and never blocks."""
+        if not self.registries:
+            return
+        try:
+            count = len(usernames)
+            self.counters['submitted'] += count
+            primary_scores = np.asarray(primary_scores, dtype=np.float64)
+            if self.sample_rate < 1.0:
+                keep = [i for i in range(count) if random.random() < self.sample_rate]
+                self.counters['sampled_out'] += count - len(keep)
+                if not keep:
+                    return
+                usernames = [usernames[i] for i in keep]
+                ips = [ips[i] for i in keep]
+                profiles = [profiles[i] for i in keep] if profiles is not None else None
+                primary_scores = primary_scores[keep]
+            self._ensure_started()
+            self._queue.put_nowait(ShadowJob(list(usernames), list(ips), profiles and list(profiles),
+                                             primary_version, primary_scores, datetime.utcnow()))
+        except queue.Full:
+            self.counters['dropped'] += len(usernames)
+        except Exception:
+            logger.exception("Could not queue %d login(s) for shadow scoring", len(usernames))
+            ERRORS.inc(component='shadow_models')
+
+    def _ensure_started(self):
+        from flask import current_app
+
+        if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+                return
+            app = current_app._get_current_object()
+            if self._pid != os.getpid():
+                self._queue = queue.Queue(maxsize=self.queue_size)
+                atexit.register(self.flush, app)
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, args=(app,), name='shadow-models', daemon=True)
+            self._thread.start()
+
+    def score_jobs(self, jobs):
+        """Score a list of ShadowJobs with every shadow model and insert their verdicts."""
+        usernames = [u for job in jobs for u in job.usernames]
+        ips = [ip for job in jobs for ip in job.ips]
+        profiles = [p for job in jobs for p in (job.profiles or [None] * len(job.usernames))]
+        primary_versions = [job.primary_version for job in jobs for _ in job.usernames]
+        created = [job.created_at for job in jobs for _ in job.usernames]
+        primary_scores = np.concatenate([job.primary_scores for job in jobs])
+
+        rows = []
+        profiles_loaded = False
+        for name, registry in self.registries.items():
+            try:
+                loaded = registry.get()
+                if loaded.encoder.use_profile and not profiles_loaded:
+                    # The request path only loads profiles the primary model uses.
+                    # Read here, a profile may already include the login itself.
+                    profiles = [profile if profile is not None else profile_store.get(username).features(ip)
+                                for username, ip, profile in zip(usernames, ips, profiles)]
+                    profiles_loaded = True
+                features = loaded.encoder.encode_many(usernames, ips, profiles if loaded.encoder.use_profile else None)
+                scores = loaded.model.decision_function(features)
+                if not np.all(np.isfinite(scores)):
+                    raise ValueError('model returned non-finite scores')
+            except Exception:
+                logger.exception("Shadow model %s failed on %d login(s)", name, len(usernames))
+                ERRORS.inc(component='shadow_models')
+                self.counters['failed'] += len(usernames)
+                continue
+            rows.extend({
+                'created_at': when, 'shadow': name, 'shadow_version': loaded.version,
+                'primary_version': primary_version,
+                'primary_flag': bool(primary < 0), 'shadow_flag': bool(shadow < 0),
+                'primary_score': float(primary), 'shadow_score': float(shadow),
+            } for when, primary_version, primary, shadow in zip(created, primary_versions, primary_scores, scores))
+            self.counters['scored'] += len(usernames)
+        if rows:
+            db.session.execute(insert(ShadowVerdict), rows)
+            db.session.commit()
+        return len(rows)
+
+    def _take_batch(self, timeout, max_logins=2000):
+        try:
+            jobs = [self._queue.get(timeout=timeout)]
+        except queue.Empty:
+            return []
+        logins = len(jobs[0].usernames)
+        while logins < max_logins:
+            try:
+                jobs.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+            logins += len(jobs[-1].usernames)
+        return jobs
+
+    def _run(self, app):
+        while True:
+            jobs = self._take_batch(timeout=1.0)
+            if not jobs:
+                continue
+            try:
+                with app.app_context():
+                    self.score_jobs(jobs)
+            except Exception:
+                logger.exception("Failed to record shadow verdicts for %d job(s)", len(jobs))
+                ERRORS.inc(component='shadow_models')
+
+    def flush(self, app):
+        """Score whatever is still queued, in the calling thread (used at exit)."""
+        if self._queue is None or self._pid != os.getpid():
+            return
+        with app.app_context():
+            while True:
+                jobs = self._take_batch(timeout=0)
+                if not jobs:
+                    return
+                self.score_jobs(jobs)
+
+    def stats(self):
+        stats = dict(self.counters)
+        stats['queued'] = self._queue.qsize() if self._queue is not None and self._pid == os.getpid() else 0
+        stats['shadows'] = {name: registry.info() for name, registry in self.registries.items()}
+        return stats
+
+
+shadow_models = ShadowModels()
+
+
+def shadow_report(since_days=None):
+    """Per shadow (and model versions): logins, alert rates and how often the verdicts differ."""
+    primary_flagged = func.sum(case((ShadowVerdict.primary_flag, 1), else_=0))
+    shadow_flagged = func.sum(case((ShadowVerdict.shadow_flag, 1), else_=0))
+    only_primary = func.sum(case((ShadowVerdict.primary_flag & ~ShadowVerdict.shadow_flag, 1), else_=0))
+    only_shadow = func.sum(case((ShadowVerdict.shadow_flag & ~ShadowVerdict.primary_flag, 1), else_=0))
+    query = select(
+        ShadowVerdict.shadow, ShadowVerdict.shadow_version, ShadowVerdict.primary_version,
+        func.count(), primary_flagged, shadow_flagged, only_primary, only_shadow,
+        func.avg(func.abs(ShadowVerdict.shadow_score - ShadowVerdict.primary_score)),
+        func.min(ShadowVerdict.created_at), func.max(ShadowVerdict.created_at),
+    ).group_by(ShadowVerdict.shadow, ShadowVerdict.shadow_version, ShadowVerdict.primary_version)
+    if since_days:
+        query = query.where(ShadowVerdict.created_at >= datetime.utcnow() - timedelta(days=since_days))
+
+    report = []
+    for (name, shadow_version, primary_version, logins, primary_alerts, shadow_alerts,
+         only_primary_count, only_shadow_count, mean_delta, first, last) in db.session.execute(query.order_by(ShadowVerdict.shadow)):
+        report.append({
+            'shadow': name,
+            'shadow_version': shadow_version,
+            'primary_version': primary_version,
+            'logins': logins,
+            'primary_alert_rate': primary_alerts / logins,
+            'shadow_alert_rate': shadow_alerts / logins,
+            'only_primary': only_primary_count,
+            'only_shadow': only_shadow_count,
+            'agreement': 1 - (only_primary_count + only_shadow_count) / logins,
+            'mean_abs_score_delta': float(mean_delta or 0.0),
+            'first': first,
+            'last': last,
+        })
+    return report
+
+
+def prune_verdicts(older_than_days):
+    """Delete shadow verdicts older than the given number of days. Returns the row count."""
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+    result = db.session.execute(delete(ShadowVerdict).where(ShadowVerdict.created_at < cutoff))
+    db.session.commit()
+    return result.rowcount
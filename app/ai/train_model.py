@@ -1,7 +1,30 @@
 import pandas as pd
+import sklearn
 from sklearn.ensemble import IsolationForest
 import pickle
 import os
+import hashlib
+import json
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+from sqlalchemy import select, union
+
+from app import db
+from app.models import User, LoginActivity
+from app.ai.features import FeatureEncoder, encoder_path_for, replay_profiles
+from app.ai.forest import forest_path_for, save_forest
+from app.ai.ipinfo import ip_ranges
+from app.ai.model_registry import DUMMY_SOURCE
+
+MODEL_PATH = 'app/ai/model/model.pkl'
+
+# Defaults for training on the real LoginActivity table (see train_from_database).
+DEFAULT_CHUNK_SIZE = 10000
+DEFAULT_SAMPLE_SIZE = 100000
+# Rough per-row cost of a fetched chunk (Row objects + strings) used for the memory ceiling.
+APPROX_FETCHED_ROW_BYTES = 300
 
 def generate_dummy_data():
     data = {
@@ -13,23 +36,205 @@ def generate_dummy_data():
     df = pd.DataFrame(data)
     return df
 
-def preprocess(df):
-    df['ip_encoded'] = df['ip_address'].astype('category').cat.codes
-    df['user_encoded'] = df['username'].astype('category').cat.codes
-    return df[['ip_encoded', 'user_encoded']]
+def preprocess(df, encoder=None):
+    # Fit the vocabulary on the training data unless an encoder is supplied,
+    # so inference can reuse exactly the same mapping.
+    if encoder is None:
+        encoder = FeatureEncoder.fit(df['username'], use_profile=True)
+    df = df.sort_values('timestamp')
+    profiles = None
+    if encoder.use_profile:
+        rows = zip(df['username'], df['ip_address'], df['timestamp'].dt.to_pydatetime())
+        profiles = replay_profiles(rows, {})
+    X = encoder.encode_many(df['username'], df['ip_address'], profiles)
+    return X, encoder
+
+def _atomic_write(path, data):
+    # Write to a temp file and rename over the target so readers (the model
+    # registry in running workers) never see a partially written file.
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+def _write_model_files(path, model, model_bytes, encoder, meta_bytes=None):
+    # The encoder (and the flattened forest) record the hash of the model they
+    # belong to, so a worker that checks between the renames keeps its old
+    # model instead of pairing the new encoder with the old model.
+    model_sha256 = hashlib.sha256(model_bytes).hexdigest()
+    save_forest(forest_path_for(path), model, model_sha256=model_sha256)
+    encoder.save(encoder_path_for(path), model_sha256=model_sha256)
+    if meta_bytes is not None:
+        _atomic_write(os.path.splitext(path)[0] + '.meta.json', meta_bytes)
+    _atomic_write(path, model_bytes)
+
+def save_artifact(model, encoder, metadata, model_dir=None, publish=True):
+    """Write a versioned model-<timestamp>.pkl (+ forest, encoder and metadata) and,
+    if publish is set, make it the live model.pkl that workers pick up."""
+    model_dir = model_dir or os.path.dirname(MODEL_PATH)
+    os.makedirs(model_dir, exist_ok=True)
+    versioned_path = os.path.join(model_dir, f"model-{metadata['version']}.pkl")
+    model_bytes = pickle.dumps(model)
+    meta_bytes = json.dumps(metadata, indent=2, sort_keys=True, default=str).encode('utf-8')
+
+    _write_model_files(versioned_path, model, model_bytes, encoder, meta_bytes)
+    if publish:
+        _write_model_files(os.path.join(model_dir, os.path.basename(MODEL_PATH)),
+                           model, model_bytes, encoder, meta_bytes)
+    return versioned_path
 
 def train_and_save_model():
+    # Placeholder model for a fresh checkout. The registry loads it observe-only
+    # (see DUMMY_SOURCE), so it never flags a login; use `flask train-model`.
     df = generate_dummy_data()
-    X = preprocess(df)
+    X, encoder = preprocess(df)
 
     model = IsolationForest(contamination=0.2, random_state=42)
     model.fit(X)
 
-    os.makedirs('app/ai/model', exist_ok=True)
-    with open('app/ai/model/model.pkl', 'wb') as f:
-        pickle.dump(model, f)
+    metadata = {
+        'version': datetime.utcnow().strftime('%Y%m%d%H%M%S'),
+        'trained_at': datetime.utcnow().isoformat() + 'Z',
+        'source': DUMMY_SOURCE,
+        'rows_seen': len(df),
+        'feature_names': encoder.feature_names,
+        'sklearn_version': sklearn.__version__,
+    }
+    os.makedirs(os.path.dirname(MODEL_PATH), exist_ok=True)
+    _write_model_files(MODEL_PATH, model, pickle.dumps(model), encoder,
+                       json.dumps(metadata, indent=2, sort_keys=True).encode('utf-8'))
 
     print("✅ Model trained and saved.")
 
+
+class Reservoir:
+    # Fixed-size uniform sample of a stream of feature rows (Algorithm R,
+    # vectorized per chunk). Memory is allocated once and never grows.
+
+    def __init__(self, capacity, n_features, seed=42):
+        self.capacity = capacity
+        self.rows = np.empty((capacity, n_features), dtype=np.float64)
+        self.seen = 0
+        self._rng = np.random.default_rng(seed)
+
+    def add(self, X):
+        n = len(X)
+        if n == 0:
+            return
+        # Fill phase: copy straight in until the reservoir is full.
+        free = max(self.capacity - self.seen, 0)
+        take = min(free, n)
+        if take:
+            self.rows[self.seen:self.seen + take] = X[:take]
+        rest = X[take:]
+        if len(rest):
+            # Row number i (0-based, global) replaces slot j ~ U[0, i] when j < capacity.
+            positions = np.arange(self.seen + take, self.seen + n)
+            slots = self._rng.integers(0, positions + 1)
+            keep = slots < self.capacity
+            self.rows[slots[keep]] = rest[keep]
+        self.seen += n
+
+    def sample(self):
+        return self.rows[:min(self.seen, self.capacity)]
+
+
+def _known_usernames(since=None):
+    # The vocabulary is every registered user plus every username with activity,
+    # fetched up front so each chunk can be encoded as soon as it arrives.
+    activity = select(LoginActivity.username).distinct()
+    if since is not None:
+        activity = activity.where(LoginActivity.timestamp >= since)
+    return db.session.execute(union(select(User.username), activity)).scalars().all()
+
+
+def iter_activity_chunks(chunk_size=DEFAULT_CHUNK_SIZE, since=None):
+    """Yield lists of (username, ip_address, timestamp) rows in time order.
+
+    Uses stream_results so PostgreSQL serves the rows from a server-side cursor
+    instead of materialising the whole result set in the worker.
+    """
+    query = (
+        select(LoginActivity.username, LoginActivity.ip_address, LoginActivity.timestamp)
+        .order_by(LoginActivity.timestamp, LoginActivity.id)
+        .execution_options(stream_results=True, yield_per=chunk_size)
+    )
+    if since is not None:
+        query = query.where(LoginActivity.timestamp >= since)
+    result = db.session.execute(query)
+    try:
+        for partition in result.partitions(chunk_size):
+            yield partition
+    finally:
+        result.close()
+
+
+def train_from_database(chunk_size=DEFAULT_CHUNK_SIZE, sample_size=DEFAULT_SAMPLE_SIZE,
+                        max_memory_mb=None, since_days=None, contamination='auto',
+                        n_estimators=100, model_dir=None, publish=True, progress=None):
+    """Train the IsolationForest on LoginActivity without loading the table into memory.
+
+    Rows are streamed in chunks, encoded immediately and reservoir-sampled down
+    to sample_size rows (further capped by max_memory_mb). Per-user profile
+    features are replayed in time order, which keeps one small ProfileState
+    per distinct username in memory. Network features are included when an IP
+    range file is loaded (see app/ai/ipinfo.py). Must run inside an application context.
+    Returns the metadata written next to the artifact.
+    """
+    started = time.perf_counter()
+    since = datetime.utcnow() - timedelta(days=since_days) if since_days else None
+    encoder = FeatureEncoder.fit(_known_usernames(since), use_profile=True, use_ipinfo=ip_ranges.available)
+    n_features = len(encoder.feature_names)
+
+    if max_memory_mb:
+        budget = max_memory_mb * 1024 * 1024 - chunk_size * APPROX_FETCHED_ROW_BYTES
+        max_rows = int(budget // (n_features * np.dtype(np.float64).itemsize))
+        if max_rows < 1:
+            raise ValueError(f"max_memory_mb={max_memory_mb} is too small for chunk_size={chunk_size}")
+        sample_size = min(sample_size, max_rows)
+
+    reservoir = Reservoir(sample_size, n_features)
+    states = {}
+    first_seen = last_seen = None
+
+    for chunk in iter_activity_chunks(chunk_size, since):
+        usernames, ips, timestamps = zip(*chunk)
+        profiles = replay_profiles(chunk, states)
+        reservoir.add(encoder.encode_many(usernames, ips, profiles))
+        first_seen = first_seen or timestamps[0]
+        last_seen = timestamps[-1]
+        if progress:
+            progress(reservoir.seen, time.perf_counter() - started)
+
+    X = reservoir.sample()
+    if len(X) == 0:
+        raise ValueError("No LoginActivity rows to train on.")
+
+    fit_started = time.perf_counter()
+    model = IsolationForest(n_estimators=n_estimators, contamination=contamination, random_state=42)
+    model.fit(X)
+
+    metadata = {
+        'version': datetime.utcnow().strftime('%Y%m%d%H%M%S'),
+        'trained_at': datetime.utcnow().isoformat() + 'Z',
+        'source': 'login_activity',
+        'rows_seen': reservoir.seen,
+        'rows_sampled': len(X),
+        'first_timestamp': first_seen,
+        'last_timestamp': last_seen,
+        'since_days': since_days,
+        'feature_names': encoder.feature_names,
+        'vocabulary_size': len(encoder.user_vocab),
+        'ipinfo': ip_ranges.info() if encoder.use_ipinfo else None,
+        'params': {'n_estimators': n_estimators, 'contamination': contamination,
+                   'chunk_size': chunk_size, 'sample_size': sample_size,
+                   'max_memory_mb': max_memory_mb},
+        'sklearn_version': sklearn.__version__,
+        'fit_seconds': round(time.perf_counter() - fit_started, 3),
+        'total_seconds': round(time.perf_counter() - started, 3),
+    }
+    metadata['path'] = save_artifact(model, encoder, metadata, model_dir, publish)
+    return metadata
+
 if __name__ == '__main__':
-    train_and_save_model()
\ No newline at end of file
+    train_and_save_model()
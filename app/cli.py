@@ -0,0 +1,325 @@
+# app/cli.py
+# Flask CLI commands, registered by create_app(). Run with e.g.
+#   flask --app wsgi rescore-activity --chunk-size 10000
+import os
+import time
+
+import click
+from flask.cli import with_appcontext
+
+
+@click.command('rescore-activity')
+@click.option('--chunk-size', default=5000, show_default=True, help='Rows scored per model.predict call.')
+@click.option('--start-id', default=0, show_default=True, help='Resume after this LoginActivity id.')
+@click.option('--end-id', default=None, type=int, help='Stop after this LoginActivity id.')
+@click.option('--dry-run', is_flag=True, help='Score and count, but do not write anything.')
+@with_appcontext
+def rescore_activity_command(chunk_size, start_id, end_id, dry_run):
+    """Re-score LoginActivity.is_suspicious with the current anomaly model."""
+    from app.ai.batch_score import rescore_login_activity
+
+    def progress(stats, elapsed):
+        rate = stats['scanned'] / elapsed if elapsed else 0
+        click.echo(f"scanned={stats['scanned']} flagged={stats['flagged']} "
+                   f"updated={stats['updated']} last_id={stats['last_id']} ({rate:,.0f} rows/s)")
+
+    try:
+        stats = rescore_login_activity(chunk_size, start_id, end_id, dry_run, progress)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    click.echo(f"Done with model {stats['model_version']}: {stats['scanned']} rows scanned, "
+               f"{stats['updated']} updated{' (dry run)' if dry_run else ''} in {stats['seconds']}s.")
+
+
+@click.command('outbox-worker')
+@click.option('--once', is_flag=True, help='Deliver everything currently due, then exit.')
+@click.option('--batch-size', default=None, type=int, help='Messages per SMTP connection (default OUTBOX_BATCH_SIZE).')
+@click.option('--poll-interval', default=None, type=float, help='Seconds to sleep when idle (default OUTBOX_POLL_INTERVAL).')
+@with_appcontext
+def outbox_worker_command(once, batch_size, poll_interval):
+    """Deliver queued outbox emails outside the web process."""
+    from flask import current_app
+    from app.outbox import drain
+
+    poll_interval = poll_interval or current_app.config.get('OUTBOX_POLL_INTERVAL', 5)
+    while True:
+        handled = drain(batch_size)
+        if handled:
+            click.echo(f"Delivered/rescheduled {handled} message(s).")
+        if once:
+            return
+        time.sleep(poll_interval)
+
+
+@click.command('login-event-worker')
+@click.option('--once', is_flag=True, help='Score everything currently pending, then exit.')
+@click.option('--batch-size', default=None, type=int, help='Rows scored per batch (default LOGIN_EVENTS_BATCH_SIZE).')
+@click.option('--poll-interval', default=None, type=float, help='Seconds to sleep when idle (default LOGIN_EVENTS_POLL_INTERVAL).')
+@with_appcontext
+def login_event_worker_command(once, batch_size, poll_interval):
+    """Score logins recorded with LOGIN_EVENTS_MODE=worker. Run a single instance."""
+    from flask import current_app
+    from app.events import process_pending
+
+    batch_size = batch_size or current_app.config.get('LOGIN_EVENTS_BATCH_SIZE', 500)
+    poll_interval = poll_interval or current_app.config.get('LOGIN_EVENTS_POLL_INTERVAL', 1)
+    while True:
+        handled = process_pending(batch_size)
+        if handled:
+            click.echo(f"Scored {handled} login(s).")
+        elif once:
+            return
+        else:
+            time.sleep(poll_interval)
+
+
+@click.command('train-model')
+@click.option('--chunk-size', default=10000, show_default=True, help='Rows fetched per database round trip.')
+@click.option('--sample-size', default=100000, show_default=True, help='Rows kept (reservoir sample) for fitting.')
+@click.option('--max-memory-mb', default=None, type=float, help='Cap the sample and fetch buffers to roughly this much memory.')
+@click.option('--since-days', default=None, type=int, help='Only train on the last N days of activity.')
+@click.option('--contamination', default='auto', show_default=True, help="Expected anomaly share, or 'auto'.")
+@click.option('--n-estimators', default=100, show_default=True)
+@click.option('--model-dir', default=None, help='Where to write the artifact (default app/ai/model).')
+@click.option('--no-publish', is_flag=True, help='Only write the versioned artifact; leave model.pkl alone.')
+@with_appcontext
+def train_model_command(chunk_size, sample_size, max_memory_mb, since_days, contamination,
+                        n_estimators, model_dir, no_publish):
+    """Train the anomaly model on the LoginActivity table, streaming it in chunks."""
+    from app.ai.train_model import train_from_database
+
+    if contamination != 'auto':
+        contamination = float(contamination)
+
+    def progress(rows, elapsed):
+        click.echo(f"streamed {rows:,} rows ({rows / elapsed if elapsed else 0:,.0f} rows/s)")
+
+    try:
+        metadata = train_from_database(chunk_size, sample_size, max_memory_mb, since_days, contamination,
+                                       n_estimators, model_dir, not no_publish, progress)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    click.echo(f"Trained on {metadata['rows_sampled']:,} of {metadata['rows_seen']:,} rows "
+               f"in {metadata['total_seconds']}s -> {metadata['path']}"
+               f"{'' if no_publish else ' (published as model.pkl)'}")
+
+
+@click.command('export-forest')
+@click.option('--verify-rows', default=10000, show_default=True, help='Random rows scored by both formats before publishing.')
+@with_appcontext
+def export_forest_command(verify_rows):
+    """Write model.forest.npz for the current model.pkl (no retraining needed)."""
+    from app.ai.forest import export_model
+    from app.ai.model_registry import model_registry
+
+    result = export_model(model_registry.path, verify_rows)
+    if not result['ok']:
+        raise click.ClickException(f"Forest does not match the pickle (max diff {result['max_abs_diff']:.3g}, "
+                                   f"same predictions: {result['same_predictions']}); nothing written.")
+    click.echo(f"Wrote {result['path']} (max score diff {result['max_abs_diff']:.3g} over {result['rows']:,} rows).")
+
+
+@click.command('shadow-report')
+@click.option('--days', default=7, show_default=True, help='Only verdicts from the last N days (0 for all).')
+@click.option('--prune-days', default=None, type=int, help='First delete verdicts older than N days.')
+@with_appcontext
+def shadow_report_command(days, prune_days):
+    """Compare shadow models' alert rates with the primary model on live logins."""
+    from app.ai.shadow import prune_verdicts, shadow_report
+
+    if prune_days is not None:
+        click.echo(f"Deleted {prune_verdicts(prune_days):,} verdicts older than {prune_days} days.")
+    report = shadow_report(days or None)
+    if not report:
+        click.echo('No shadow verdicts recorded (is ANOMALY_SHADOW_MODELS set?).')
+        return
+    click.echo(f"{'shadow':20s} {'versions':27s} {'logins':>9s} {'primary':>8s} {'shadow':>8s} "
+               f"{'+shadow':>8s} {'-shadow':>8s} {'agree':>7s} {'|delta|':>8s}")
+    for row in report:
+        click.echo(f"{row['shadow']:20s} {row['primary_version'] + ' -> ' + row['shadow_version']:27s} "
+                   f"{row['logins']:>9,} {row['primary_alert_rate']:>8.2%} {row['shadow_alert_rate']:>8.2%} "
+                   f"{row['only_shadow']:>8,} {row['only_primary']:>8,} {row['agreement']:>7.2%} "
+                   f"{row['mean_abs_score_delta']:>8.4f}")
+
+
+@click.command('online-model')
+@click.option('--replay-days', default=None, type=int, help='Start over and learn this many days of login history.')
+@click.option('--reset', is_flag=True, help='Forget everything learnt and delete the checkpoint.')
+@with_appcontext
+def online_model_command(replay_days, reset):
+    """Show, reset or warm up the streaming anomaly detector (ANOMALY_ONLINE_MODE)."""
+    from app.ai.online import online_detector
+
+    if reset:
+        online_detector.reset()
+        click.echo(f"Reset the online model ({online_detector.path} removed).")
+    if replay_days:
+        started = time.perf_counter()
+        rows = online_detector.replay(replay_days)
+        click.echo(f"Learnt {rows:,} login(s) in {time.perf_counter() - started:.2f}s; "
+                   f"checkpoint written to {online_detector.path}.")
+    online_detector.load()
+    for key, value in online_detector.info().items():
+        click.echo(f"{key}: {value}")
+
+
+@click.command('build-ipinfo')
+@click.argument('source', type=click.Path(exists=True, dir_okay=False))
+@click.option('--output', default=None, help='Where to write the range file (default IPINFO_PATH).')
+@with_appcontext
+def build_ipinfo_command(source, output):
+    """Compile a CIDR,asn,country,datacenter CSV into the IP range file."""
+    from app.ai.ipinfo import build_ip_ranges, ip_ranges
+
+    output = output or ip_ranges.path
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    try:
+        counts = build_ip_ranges(source, output)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    click.echo(f"Wrote {output}: {counts['v4']:,} IPv4 and {counts['v6']:,} IPv6 ranges. "
+               f"Retrain the model (flask train-model) to use them as features.")
+
+
+@click.command('rebuild-profiles')
+@click.option('--chunk-size', default=10000, show_default=True, help='Rows fetched/written per round trip.')
+@with_appcontext
+def rebuild_profiles_command(chunk_size):
+    """Recompute every user_profile row from the LoginActivity history."""
+    from app.profiles import profile_store
+
+    started = time.perf_counter()
+    count = profile_store.rebuild(chunk_size)
+    click.echo(f"Rebuilt {count} profile(s) in {time.perf_counter() - started:.2f}s.")
+
+
+@click.command('rollup-activity')
+@click.option('--retention-days', default=None, type=int, help='Keep this many days of raw activity (default ACTIVITY_RETENTION_DAYS).')
+@click.option('--dry-run', is_flag=True, help='Only count the rows that would be rolled up.')
+@with_appcontext
+def rollup_activity_command(retention_days, dry_run):
+    """Roll old LoginActivity rows into login_activity_daily and delete them."""
+    from flask import current_app
+    from app.retention import rollup_and_prune
+
+    if retention_days is None:
+        retention_days = current_app.config.get('ACTIVITY_RETENTION_DAYS', 0)
+    if not retention_days or retention_days <= 0:
+        raise click.ClickException('Retention is disabled; pass --retention-days or set ACTIVITY_RETENTION_DAYS.')
+
+    def progress(day, stats):
+        click.echo(f"rolled up {day} ({stats['rows']:,} rows so far)")
+
+    stats = rollup_and_prune(retention_days, dry_run, progress)
+    if dry_run:
+        click.echo(f"{stats['rows']:,} rows are older than {stats['cutoff']:%Y-%m-%d} (dry run).")
+    else:
+        click.echo(f"Rolled up {stats['days']} day(s), {stats['rows']:,} rows older than {stats['cutoff']:%Y-%m-%d}.")
+        for name in stats['partitions_dropped']:
+            click.echo(f"Dropped empty partition {name}.")
+
+
+@click.command('compact-stats')
+@click.option('--hours', default=None, type=int, help='Recompute this many recent hours (default STATS_COMPACT_HOURS; large to backfill).')
+@with_appcontext
+def compact_stats_command(hours):
+    """Recompute the dashboard rollups and top IPs/usernames from LoginActivity."""
+    from flask import current_app
+    from app.stats import compact_stats
+
+    config = current_app.config
+    started = time.perf_counter()
+    try:
+        stats = compact_stats(hours or config.get('STATS_COMPACT_HOURS', 3), config.get('STATS_TOP_KEYS', 20),
+                              config.get('STATS_MINUTE_RETENTION_HOURS', 48))
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    click.echo(f"Compacted {stats['hours']} hours ({stats['minute_buckets']} minute and "
+               f"{stats['hour_buckets']} hour buckets), pruned {stats['minutes_pruned']} minute rows "
+               f"in {time.perf_counter() - started:.2f}s.")
+
+
+@click.command('prune-rate-limits')
+@with_appcontext
+def prune_rate_limits_command():
+    """Delete shared rate limit buckets that have refilled completely (RATELIMIT_BACKEND=sql)."""
+    from app.ratelimit import SQLBackend, limiter
+
+    if not isinstance(limiter.backend, SQLBackend):
+        click.echo('RATELIMIT_BACKEND is not sql; nothing to prune.')
+        return
+    click.echo(f"Deleted {limiter.backend.prune():,} refilled bucket(s).")
+
+
+@click.command('activity-partitions')
+@click.option('--months-ahead', default=3, show_default=True, help='Create monthly partitions this far ahead.')
+@with_appcontext
+def activity_partitions_command(months_ahead):
+    """Create upcoming monthly login_activity partitions (PostgreSQL only)."""
+    from app.retention import ensure_monthly_partitions, is_partitioned
+
+    if not is_partitioned():
+        click.echo('login_activity is not partitioned; nothing to do.')
+        return
+    created = ensure_monthly_partitions(months_ahead)
+    click.echo(f"Created {len(created)} partition(s){': ' + ', '.join(created) if created else ''}.")
+
+
+@click.command('import-users')
+@click.argument('source', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'file_format', type=click.Choice(['csv', 'ndjson']), default=None, help='Input format (default: from the file extension).')
+@click.option('--batch-size', default=1000, show_default=True, help='Users inserted per transaction.')
+@click.option('--workers', default=None, type=int, help='Password hashing processes (default: one per CPU; 0 hashes inline).')
+@click.option('--errors', 'errors_path', default=None, type=click.Path(dir_okay=False), help='Write rejected rows to this CSV.')
+@click.option('--dry-run', is_flag=True, help='Validate the file without hashing or inserting anything.')
+@with_appcontext
+def import_users_command(source, file_format, batch_size, workers, errors_path, dry_run):
+    """Create users in bulk from a CSV or NDJSON file (username, email, password or password_hash, is_admin)."""
+    from app.user_import import UserImporter, read_records
+
+    def progress(stats, elapsed):
+        click.echo(f"read={stats['read']:,} imported={stats['imported']:,} rejected={stats['rejected']:,} "
+                   f"({stats['imported'] / elapsed if elapsed else 0:,.0f} users/s)")
+
+    importer = UserImporter(batch_size, workers, dry_run=dry_run)
+    stats = importer.run(read_records(source, file_format), progress)
+    click.echo(f"Imported {stats['imported']:,} of {stats['read']:,} user(s), rejected {stats['rejected']:,} "
+               f"in {stats['seconds']}s{' (dry run)' if dry_run else ''}.")
+    if errors_path:
+        importer.write_error_report(errors_path)
+        click.echo(f"Rejected rows written to {errors_path}.")
+    else:
+        for error in importer.errors[:20]:
+            click.echo(f"line {error.line}: {error.error} ({error.username or '-'}, {error.email or '-'})", err=True)
+        if len(importer.errors) > 20:
+            click.echo(f"... and {len(importer.errors) - 20} more; use --errors to write them all.", err=True)
+
+
+@click.command('release')
+@click.option('--no-seed', is_flag=True, help='Only apply migrations; skip the default admin.')
+@with_appcontext
+def release_command(no_seed):
+    """Apply database migrations and seed the default admin (run once per deploy)."""
+    from app.release import run_release
+
+    started = time.perf_counter()
+    run_release(seed_admin=not no_seed)
+    click.echo(f"Release tasks finished in {time.perf_counter() - started:.2f}s.")
+
+
+def register_commands(app):
+    app.cli.add_command(release_command)
+    app.cli.add_command(import_users_command)
+    app.cli.add_command(rescore_activity_command)
+    app.cli.add_command(train_model_command)
+    app.cli.add_command(export_forest_command)
+    app.cli.add_command(build_ipinfo_command)
+    app.cli.add_command(shadow_report_command)
+    app.cli.add_command(online_model_command)
+    app.cli.add_command(rebuild_profiles_command)
+    app.cli.add_command(rollup_activity_command)
+    app.cli.add_command(activity_partitions_command)
+    app.cli.add_command(compact_stats_command)
+    app.cli.add_command(prune_rate_limits_command)
+    app.cli.add_command(outbox_worker_command)
+    app.cli.add_command(login_event_worker_command)
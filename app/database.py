@@ -0,0 +1,143 @@
+# app/database.py
+# Engine configuration and read-replica routing.
+#
+# configure_engines() turns the DB_* settings into SQLALCHEMY_ENGINE_OPTIONS
+# (pool size/overflow/timeout/recycle/pre-ping, PostgreSQL statement_timeout)
+# and, when DATABASE_REPLICA_URL is set, adds a "replica" bind with the same
+# options. RoutingSession then sends SELECTs made inside read_replica() (or a
+# @replica_reads view) to the replica; flushes, INSERT/UPDATE/DELETE and
+# everything outside those blocks go to the primary. After a request writes,
+# the client sticks to the primary for DB_REPLICA_STICKY_SECONDS so it reads
+# its own writes despite replication lag.
+#
+# Pools time every checkout, exported as francis_db_pool_wait_seconds.
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from flask import current_app, has_request_context, session as flask_session
+from flask_sqlalchemy.session import Session
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.sql import Select
+from sqlalchemy.sql.dml import UpdateBase
+
+REPLICA_BIND = 'replica'
+_use_replica = ContextVar('use_replica', default=False)
+
+
+class TimedQueuePool(QueuePool):
+    # QueuePool that records how long each checkout waited for a connection
+    # (including opening a new one when the pool is below its overflow limit).
+    bind_name = 'primary'
+
+    def _do_get(self):
+        from app.metrics import POOL_WAIT_SECONDS
+
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            POOL_WAIT_SECONDS.observe(time.perf_counter() - started, bind=self.bind_name)
+
+    def recreate(self):
+        pool = super().recreate()
+        pool.bind_name = self.bind_name
+        return pool
+
+
+def _engine_options(config, uri):
+    url = make_url(uri)
+    options = {
+        'pool_pre_ping': config.get('DB_POOL_PRE_PING', True),
+        'pool_recycle': config.get('DB_POOL_RECYCLE', 1800),
+    }
+    if url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:'):
+        return options  # single shared connection; pool sizing doesn't apply
+    options.update(
+        poolclass=TimedQueuePool,
+        pool_size=config.get('DB_POOL_SIZE', 5),
+        max_overflow=config.get('DB_MAX_OVERFLOW', 10),
+        pool_timeout=config.get('DB_POOL_TIMEOUT', 30),
+    )
+    timeout_ms = config.get('DB_STATEMENT_TIMEOUT_MS', 0)
+    if timeout_ms and url.get_backend_name() == 'postgresql':
+        options['connect_args'] = {'options': f'-c statement_timeout={int(timeout_ms)}'}
+    return options
+
+
+def configure_engines(app):
+    """Fill in engine options and the replica bind; call before db.init_app(app)."""
+    config = app.config
+    engine_options = _engine_options(config, config['SQLALCHEMY_DATABASE_URI'])
+    # Explicit SQLALCHEMY_ENGINE_OPTIONS entries win over the DB_* settings.
+    config['SQLALCHEMY_ENGINE_OPTIONS'] = dict(engine_options, **(config.get('SQLALCHEMY_ENGINE_OPTIONS') or {}))
+    replica_uri = config.get('DATABASE_REPLICA_URL')
+    if replica_uri:
+        binds = dict(config.get('SQLALCHEMY_BINDS') or {})
+        binds[REPLICA_BIND] = dict(_engine_options(config, replica_uri), url=replica_uri)
+        config['SQLALCHEMY_BINDS'] = binds
+
+
+def label_pools(db, app):
+    # Name each engine's pool for the wait-time metric; needs an app context.
+    with app.app_context():
+        for key, engine in db.engines.items():
+            if isinstance(engine.pool, TimedQueuePool):
+                engine.pool.bind_name = key or 'primary'
+
+
+class RoutingSession(Session):
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if self._flushing or isinstance(clause, UpdateBase):
+            self.info['wrote'] = True  # see remember_writes()
+        elif bind is None and _use_replica.get() and isinstance(clause, Select):
+            replica = self._db.engines.get(REPLICA_BIND)
+            if replica is not None:
+                return replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def _sticky_to_primary():
+    if not has_request_context():
+        return False
+    return flask_session.get('_db_primary_until', 0) > time.time()
+
+
+@contextmanager
+def read_replica():
+    """Route SELECTs in this block to the replica (a no-op without one)."""
+    token = _use_replica.set(not _sticky_to_primary())
+    try:
+        yield
+    finally:
+        _use_replica.reset(token)
+
+
+@contextmanager
+def primary():
+    """Force the primary inside a read_replica() block, e.g. for authorization checks."""
+    token = _use_replica.set(False)
+    try:
+        yield
+    finally:
+        _use_replica.reset(token)
+
+
+def replica_reads(view):
+    """View decorator: the view's SELECTs may be served by the replica."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        with read_replica():
+            return view(*args, **kwargs)
+    return wrapper
+
+
+def remember_writes(db):
+    """after_request hook: keep a client on the primary for a while after it wrote."""
+    def hook(response):
+        if db.session().info.get('wrote'):
+            flask_session['_db_primary_until'] = time.time() + current_app.config.get('DB_REPLICA_STICKY_SECONDS', 5)
+        return response
+    return hook
@@ -0,0 +1,43 @@
+# app/db_utils.py
+# Small SQL helpers shared by the modules that maintain derived tables.
+from sqlalchemy.dialects import postgresql, sqlite
+
+from app import db
+
+
+def _native_insert(dialect, caller):
+    # The dialect's insert(), which has on_conflict_do_update/do_nothing.
+    if dialect == 'postgresql':
+        return postgresql.insert
+    if dialect == 'sqlite':
+        return sqlite.insert
+    raise NotImplementedError(f"{caller} does not support the {dialect} dialect")
+
+
+def upsert(model, values, key_columns, update_columns=None):
+    """INSERT a row, or UPDATE it if a row with the same key already exists.
+
+    Uses the native ON CONFLICT clause (PostgreSQL and SQLite both have it), so
+    it is a single statement with no SELECT first and no race between workers.
+    update_columns maps column name -> value/expression to apply on conflict;
+    by default every non-key value is overwritten.
+    """
+    insert = _native_insert(db.session.get_bind(mapper=model.__mapper__).dialect.name, 'upsert()')
+    statement = insert(model.__table__).values(**values)
+    if update_columns is None:
+        update_columns = {name: statement.excluded[name] for name in values if name not in key_columns}
+    statement = statement.on_conflict_do_update(index_elements=key_columns, set_=update_columns)
+    return db.session.execute(statement)
+
+
+def insert_ignore(connection, table, values, key_columns=None):
+    """INSERT a row unless it clashes with an existing one; returns its primary key, or None.
+
+    key_columns are the unique columns checked (default: the primary key).
+    Uses ON CONFLICT DO NOTHING instead of catching IntegrityError, so the
+    transaction stays usable. connection may also be the session.
+    """
+    bind = connection.get_bind() if hasattr(connection, 'get_bind') else connection
+    insert = _native_insert(bind.dialect.name, 'insert_ignore()')
+    result = connection.execute(insert(table).values(**values).on_conflict_do_nothing(index_elements=key_columns))
+    return result.inserted_primary_key[0] if result.rowcount == 1 else None
@@ -1,18 +1,22 @@
 # app/email_alerts.py
-from flask_mail import Message
-from app import mail # CORRECT: Import the globally initialized mail instance from app/__init__.py
-# No need for configure_mail function or Mail() instance here.
+import logging
+from app.metrics import ERRORS
+from app.outbox import enqueue_email # Alerts are queued and delivered by the outbox workers
+
+logger = logging.getLogger(__name__)
 
 def send_alert_email(to_email, username, ip):
+    # Queue the alert instead of talking to SMTP on the request thread.
+    # Repeated alerts for the same user and IP inside OUTBOX_DEDUPE_WINDOW are dropped.
     try:
-        msg = Message(
+        queued = enqueue_email(
+            recipient=to_email,
             subject="🚨 Suspicious Login Detected",
-            sender=mail.default_sender, # Use the default sender from config
-            recipients=[to_email],
-            body=f"Suspicious login detected for user: {username}\nIP Address: {ip}"
+            body=f"Suspicious login detected for user: {username}\nIP Address: {ip}",
+            dedupe_key=f"suspicious-login:{username}:{ip}",
         )
-        mail.send(msg)
-        print(f"✅ Alert email sent to {to_email} for {username}.")
-    except Exception as e:
-        # Log the actual error for debugging
-        print(f"[EMAIL ERROR] Failed to send suspicious login alert to {to_email}: {e}")
\ No newline at end of file
+        if queued:
+            logger.info("Alert email queued for %s (%s)", to_email, username)
+    except Exception:
+        logger.exception("Failed to queue suspicious login alert to %s", to_email)
+        ERRORS.inc(component='email_alerts')
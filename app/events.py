@@ -0,0 +1,251 @@
+# app/events.py
+# Login event pipeline. A successful login used to score the model, write
+# LoginActivity, update the profile and queue alerts before redirecting; now
+# the request only records a compact LoginEvent and returns. Where the rest
+# happens depends on LOGIN_EVENTS_MODE:
+#
+#   inline  - synchronously in the request (the old behaviour; alerts can be flashed)
+#   thread  - a bounded in-memory queue drained in batches by a daemon thread in
+#             each web worker. Events still queued when a worker is killed are lost.
+#   worker  - the request INSERTs the LoginActivity row with is_suspicious NULL,
+#             and `flask login-event-worker` scores pending rows in batches.
+#             Durable, and the web process never loads the model. Run one consumer.
+#
+# When the thread-mode queue is full, LOGIN_EVENTS_OVERFLOW decides: 'inline'
+# processes the event in the request, 'block' waits up to
+# LOGIN_EVENTS_BLOCK_TIMEOUT for room first, and 'drop' discards it (counted).
+import logging
+import atexit
+import os
+import queue
+import threading
+from collections import namedtuple
+from datetime import datetime
+
+import numpy as np
+from flask import current_app
+from sqlalchemy import insert, select, update
+
+from app import db
+from app.models import LoginActivity, User
+from app.ai.detect_anomaly import score_batch
+from app.ai.model_registry import model_registry
+from app.ai.online import online_detector
+from app.ai.shadow import shadow_models
+from app.email_alerts import send_alert_email
+from app.metrics import ERRORS
+from app.profiles import profile_store
+from app.stats import record_activity
+
+logger = logging.getLogger(__name__)
+
+LoginEvent = namedtuple('LoginEvent', ['username', 'email', 'ip_address', 'timestamp', 'recent_failures'])
+
+
+def _score_and_record(usernames, ips, timestamps, failures):
+    # Profile features for each login (history *before* it), folded into the
+    # locked profile rows in order, then one model.predict for the whole batch.
+    # The online detector (app/ai/online.py) scores and learns the same logins.
+    profiles = profile_store.record_many(usernames, ips, timestamps)
+
+    try:
+        loaded = model_registry.get()
+        flags, scores = score_batch(usernames, ips, loaded, profiles if loaded.encoder.use_profile else None,
+                                    return_scores=True)
+        shadow_models.submit(usernames, ips, profiles, loaded.version, scores)
+    except Exception:
+        logger.exception("Scoring failed for %d login(s)", len(usernames))
+        ERRORS.inc(component='login_events')
+        flags = np.zeros(len(usernames), dtype=bool)
+
+    if online_detector.enabled:
+        try:
+            flags = online_detector.combine(flags, online_detector.score_learn(ips, timestamps, profiles))
+        except Exception:
+            logger.exception("Online scoring failed for %d login(s)", len(usernames))
+            ERRORS.inc(component='online_detector')
+
+    threshold = current_app.config.get('ANOMALY_FAILURE_THRESHOLD', 0)
+    if threshold:
+        flags = flags | (np.asarray(failures) >= threshold)
+    return [bool(flag) for flag in flags]
+
+
+def process_events(events):
+    """Score a batch of LoginEvents, insert their LoginActivity rows and queue alerts.
+
+    Returns the list of is_suspicious flags, in event order.
+    """
+    if not events:
+        return []
+    usernames, emails, ips, timestamps, failures = zip(*events)
+    flags = _score_and_record(usernames, ips, timestamps, failures)
+    db.session.execute(insert(LoginActivity), [
+        {'username': username, 'ip_address': ip, 'timestamp': when, 'is_suspicious': flag}
+        for username, ip, when, flag in zip(usernames, ips, timestamps, flags)
+    ])
+    record_activity(timestamps, flags)
+    db.session.commit()
+    for event, flag in zip(events, flags):
+        if flag:
+            send_alert_email(event.email, event.username, event.ip_address)
+    return flags
+
+
+def process_pending(batch_size=500):
+    """Worker mode: score one batch of LoginActivity rows still marked NULL.
+
+    Returns the number of rows handled.
+    """
+    rows = db.session.execute(
+        select(LoginActivity.id, LoginActivity.username, LoginActivity.ip_address, LoginActivity.timestamp)
+        .where(LoginActivity.is_suspicious.is_(None))
+        .order_by(LoginActivity.id)
+        .limit(batch_size)
+    ).all()
+    if not rows:
+        return 0
+    ids, usernames, ips, timestamps = zip(*rows)
+    # Rate-limiter failure counts live in the web workers' memory, so they can't reach us here.
+    flags = _score_and_record(usernames, ips, timestamps, [0] * len(rows))
+    db.session.execute(update(LoginActivity), [
+        {'id': row_id, 'is_suspicious': flag} for row_id, flag in zip(ids, flags)
+    ])
+    # Counted once scored, so worker mode's rollups lag by one polling interval.
+    record_activity(timestamps, flags)
+    db.session.commit()
+
+    flagged = {(username, ip) for username, ip, flag in zip(usernames, ips, flags) if flag}
+    if flagged:
+        emails = dict(db.session.execute(
+            select(User.username, User.email).where(User.username.in_({u for u, _ in flagged}))
+        ).all())
+        for username, ip in flagged:
+            if username in emails:
+                send_alert_email(emails[username], username, ip)
+    return len(rows)
+
+
+class LoginEventPipeline:
+    # In-process queue and consumer thread for LOGIN_EVENTS_MODE=thread. Like the
+    # outbox workers, the thread starts lazily and is restarted after a fork.
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._queue = None
+        self._thread = None
+        self._pid = None
+        self.counters = {'submitted': 0, 'processed': 0, 'batches': 0, 'dropped': 0,
+                         'overflow_inline': 0, 'failed': 0}
+
+    def submit(self, event):
+        """Hand a LoginEvent to the pipeline.
+
+        Returns its is_suspicious flag when it was processed right away, or None
+        when it was queued (or dropped).
+        """
+        app = current_app._get_current_object()
+        config = app.config
+        mode = config.get('LOGIN_EVENTS_MODE', 'thread')
+        self.counters['submitted'] += 1
+
+        if mode == 'worker':
+            # A Core insert, so is_suspicious really is NULL rather than the column default.
+            db.session.execute(insert(LoginActivity).values(
+                username=event.username, ip_address=event.ip_address,
+                timestamp=event.timestamp, is_suspicious=None))
+            db.session.commit()
+            return None
+        if mode != 'thread':
+            return self._process_now([event])
+
+        self._ensure_started(app)
+        overflow = config.get('LOGIN_EVENTS_OVERFLOW', 'inline')
+        try:
+            if overflow == 'block':
+                self._queue.put(event, timeout=config.get('LOGIN_EVENTS_BLOCK_TIMEOUT', 0.05))
+            else:
+                self._queue.put_nowait(event)
+            return None
+        except queue.Full:
+            pass
+        if overflow == 'drop':
+            self.counters['dropped'] += 1
+            logger.warning("Queue full, dropped login event for %s", event.username)
+            return None
+        self.counters['overflow_inline'] += 1
+        return self._process_now([event])
+
+    def _process_now(self, events):
+        flags = process_events(events)
+        self.counters['processed'] += len(events)
+        self.counters['batches'] += 1
+        return flags[0]
+
+    def _ensure_started(self, app):
+        if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+                return
+            if self._pid != os.getpid():
+                self._queue = queue.Queue(maxsize=app.config.get('LOGIN_EVENTS_QUEUE_SIZE', 10000))
+                atexit.register(self.flush, app)
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, args=(app,), name='login-events', daemon=True)
+            self._thread.start()
+
+    def _take_batch(self, batch_size, timeout):
+        try:
+            batch = [self._queue.get(timeout=timeout)]
+        except queue.Empty:
+            return []
+        while len(batch) < batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self, app):
+        batch_size = app.config.get('LOGIN_EVENTS_BATCH_SIZE', 500)
+        while True:
+            batch = self._take_batch(batch_size, timeout=1.0)
+            if not batch:
+                continue
+            try:
+                with app.app_context():
+                    process_events(batch)
+                self.counters['processed'] += len(batch)
+                self.counters['batches'] += 1
+            except Exception:
+                self.counters['failed'] += len(batch)
+                logger.exception("Failed to record %d login event(s)", len(batch))
+                ERRORS.inc(component='login_events')
+
+    def flush(self, app):
+        """Process whatever is still queued, in the calling thread (used at exit)."""
+        if self._queue is None or self._pid != os.getpid():
+            return
+        batch_size = app.config.get('LOGIN_EVENTS_BATCH_SIZE', 500)
+        with app.app_context():
+            while True:
+                batch = self._take_batch(batch_size, timeout=0)
+                if not batch:
+                    return
+                process_events(batch)
+
+    def stats(self):
+        stats = dict(self.counters)
+        stats['queued'] = self._queue.qsize() if self._queue is not None and self._pid == os.getpid() else 0
+        stats['mode'] = current_app.config.get('LOGIN_EVENTS_MODE', 'thread')
+        return stats
+
+
+login_events = LoginEventPipeline()
+
+
+def record_login(user, ip_address, recent_failures=0):
+    """Record a successful login. Returns is_suspicious if known now, else None."""
+    return login_events.submit(LoginEvent(user.username, user.email, ip_address,
+                                          datetime.utcnow(), recent_failures))
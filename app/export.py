@@ -0,0 +1,207 @@
+# app/export.py
+# Activity log exports that never hold the whole table in memory.
+# CSV and NDJSON are generated row by row from a server-side cursor and
+# streamed straight into the HTTP response. PDF needs wkhtmltopdf, which wants
+# a complete document, so it runs as a background job: the HTML is streamed
+# into a file on disk chunk by chunk, converted to PDF there, and the admin
+# downloads the result from a link.
+#
+# Each worker renders at most EXPORT_PDF_WORKERS PDFs at a time. Asking again
+# for an export that is already rendering returns the running job; anything
+# beyond that is refused (ExportsBusy, answered with 429) rather than queued.
+import logging
+import csv
+import io
+import json
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app
+from sqlalchemy import select
+
+from app import db
+from app.activity import apply_filters
+from app.models import LoginActivity
+
+logger = logging.getLogger(__name__)
+
+EXPORT_COLUMNS = ['timestamp', 'username', 'ip_address', 'is_suspicious']
+DEFAULT_CHUNK_SIZE = 2000
+# Job ids are uuid4 hex strings; anything else is rejected before touching the filesystem.
+_JOB_ID = re.compile(r'^[0-9a-f]{32}$')
+
+
+class ExportsBusy(RuntimeError):
+    # Every PDF render slot on this worker is taken; callers answer 429.
+    pass
+
+
+def iter_activity(filters, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Yield (timestamp, username, ip_address, is_suspicious) rows, newest first.
+
+    stream_results makes PostgreSQL use a server-side cursor, so only one
+    chunk of rows is in memory at a time.
+    """
+    query = apply_filters(
+        select(LoginActivity.timestamp, LoginActivity.username,
+               LoginActivity.ip_address, LoginActivity.is_suspicious),
+        filters,
+    ).order_by(LoginActivity.timestamp.desc(), LoginActivity.id.desc())
+    result = db.session.execute(query.execution_options(stream_results=True, yield_per=chunk_size))
+    try:
+        for row in result:
+            yield row
+    finally:
+        result.close()
+
+
+def csv_chunks(rows, rows_per_chunk=500):
+    """Encode rows as CSV, yielding a string every rows_per_chunk rows."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    pending = 0
+    for timestamp, username, ip_address, is_suspicious in rows:
+        writer.writerow([timestamp.isoformat(), username, ip_address, 'yes' if is_suspicious else 'no'])
+        pending += 1
+        if pending >= rows_per_chunk:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            pending = 0
+    yield buffer.getvalue()
+
+
+def ndjson_chunks(rows, rows_per_chunk=500):
+    """Encode rows as newline-delimited JSON, yielding every rows_per_chunk rows."""
+    lines = []
+    for timestamp, username, ip_address, is_suspicious in rows:
+        lines.append(json.dumps({
+            'timestamp': timestamp.isoformat(),
+            'username': username,
+            'ip_address': ip_address,
+            'is_suspicious': bool(is_suspicious),
+        }))
+        if len(lines) >= rows_per_chunk:
+            yield '\n'.join(lines) + '\n'
+            lines = []
+    if lines:
+        yield '\n'.join(lines) + '\n'
+
+
+def _export_dir():
+    path = current_app.config.get('EXPORT_DIR') or os.path.join(current_app.instance_path, 'exports')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _job_dir(job_id):
+    if not _JOB_ID.match(job_id or ''):
+        return None
+    return os.path.join(_export_dir(), job_id)
+
+
+def _purge_old_jobs(max_age_seconds):
+    cutoff = time.time() - max_age_seconds
+    root = _export_dir()
+    for name in os.listdir(root):
+        path = os.path.join(root, name)
+        if _JOB_ID.match(name) and os.path.getmtime(path) < cutoff:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+class _PdfRenders:
+    # The render threads of this process, and which filters they are rendering.
+
+    def __init__(self):
+        self._executor = None
+        self._pid = None
+        self._running = {}  # filters key -> job id
+        self._lock = threading.Lock()
+
+    def start(self, app, filters):
+        workers = max(1, int(app.config.get('EXPORT_PDF_WORKERS', 1)))
+        key = tuple(sorted(filters.items()))
+        with self._lock:
+            # Created on first use and re-created after a fork: threads don't
+            # survive one, and neither do the renders they were running.
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='pdf-export')
+                self._pid = os.getpid()
+                self._running = {}
+            running = self._running
+            if key in running:
+                return running[key]
+            if len(running) >= workers:
+                raise ExportsBusy(f'{len(running)} PDF exports are already rendering')
+            job_id = uuid.uuid4().hex
+            os.makedirs(_job_dir(job_id))
+            running[key] = job_id
+            future = self._executor.submit(_render_pdf, app, job_id, filters)
+        future.add_done_callback(lambda _future: self._finished(running, key))
+        return job_id
+
+    def _finished(self, running, key):
+        with self._lock:
+            running.pop(key, None)
+
+
+_pdf_renders = _PdfRenders()
+
+
+def start_pdf_export(filters):
+    """Start rendering a PDF of the filtered activity log in the background.
+
+    Returns the job id, which is that of the running job if the same filters
+    are already being rendered. Raises ExportsBusy when every render slot is
+    taken. Job state lives on disk under EXPORT_DIR, so any worker on the same
+    host can answer status and download requests for it.
+    """
+    app = current_app._get_current_object()
+    _purge_old_jobs(app.config.get('EXPORT_MAX_AGE_SECONDS', 86400))
+    return _pdf_renders.start(app, filters)
+
+
+def _render_pdf(app, job_id, filters):
+    with app.app_context():
+        job_dir = _job_dir(job_id)
+        html_path = os.path.join(job_dir, 'activity_log.html')
+        try:
+            # Template.generate() renders lazily while the row generator feeds
+            # it, so the HTML goes to disk without ever being a single string.
+            template = app.jinja_env.get_template('activity_log_pdf.html')
+            with open(html_path, 'w', encoding='utf-8') as f:
+                for piece in template.generate(logs=iter_activity(filters)):
+                    f.write(piece)
+
+            import pdfkit  # only export workers need it
+            tmp_path = os.path.join(job_dir, 'activity_log.pdf.tmp')
+            pdfkit.from_file(html_path, tmp_path)
+            os.replace(tmp_path, os.path.join(job_dir, 'activity_log.pdf'))
+        except Exception as e:
+            logger.exception("PDF export %s failed", job_id)
+            with open(os.path.join(job_dir, 'error.txt'), 'w') as f:
+                f.write(str(e))
+        finally:
+            if os.path.exists(html_path):
+                os.remove(html_path)
+
+
+def pdf_export_status(job_id):
+    """Return ('missing' | 'pending' | 'done' | 'failed', pdf_path_or_error)."""
+    job_dir = _job_dir(job_id)
+    if job_dir is None or not os.path.isdir(job_dir):
+        return 'missing', None
+    pdf_path = os.path.join(job_dir, 'activity_log.pdf')
+    if os.path.exists(pdf_path):
+        return 'done', pdf_path
+    error_path = os.path.join(job_dir, 'error.txt')
+    if os.path.exists(error_path):
+        with open(error_path) as f:
+            return 'failed', f.read()
+    return 'pending', None
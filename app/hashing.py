@@ -0,0 +1,177 @@
+# app/hashing.py
+# Password hashing off the request thread. scrypt/pbkdf2 are deliberately
+# CPU-bound; run inline they hold the GIL and stall every other request in the
+# worker. Hashes and verifications are submitted to a small process pool
+# instead, and admission is bounded: when HASH_WORKERS + HASH_QUEUE_SIZE jobs
+# are already in flight, new ones fail fast with HashingOverloaded (the routes
+# turn that into a 503) rather than queueing until the request times out. A
+# job counts as in flight until the pool finishes it, even if the request
+# stopped waiting for it.
+#
+# PASSWORD_HASH_METHOD is the werkzeug method string, cost included
+# (e.g. "scrypt:32768:8:1" or "pbkdf2:sha256:1000000"). Stored hashes made with
+# different parameters are upgraded the next time their owner logs in.
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from app.metrics import record_phase
+
+logger = logging.getLogger(__name__)
+
+
+class HashingOverloaded(RuntimeError):
+    # Too many hashes already queued; callers should shed the request (503).
+    pass
+
+
+def _hash_job(password, method):
+    started = time.time()
+    result = generate_password_hash(password, method)
+    return result, started, time.time()
+
+
+def _verify_job(stored_hash, password):
+    started = time.time()
+    result = check_password_hash(stored_hash, password)
+    return result, started, time.time()
+
+
+class PasswordHasher:
+    def __init__(self):
+        self.method = 'scrypt:32768:8:1'
+        self.workers = 0
+        self.queue_size = 0
+        self.timeout = 10.0
+        self._slots = None
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._normalized_method = None
+        self._stats = {'hashes': 0, 'verifications': 0, 'rejected': 0, 'in_flight': 0,
+                       'queue_wait_seconds': 0.0, 'hash_seconds': 0.0,
+                       'max_queue_wait_seconds': 0.0, 'max_hash_seconds': 0.0}
+
+    def init_app(self, app):
+        config = app.config
+        self.method = config.get('PASSWORD_HASH_METHOD', self.method)
+        self.workers = config.get('HASH_WORKERS', 1)
+        self.queue_size = config.get('HASH_QUEUE_SIZE', 32)
+        self.timeout = config.get('HASH_TIMEOUT', 10.0)
+        self._slots = threading.BoundedSemaphore(max(self.workers, 1) + self.queue_size)
+        self._normalized_method = None
+        app.extensions['password_hasher'] = self
+
+    def _pool(self):
+        # Created on first use and re-created after a fork: a pool inherited
+        # from the gunicorn master would point at processes we don't own.
+        if self._executor is not None and self._pid == os.getpid():
+            return self._executor
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                # forkserver children don't inherit this process's threads or locks.
+                methods = multiprocessing.get_all_start_methods()
+                context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+                self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+                self._pid = os.getpid()
+        return self._executor
+
+    def _drop_pool(self, error):
+        # The next call builds a new pool.
+        logger.error("Process pool broken, hashing inline: %s", error)
+        with self._lock:
+            self._executor = None
+
+    def _run(self, kind, job, *args):
+        if self._slots is None:
+            self._slots = threading.BoundedSemaphore(max(self.workers, 1) + self.queue_size)
+        slots = self._slots
+        if not slots.acquire(blocking=False):
+            with self._lock:
+                self._stats['rejected'] += 1
+            raise HashingOverloaded('password hashing queue is full')
+        with self._lock:
+            self._stats['in_flight'] += 1
+
+        def release(_future=None):
+            slots.release()
+            with self._lock:
+                self._stats['in_flight'] -= 1
+
+        submitted = time.time()
+        future = None
+        if self.workers > 0:
+            try:
+                future = self._pool().submit(job, *args)
+            except BrokenProcessPool as e:
+                self._drop_pool(e)
+        if future is None:
+            try:
+                result, started, finished = job(*args)
+            finally:
+                release()
+        else:
+            # The slot is held until the job is done or cancelled, not just until
+            # we stop waiting for it: a request that times out must not free room
+            # for another job while its own still occupies the pool.
+            future.add_done_callback(release)
+            try:
+                result, started, finished = future.result(timeout=self.timeout)
+            except FutureTimeout:
+                future.cancel()  # succeeds only while it is still queued
+                with self._lock:
+                    self._stats['rejected'] += 1
+                raise HashingOverloaded(f'password hashing took longer than {self.timeout}s')
+            except BrokenProcessPool as e:
+                # A pool process died (OOM kill, bad start method...): answer this one inline.
+                self._drop_pool(e)
+                submitted = time.time()
+                result, started, finished = job(*args)
+
+        queue_wait = max(0.0, started - submitted)
+        hash_time = finished - started
+        record_phase('password_hash_queue', queue_wait)
+        record_phase('password_hash', hash_time)
+        with self._lock:
+            stats = self._stats
+            stats[kind] += 1
+            stats['queue_wait_seconds'] += queue_wait
+            stats['hash_seconds'] += hash_time
+            stats['max_queue_wait_seconds'] = max(stats['max_queue_wait_seconds'], queue_wait)
+            stats['max_hash_seconds'] = max(stats['max_hash_seconds'], hash_time)
+        return result
+
+    def hash(self, password):
+        """Hash a password with the configured method. May raise HashingOverloaded."""
+        return self._run('hashes', _hash_job, password, self.method)
+
+    def verify(self, stored_hash, password):
+        """Check a password against a stored hash. May raise HashingOverloaded."""
+        if not stored_hash or password is None:
+            return False
+        return self._run('verifications', _verify_job, stored_hash, password)
+
+    def needs_rehash(self, stored_hash):
+        """True if stored_hash was made with a different method or cost than configured."""
+        if self._normalized_method is None:
+            # werkzeug fills in defaults ("scrypt" -> "scrypt:32768:8:1"); hash once to see them.
+            self._normalized_method = generate_password_hash('', self.method).split('$', 1)[0]
+        return stored_hash.split('$', 1)[0] != self._normalized_method
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        done = stats['hashes'] + stats['verifications']
+        stats['avg_queue_wait_seconds'] = stats['queue_wait_seconds'] / done if done else 0.0
+        stats['avg_hash_seconds'] = stats['hash_seconds'] / done if done else 0.0
+        stats.update(method=self.method, workers=self.workers, queue_size=self.queue_size, pid=os.getpid())
+        return stats
+
+
+password_hasher = PasswordHasher()
@@ -0,0 +1,54 @@
+# app/logging_setup.py
+# One handler for every "app.*" logger. LOG_FORMAT=json writes one JSON object
+# per line (for log shippers); the default text format is for humans. Anything
+# passed via extra={...} comes out as fields in either format.
+import json
+import logging
+import sys
+from datetime import datetime, timezone
+
+# Attributes every LogRecord has; anything else was passed via extra=.
+_STANDARD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+def _extra_fields(record):
+    return {key: value for key, value in vars(record).items() if key not in _STANDARD_ATTRS}
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        entry.update(_extra_fields(record))
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__('%(asctime)s %(levelname)s %(name)s: %(message)s')
+
+    def format(self, record):
+        line = super().format(record)
+        fields = _extra_fields(record)
+        if fields:
+            line += ' ' + ' '.join(f'{key}={value}' for key, value in fields.items())
+        return line
+
+
+def configure_logging(app):
+    logger = logging.getLogger('app')
+    logger.setLevel(app.config.get('LOG_LEVEL', 'INFO'))
+    formatter = JsonFormatter() if app.config.get('LOG_FORMAT') == 'json' else TextFormatter()
+    handler = next((h for h in logger.handlers if getattr(h, '_francis', False)), None)
+    if handler is None:
+        handler = logging.StreamHandler(sys.stderr)
+        handler._francis = True
+        logger.addHandler(handler)
+    handler.setFormatter(formatter)
+    logger.propagate = False
@@ -0,0 +1,247 @@
+# app/metrics.py
+# In-process metrics in the Prometheus text format, served at /metrics.
+# Request hooks on the main blueprint time every request, and phase() /
+# record_phase() time the expensive parts of one: database queries (via
+# SQLAlchemy cursor events), password hashing, model inference and mail
+# sending. Each request also gets one structured log line with its per-phase
+# breakdown, so a slow login can be explained without attaching a profiler.
+#
+# Metrics are per process; with several gunicorn workers each scrape sees the
+# worker that answered it, so aggregate with sum()/rate() in Prometheus.
+import hmac
+import logging
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from flask import Response, current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+request_log = logging.getLogger('app.requests')
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs.extend(f'{name}="{value}"' for name, value in extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1.0, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{_labels(self.labelnames, key)} {value:g}')
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # label values -> [per-bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, series):
+                    cumulative += count
+                    lines.append(f'{self.name}_bucket{_labels(self.labelnames, key, [("le", f"{bound:g}")])} {cumulative}')
+                cumulative += series[len(self.buckets)]
+                lines.append(f'{self.name}_bucket{_labels(self.labelnames, key, [("le", "+Inf")])} {cumulative}')
+                lines.append(f'{self.name}_sum{_labels(self.labelnames, key)} {series[-1]:.6f}')
+                lines.append(f'{self.name}_count{_labels(self.labelnames, key)} {cumulative}')
+        return lines
+
+
+class Gauge:
+    # Read at scrape time from a callback, e.g. a queue length.
+    def __init__(self, name, documentation, callback):
+        self.name = name
+        self.documentation = documentation
+        self.callback = callback
+
+    def render(self):
+        try:
+            value = float(self.callback())
+        except Exception:
+            return []
+        return [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} gauge', f'{self.name} {value:g}']
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = {}
+
+    def _register(self, metric):
+        return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def gauge(self, name, documentation, callback):
+        return self._register(Gauge(name, documentation, callback))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+REQUEST_SECONDS = registry.histogram(
+    'francis_request_duration_seconds', 'HTTP request latency by endpoint.', ['endpoint', 'method', 'status'])
+PHASE_SECONDS = registry.histogram(
+    'francis_phase_duration_seconds', 'Time spent in one phase of the work (hashing, inference, mail...).', ['phase'])
+DB_QUERY_SECONDS = registry.histogram(
+    'francis_db_query_duration_seconds', 'SQL statement execution time by statement type.', ['operation'])
+POOL_WAIT_SECONDS = registry.histogram(
+    'francis_db_pool_wait_seconds', 'Time spent waiting to check a connection out of the pool.', ['bind'])
+ERRORS = registry.counter('francis_errors_total', 'Errors handled and logged, by component.', ['component'])
+
+
+def record_phase(phase, seconds):
+    """Add an already-measured duration to the phase histogram and the current request."""
+    PHASE_SECONDS.observe(seconds, phase=phase)
+    if has_request_context() and hasattr(g, 'metrics_phases'):
+        g.metrics_phases[phase] = g.metrics_phases.get(phase, 0.0) + seconds
+
+
+@contextmanager
+def phase(name):
+    """Time the block as phase `name`."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_phase(name, time.perf_counter() - started)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('metrics_query_started', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stack = conn.info.get('metrics_query_started')
+    if not stack:
+        return
+    elapsed = time.perf_counter() - stack.pop()
+    DB_QUERY_SECONDS.observe(elapsed, operation=statement.lstrip().split(None, 1)[0].upper() if statement.strip() else '')
+    if has_request_context() and hasattr(g, 'metrics_phases'):
+        g.metrics_phases['db'] = g.metrics_phases.get('db', 0.0) + elapsed
+        g.metrics_queries += 1
+
+
+_engine_events_installed = False
+
+
+def init_app(app):
+    """Install the SQLAlchemy timing hooks (once per process) and the scrape-time gauges."""
+    global _engine_events_installed
+    if not _engine_events_installed:
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+        _engine_events_installed = True
+
+    from app import db
+    from app.events import login_events
+    from app.hashing import password_hasher
+    registry.gauge('francis_password_hash_in_flight', 'Password hash jobs running or queued.',
+                   lambda: password_hasher.stats()['in_flight'])
+    registry.gauge('francis_login_events_queued', 'Login events waiting for the consumer thread.',
+                   lambda: login_events._queue.qsize() if login_events._queue is not None else 0)
+    with app.app_context():
+        engine = db.engine
+    registry.gauge('francis_db_pool_checked_out', 'Primary database connections currently checked out.',
+                   lambda: engine.pool.checkedout())
+    app.extensions['metrics'] = registry
+
+
+def _start_request():
+    g.metrics_started = time.perf_counter()
+    g.metrics_phases = {}
+    g.metrics_queries = 0
+
+
+def _finish_request(response):
+    started = g.pop('metrics_started', None)
+    if started is None:
+        return response
+    elapsed = time.perf_counter() - started
+    endpoint = request.endpoint or 'unmatched'
+    REQUEST_SECONDS.observe(elapsed, endpoint=endpoint, method=request.method, status=response.status_code)
+    request_log.info('%s %s %s %.1fms', request.method, request.path, response.status_code, elapsed * 1000, extra={
+        'endpoint': endpoint,
+        'status': response.status_code,
+        'duration_ms': round(elapsed * 1000, 2),
+        'db_queries': g.get('metrics_queries', 0),
+        'phases_ms': {name: round(seconds * 1000, 2) for name, seconds in g.get('metrics_phases', {}).items()},
+    })
+    return response
+
+
+def instrument_blueprint(blueprint):
+    """Time every request handled by blueprint and serve /metrics from it."""
+    blueprint.before_request(_start_request)
+    blueprint.after_request(_finish_request)
+
+    @blueprint.route('/metrics')
+    def metrics():
+        if not _may_scrape():
+            return Response('unauthorized\n', status=401, mimetype='text/plain')
+        return Response(registry.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+
+def _may_scrape():
+    # Scrapers send "Authorization: Bearer <METRICS_TOKEN>"; admins can look in
+    # the browser. Open access only when METRICS_PUBLIC says so explicitly.
+    config = current_app.config
+    if config.get('METRICS_PUBLIC'):
+        return True
+    token = config.get('METRICS_TOKEN')
+    if token and hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return True
+    from flask_login import current_user
+    from app.user_cache import user_cache
+
+    return current_user.is_authenticated and user_cache.is_admin(current_user.id)
@@ -2,38 +2,124 @@
 from app import db # CORRECT: Import the db instance from your app package's __init__.py
 from datetime import datetime
 from flask_login import UserMixin # Needed for Flask-Login
-from itsdangerous import TimedSerializer as Serializer # For secure, time-limited tokens
-from flask import current_app # To access SECRET_KEY from app config
 
 class User(db.Model, UserMixin): # Inherit from UserMixin
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(80), unique=True, nullable=False)
     email = db.Column(db.String(120), unique=True, nullable=False)
-    password = db.Column(db.String(128), nullable=False) # For hashed passwords
+    password = db.Column(db.String(255), nullable=False) # For hashed passwords (scrypt hashes are ~162 chars)
     is_admin = db.Column(db.Boolean, default=False) # is_admin column
 
     def __repr__(self):
         return f'<User {self.username}>'
 
-    # Method to generate a password reset token
-    def get_reset_token(self, expires_sec=1800): # Token valid for 30 minutes (1800 seconds)
-        s = Serializer(current_app.config['SECRET_KEY'], expires_sec)
-        return s.dumps({'user_id': self.id}).decode('utf-8')
+    # Password reset tokens (app/tokens.py): signed, expiring and single-use.
+    def get_reset_token(self):
+        from app.tokens import reset_tokens
+        return reset_tokens.issue(self)
 
-    # Static method to verify a password reset token
     @staticmethod
     def verify_reset_token(token):
-        s = Serializer(current_app.config['SECRET_KEY'])
-        try:
-            user_id = s.loads(token)['user_id']
-        except:
-            return None # Token is invalid or expired
-        return User.query.get(user_id)
+        from app.tokens import reset_tokens
+        return reset_tokens.verify(token) # None if invalid, expired or already used
 
 
 class LoginActivity(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(150), nullable=False)
     ip_address = db.Column(db.String(100), nullable=False)
-    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
-    is_suspicious = db.Column(db.Boolean, default=False)
\ No newline at end of file
+    timestamp = db.Column(db.DateTime, nullable=False, default=datetime.utcnow) # partition key when partitioned
+    is_suspicious = db.Column(db.Boolean, default=False)
+
+    # Every read path filters by one of these and orders/ranges by time.
+    __table_args__ = (
+        db.Index('ix_login_activity_timestamp', 'timestamp'),
+        db.Index('ix_login_activity_username_timestamp', 'username', 'timestamp'),
+        db.Index('ix_login_activity_ip_address_timestamp', 'ip_address', 'timestamp'),
+        db.Index('ix_login_activity_is_suspicious_timestamp', 'is_suspicious', 'timestamp'),
+    )
+
+
+class LoginActivityDaily(db.Model):
+    # Per-user daily totals that LoginActivity rows are rolled up into before
+    # they are pruned by the retention job (see app/retention.py).
+    day = db.Column(db.Date, primary_key=True)
+    username = db.Column(db.String(150), primary_key=True)
+    logins = db.Column(db.Integer, nullable=False, default=0)
+    suspicious_logins = db.Column(db.Integer, nullable=False, default=0)
+    distinct_ips = db.Column(db.Integer, nullable=False, default=0)
+
+class OutboxMessage(db.Model):
+    # Emails waiting to be delivered by the outbox workers (see app/outbox.py).
+    id = db.Column(db.Integer, primary_key=True)
+    recipient = db.Column(db.String(120), nullable=False)
+    subject = db.Column(db.String(255), nullable=False)
+    body = db.Column(db.Text, nullable=False)
+    # Messages with the same key inside the dedupe window are only queued once;
+    # unique, and cleared on the old message when the window has passed.
+    dedupe_key = db.Column(db.String(255), unique=True, index=True)
+    status = db.Column(db.String(16), nullable=False, default='pending') # pending, sending, sent, failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    claimed_by = db.Column(db.String(32), index=True) # worker claim token while sending
+    claimed_at = db.Column(db.DateTime)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime)
+    last_error = db.Column(db.Text)
+
+    __table_args__ = (
+        db.Index('ix_outbox_message_status_next_attempt_at', 'status', 'next_attempt_at'),
+    )
+
+
+class UserProfile(db.Model):
+    # Incrementally maintained login history per username (see app/profiles.py).
+    username = db.Column(db.String(150), primary_key=True)
+    login_count = db.Column(db.Integer, nullable=False, default=0)
+    first_seen = db.Column(db.DateTime)
+    last_seen = db.Column(db.DateTime)
+    known_ips = db.Column(db.Text, nullable=False, default='') # comma-separated, most recent first
+    hour_histogram = db.Column(db.String(200), nullable=False, default='') # 24 comma-separated counts (UTC hours)
+    recent_rate = db.Column(db.Float, nullable=False, default=0.0) # exponentially decayed login count
+
+
+class ActivityRollup(db.Model):
+    # Login counts per minute and per hour, kept current by the login event
+    # pipeline and corrected by `flask compact-stats` (see app/stats.py).
+    granularity = db.Column(db.String(8), primary_key=True) # 'minute' or 'hour'
+    bucket = db.Column(db.DateTime, primary_key=True) # start of the minute/hour (UTC)
+    logins = db.Column(db.Integer, nullable=False, default=0)
+    suspicious_logins = db.Column(db.Integer, nullable=False, default=0)
+
+
+class ActivityTopKey(db.Model):
+    # The busiest and most-flagged IPs/usernames of each hour, written by `flask compact-stats`.
+    kind = db.Column(db.String(16), primary_key=True) # 'ip' or 'username'
+    hour = db.Column(db.DateTime, primary_key=True)
+    key = db.Column(db.String(150), primary_key=True)
+    logins = db.Column(db.Integer, nullable=False, default=0)
+    suspicious_logins = db.Column(db.Integer, nullable=False, default=0)
+
+
+class ShadowVerdict(db.Model):
+    # One live login scored by a shadow model next to the primary one (see app/ai/shadow.py).
+    id = db.Column(db.Integer, primary_key=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    shadow = db.Column(db.String(64), nullable=False) # configured shadow name
+    shadow_version = db.Column(db.String(12), nullable=False)
+    primary_version = db.Column(db.String(12), nullable=False)
+    primary_flag = db.Column(db.Boolean, nullable=False)
+    shadow_flag = db.Column(db.Boolean, nullable=False)
+    primary_score = db.Column(db.Float, nullable=False) # decision_function: negative means anomalous
+    shadow_score = db.Column(db.Float, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_shadow_verdict_shadow_created_at', 'shadow', 'created_at'),
+    )
+
+
+class RateLimitBucket(db.Model):
+    # Token buckets shared between workers when RATELIMIT_BACKEND=sql (see app/ratelimit.py).
+    key = db.Column(db.String(200), primary_key=True) # "<rule>:<ip|subnet|username>"
+    tokens = db.Column(db.Float, nullable=False)
+    updated_at = db.Column(db.Float, nullable=False) # unix time of the last refill
@@ -0,0 +1,203 @@
+# app/outbox.py
+# Persisted email outbox. Request handlers only INSERT a row into outbox_message
+# and return; delivery happens on background worker threads (or a separate
+# `flask outbox-worker` process), which claim a batch of due messages, send the
+# whole batch over ONE SMTP connection, and reschedule failures with
+# exponential backoff.
+import logging
+import os
+import threading
+import uuid
+from datetime import datetime, timedelta
+
+from flask import current_app
+from flask_mail import Message
+from sqlalchemy import and_, or_, select, update
+
+from app import db, mail
+from app.db_utils import insert_ignore
+from app.metrics import ERRORS, phase
+from app.models import OutboxMessage
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue_email(recipient, subject, body, dedupe_key=None, dedupe_window=None):
+    """Queue an email for background delivery and commit it. Returns the message id.
+
+    If dedupe_key is given and a message with the same key was queued within
+    the last dedupe_window seconds, nothing is queued and None is returned.
+    dedupe_key is unique in outbox_message, so two concurrent requests can't
+    both queue it; a message older than the window gives its key up to the
+    next one.
+    """
+    config = current_app.config
+    table = OutboxMessage.__table__
+    values = {'recipient': recipient, 'subject': subject, 'body': body, 'dedupe_key': dedupe_key}
+
+    message_id = insert_ignore(db.session, table, values, ['dedupe_key'])
+    if message_id is None:
+        if dedupe_window is None:
+            dedupe_window = config.get('OUTBOX_DEDUPE_WINDOW', 600)
+        since = datetime.utcnow() - timedelta(seconds=dedupe_window)
+        released = db.session.execute(
+            update(OutboxMessage)
+            .where(OutboxMessage.dedupe_key == dedupe_key, OutboxMessage.created_at < since)
+            .values(dedupe_key=None)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        # Whoever released the key may still lose the insert to a faster request.
+        message_id = insert_ignore(db.session, table, values, ['dedupe_key']) if released else None
+        if message_id is None:
+            db.session.rollback()
+            return None
+    db.session.commit()
+
+    # Wake (or lazily start) the in-process workers, if any are configured.
+    outbox_worker.notify(current_app._get_current_object())
+    return message_id
+
+
+def backoff_seconds(attempts, base, cap):
+    # 1st retry after `base` seconds, then doubling, never more than `cap`.
+    return min(cap, base * (2 ** max(attempts - 1, 0)))
+
+
+def _claim_batch(batch_size, lease_seconds):
+    # Mark a batch of due messages with a unique claim token, then read back
+    # exactly the rows carrying our token. The conditional UPDATE makes the claim
+    # safe across threads and processes without relying on SELECT ... FOR UPDATE.
+    now = datetime.utcnow()
+    token = uuid.uuid4().hex
+    stale = now - timedelta(seconds=lease_seconds)
+    due = or_(
+        and_(OutboxMessage.status == 'pending', OutboxMessage.next_attempt_at <= now),
+        # A worker that died mid-send leaves rows in 'sending'; take them back after the lease.
+        and_(OutboxMessage.status == 'sending', OutboxMessage.claimed_at < stale),
+    )
+    candidate_ids = db.session.execute(
+        select(OutboxMessage.id).where(due).order_by(OutboxMessage.id).limit(batch_size)
+    ).scalars().all()
+    if not candidate_ids:
+        return []
+
+    db.session.execute(
+        update(OutboxMessage)
+        .where(OutboxMessage.id.in_(candidate_ids), due)
+        .values(status='sending', claimed_by=token, claimed_at=now)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    return db.session.execute(
+        select(OutboxMessage).where(OutboxMessage.claimed_by == token).order_by(OutboxMessage.id)
+    ).scalars().all()
+
+
+def deliver_pending(batch_size=None):
+    """Deliver one batch of due messages. Returns the number of messages handled."""
+    config = current_app.config
+    batch_size = batch_size or config.get('OUTBOX_BATCH_SIZE', 50)
+    max_attempts = config.get('OUTBOX_MAX_ATTEMPTS', 5)
+    base = config.get('OUTBOX_BACKOFF_SECONDS', 30)
+    cap = config.get('OUTBOX_BACKOFF_MAX_SECONDS', 3600)
+
+    batch = _claim_batch(batch_size, config.get('OUTBOX_LEASE_SECONDS', 300))
+    if not batch:
+        return 0
+
+    def failed(message, error):
+        message.attempts += 1
+        message.last_error = str(error)[:1000]
+        message.claimed_by = None
+        if message.attempts >= max_attempts:
+            message.status = 'failed'
+            logger.error("Giving up on message %s to %s: %s", message.id, message.recipient, error)
+        else:
+            message.status = 'pending'
+            message.next_attempt_at = datetime.utcnow() + timedelta(
+                seconds=backoff_seconds(message.attempts, base, cap))
+
+    try:
+        # One SMTP connection (and one TLS handshake/login) for the whole batch.
+        with phase('mail_send'), mail.connect() as connection:
+            for message in batch:
+                try:
+                    connection.send(Message(
+                        subject=message.subject,
+                        sender=mail.default_sender,
+                        recipients=[message.recipient],
+                        body=message.body,
+                    ))
+                except Exception as e:
+                    failed(message, e)
+                else:
+                    message.status = 'sent'
+                    message.sent_at = datetime.utcnow()
+                    message.claimed_by = None
+    except Exception as e:
+        # Couldn't connect/login, or the connection dropped: retry everything not yet sent.
+        logger.error("SMTP connection failed: %s", e)
+        ERRORS.inc(component='outbox')
+        for message in batch:
+            if message.status == 'sending':
+                failed(message, e)
+
+    db.session.commit()
+    return len(batch)
+
+
+def drain(batch_size=None):
+    """Deliver batches until nothing is due. Returns the total handled."""
+    total = 0
+    while True:
+        handled = deliver_pending(batch_size)
+        if not handled:
+            return total
+        total += handled
+
+
+class OutboxWorker:
+    # A small pool of daemon threads delivering the outbox inside a web worker.
+    # Threads are started lazily on the first notify() and restarted after a
+    # fork, so the pool is never inherited half-alive by gunicorn workers.
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._threads = []
+        self._pid = None
+
+    def notify(self, app):
+        if app.config.get('OUTBOX_WORKERS', 0) <= 0:
+            return
+        self._ensure_started(app)
+        self._wakeup.set()
+
+    def _ensure_started(self, app):
+        if self._pid == os.getpid() and all(t.is_alive() for t in self._threads):
+            return
+        with self._lock:
+            if self._pid == os.getpid() and all(t.is_alive() for t in self._threads):
+                return
+            self._pid = os.getpid()
+            self._threads = [
+                threading.Thread(target=self._run, args=(app,), name=f'outbox-worker-{i}', daemon=True)
+                for i in range(app.config['OUTBOX_WORKERS'])
+            ]
+            for thread in self._threads:
+                thread.start()
+
+    def _run(self, app):
+        poll_interval = app.config.get('OUTBOX_POLL_INTERVAL', 5)
+        while True:
+            self._wakeup.wait(poll_interval)
+            self._wakeup.clear()
+            try:
+                with app.app_context():
+                    drain()
+            except Exception:
+                logger.exception("Worker error")
+                ERRORS.inc(component='outbox')
+
+
+outbox_worker = OutboxWorker()
@@ -0,0 +1,156 @@
+# app/profiles.py
+# Per-user behavioural profiles (known IPs, usual login hours, last seen,
+# login velocity) for anomaly features. Each profile is one user_profile row,
+# updated incrementally on every new LoginActivity, and fronted by an
+# in-process LRU cache with a TTL so a login normally needs no extra query.
+#
+# Reads may be up to PROFILE_CACHE_TTL old, but writes never start from the
+# cache: record_many() locks the row and folds the new logins into what is
+# committed, so workers recording logins for the same user don't lose updates.
+# The new state only reaches the cache once the transaction commits.
+from datetime import datetime
+
+from sqlalchemy import delete, event, select, update
+
+from app import db
+from app.cache import TTLCache
+from app.db_utils import upsert
+from app.models import LoginActivity, UserProfile
+from app.ai.features import ProfileState, DEFAULT_MAX_KNOWN_IPS
+
+
+def _to_state(row):
+    hours = [int(h) for h in row.hour_histogram.split(',')] if row.hour_histogram else None
+    return ProfileState(
+        login_count=row.login_count,
+        first_seen=row.first_seen,
+        last_seen=row.last_seen,
+        known_ips=row.known_ips.split(',') if row.known_ips else None,
+        hour_counts=hours,
+        recent_rate=row.recent_rate,
+    )
+
+
+def _to_values(username, state):
+    return {
+        'username': username,
+        'login_count': state.login_count,
+        'first_seen': state.first_seen,
+        'last_seen': state.last_seen,
+        'known_ips': ','.join(state.known_ips),
+        'hour_histogram': ','.join(str(count) for count in state.hour_counts),
+        'recent_rate': state.recent_rate,
+    }
+
+
+class ProfileStore:
+    def __init__(self):
+        self.cache = TTLCache()
+        self.max_known_ips = DEFAULT_MAX_KNOWN_IPS
+
+    def init_app(self, app):
+        self.cache = TTLCache(app.config.get('PROFILE_CACHE_SIZE', 10000),
+                              app.config.get('PROFILE_CACHE_TTL', 300.0))
+        self.max_known_ips = app.config.get('PROFILE_MAX_KNOWN_IPS', DEFAULT_MAX_KNOWN_IPS)
+        app.extensions['profile_store'] = self
+
+    def get(self, username):
+        """Return the ProfileState for a username (an empty one for a new user).
+
+        Treat the result as read-only: it may be shared with other requests.
+        """
+        state = self.cache.get(username)
+        if state is None:
+            row = db.session.get(UserProfile, username)
+            state = _to_state(row) if row is not None else ProfileState()
+            self.cache.put(username, state)
+        return state
+
+    def _locked_state(self, username):
+        # Create the row if it is missing and take its write lock (an ON CONFLICT
+        # UPDATE that changes nothing), then read the committed state under it.
+        upsert(UserProfile, {'username': username}, ['username'], {'login_count': UserProfile.login_count})
+        row = db.session.execute(
+            select(UserProfile.__table__).where(UserProfile.username == username).with_for_update()
+        ).one()
+        return _to_state(row)
+
+    def record_many(self, usernames, ip_addresses, timestamps):
+        """Fold a batch of logins (in time order) into the stored profiles.
+
+        Returns each login's profile features, describing the history before
+        it. Rows are locked in username order, so concurrent batches can't
+        deadlock, and the locks are held until the caller commits, together
+        with the LoginActivity rows.
+        """
+        logins = {}
+        for index, username in enumerate(usernames):
+            logins.setdefault(username, []).append(index)
+        features = [None] * len(usernames)
+        for username in sorted(logins):
+            state = self._locked_state(username)
+            for index in logins[username]:
+                when = timestamps[index] or datetime.utcnow()
+                features[index] = state.features(ip_addresses[index], when)
+                state.observe(ip_addresses[index], when, self.max_known_ips)
+            db.session.execute(update(UserProfile).where(UserProfile.username == username)
+                               .values(**_to_values(username, state)))
+            # Cached by _profiles_committed(); dropped if the caller rolls back.
+            db.session.info.setdefault('recorded_profiles', {})[self, username] = state
+        return features
+
+    def record(self, username, ip_address, when=None):
+        """Fold a single login into the user's profile; see record_many()."""
+        self.record_many([username], [ip_address], [when or datetime.utcnow()])
+        return db.session.info['recorded_profiles'][self, username]
+
+    def invalidate(self, username=None):
+        """Forget one cached profile, or all of them when username is None."""
+        if username is None:
+            self.cache.clear()
+        else:
+            self.cache.invalidate(username)
+
+    def rebuild(self, chunk_size=10000):
+        """Recompute every profile from LoginActivity, replaying it in time order.
+
+        Keeps one ProfileState per distinct username in memory while streaming.
+        Returns the number of profiles written.
+        """
+        states = {}
+        result = db.session.execute(
+            select(LoginActivity.username, LoginActivity.ip_address, LoginActivity.timestamp)
+            .order_by(LoginActivity.timestamp, LoginActivity.id)
+            .execution_options(stream_results=True, yield_per=chunk_size)
+        )
+        for partition in result.partitions(chunk_size):
+            for username, ip, when in partition:
+                state = states.get(username)
+                if state is None:
+                    state = states[username] = ProfileState()
+                state.observe(ip, when, self.max_known_ips)
+        result.close()
+
+        db.session.execute(delete(UserProfile))
+        values = [_to_values(username, state) for username, state in states.items()]
+        for start in range(0, len(values), chunk_size):
+            db.session.execute(UserProfile.__table__.insert(), values[start:start + chunk_size])
+        db.session.commit()
+        self.invalidate()
+        return len(values)
+
+
+profile_store = ProfileStore()
+
+
+@event.listens_for(db.session, 'after_commit')
+def _profiles_committed(session):
+    for (store, username), state in session.info.pop('recorded_profiles', {}).items():
+        store.cache.put(username, state)
+
+
+@event.listens_for(db.session, 'after_transaction_end')
+def _profiles_discarded(session, transaction):
+    # Runs after after_commit; anything still pending was rolled back.
+    if transaction.parent is None:
+        session.info.pop('recorded_profiles', None)
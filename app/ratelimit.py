@@ -0,0 +1,261 @@
+# app/ratelimit.py
+# Token-bucket rate limiting for login attempts, checked BEFORE the password
+# hash is verified so a credential-stuffing burst is turned away cheaply.
+# Buckets are kept per IP, per subnet (/24 for IPv4, /64 for IPv6) and per
+# username. The default backend is an in-process LRU of buckets with a bounded
+# key count; RATELIMIT_BACKEND=sql shares buckets between workers and hosts
+# through the rate_limit_bucket table instead; rows that have refilled
+# completely carry no information and are pruned (on a sample of inserts, and
+# by `flask prune-rate-limits`).
+#
+# Password reset requests (per IP and per email) and reset token checks (per IP)
+# are throttled the same way.
+#
+# Rejections and failed passwords are also counted in a sliding window, and
+# that count is handed to detect_anomaly so a login that succeeds right after a
+# burst of failures is flagged.
+import ipaddress
+import random
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import delete, select, update
+
+from app import db
+from app.db_utils import insert_ignore
+from app.models import RateLimitBucket
+
+
+class Rate:
+    # "10/60" = bursts of up to 10, refilled at 10 tokens per 60 seconds.
+    def __init__(self, spec):
+        count, seconds = str(spec).split('/')
+        self.capacity = float(count)
+        self.per_second = float(count) / float(seconds)
+        self.refill_seconds = float(seconds)  # an empty bucket is full again after this
+
+    def refill(self, tokens, updated_at, now):
+        return min(self.capacity, tokens + (now - updated_at) * self.per_second)
+
+    def retry_after(self, tokens, cost):
+        return (cost - tokens) / self.per_second if self.per_second else float('inf')
+
+
+class MemoryBackend:
+    # Buckets live in this process only. At most max_keys buckets are kept; the
+    # least recently used is evicted first (it has usually refilled anyway).
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()  # key -> [tokens, updated_at]
+        self._lock = threading.Lock()
+
+    def consume(self, key, rate, cost=1.0, now=None):
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            bucket = self._buckets.get(key)
+            tokens = rate.capacity if bucket is None else rate.refill(bucket[0], bucket[1], now)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            self._buckets[key] = [tokens, now]
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return allowed, 0.0 if allowed else rate.retry_after(tokens, cost)
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class SQLBackend:
+    # Buckets shared through the database. Each consume is a read followed by a
+    # compare-and-set UPDATE (WHERE updated_at = what we read), retried on
+    # conflict, on its own short transaction so it never touches the request's session.
+    # New keys are created with INSERT ... ON CONFLICT DO NOTHING; one insert in
+    # prune_every also deletes the buckets that have refilled completely.
+
+    def __init__(self, retries=5, prune_every=1000):
+        self.retries = retries
+        self.prune_every = prune_every
+        self.rules = {}
+
+    def consume(self, key, rate, cost=1.0, now=None):
+        now = time.time() if now is None else now
+        table = RateLimitBucket.__table__
+        with db.engine.connect() as connection:
+            for _ in range(self.retries):
+                with connection.begin():
+                    row = connection.execute(
+                        select(table.c.tokens, table.c.updated_at).where(table.c.key == key)
+                    ).first()
+                    if row is None:
+                        tokens = rate.capacity
+                        allowed = tokens >= cost
+                        if not insert_ignore(connection, table, {
+                                'key': key, 'tokens': tokens - cost if allowed else tokens, 'updated_at': now}):
+                            continue  # another worker created it first; retry as an update
+                        if self.prune_every and random.randrange(self.prune_every) == 0:
+                            self._prune(connection, now)
+                    else:
+                        tokens = rate.refill(row.tokens, row.updated_at, now)
+                        allowed = tokens >= cost
+                        changed = connection.execute(
+                            update(table)
+                            .where(table.c.key == key, table.c.updated_at == row.updated_at)
+                            .values(tokens=tokens - cost if allowed else tokens, updated_at=now)
+                        ).rowcount
+                        if not changed:
+                            continue
+                return allowed, 0.0 if allowed else rate.retry_after(tokens, cost)
+        # Persistent contention on one key is itself a sign of a burst: refuse.
+        return False, 1.0 / rate.per_second if rate.per_second else 1.0
+
+    def _prune(self, connection, now):
+        # A bucket untouched for its rule's refill time is full, the same as no row.
+        table = RateLimitBucket.__table__
+        deleted = 0
+        for name, rate in self.rules.items():
+            deleted += connection.execute(delete(table).where(
+                table.c.key.startswith(f'{name}:', autoescape=True),
+                table.c.updated_at < now - rate.refill_seconds)).rowcount
+        return deleted
+
+    def prune(self, now=None):
+        """Delete every bucket that has refilled completely. Returns the number deleted."""
+        now = time.time() if now is None else now
+        with db.engine.begin() as connection:
+            return self._prune(connection, now)
+
+
+class SlidingWindowCounter:
+    # Approximate per-key event count over the last `window` seconds using the
+    # current and previous fixed windows (weighted by overlap): two numbers per
+    # key, bounded to max_keys keys with LRU eviction.
+
+    def __init__(self, window=900.0, max_keys=100000):
+        self.window = window
+        self.max_keys = max_keys
+        self._counts = OrderedDict()  # key -> [window_index, current, previous]
+        self._lock = threading.Lock()
+
+    def _roll(self, entry, index):
+        if entry[0] == index:
+            return
+        entry[2] = entry[1] if entry[0] == index - 1 else 0
+        entry[1] = 0
+        entry[0] = index
+
+    def add(self, key, amount=1, now=None):
+        now = time.monotonic() if now is None else now
+        index = int(now // self.window)
+        with self._lock:
+            entry = self._counts.get(key)
+            if entry is None:
+                entry = self._counts[key] = [index, 0, 0]
+            self._roll(entry, index)
+            entry[1] += amount
+            self._counts.move_to_end(key)
+            while len(self._counts) > self.max_keys:
+                self._counts.popitem(last=False)
+
+    def count(self, key, now=None):
+        now = time.monotonic() if now is None else now
+        index = int(now // self.window)
+        with self._lock:
+            entry = self._counts.get(key)
+            if entry is None:
+                return 0.0
+            self._roll(entry, index)
+            overlap = 1.0 - (now % self.window) / self.window
+            return entry[1] + entry[2] * overlap
+
+
+def subnet_key(ip_address):
+    try:
+        ip = ipaddress.ip_address(ip_address)
+    except ValueError:
+        return 'invalid'
+    prefix = 24 if ip.version == 4 else 64
+    return str(ipaddress.ip_network(f'{ip}/{prefix}', strict=False))
+
+
+class RateLimiter:
+    def __init__(self):
+        self.enabled = True
+        self.backend = MemoryBackend()
+        self.rules = {}
+        self.failures = SlidingWindowCounter()
+
+    def init_app(self, app):
+        config = app.config
+        self.enabled = config.get('RATELIMIT_ENABLED', True)
+        max_keys = config.get('RATELIMIT_MAX_KEYS', 100000)
+        self.rules = {
+            'login_ip': Rate(config.get('RATELIMIT_LOGIN_PER_IP', '10/60')),
+            'login_subnet': Rate(config.get('RATELIMIT_LOGIN_PER_SUBNET', '50/60')),
+            'login_username': Rate(config.get('RATELIMIT_LOGIN_PER_USERNAME', '5/60')),
+            'reset_ip': Rate(config.get('RATELIMIT_RESET_PER_IP', '5/300')),
+            'reset_email': Rate(config.get('RATELIMIT_RESET_PER_EMAIL', '3/3600')),
+            'reset_verify_ip': Rate(config.get('RATELIMIT_RESET_VERIFY_PER_IP', '20/300')),
+        }
+        if config.get('RATELIMIT_BACKEND', 'memory') == 'sql':
+            self.backend = SQLBackend(prune_every=config.get('RATELIMIT_PRUNE_EVERY', 1000))
+            self.backend.rules = self.rules
+        else:
+            self.backend = MemoryBackend(max_keys)
+        self.failures = SlidingWindowCounter(config.get('RATELIMIT_FAILURE_WINDOW', 900.0), max_keys)
+        app.extensions['rate_limiter'] = self
+
+    def hit(self, rule, key, cost=1.0):
+        """Take `cost` tokens from rule's bucket for key. Returns (allowed, retry_after_seconds)."""
+        if not self.enabled:
+            return True, 0.0
+        return self.backend.consume(f'{rule}:{key}', self.rules[rule], cost)
+
+    def check_login(self, username, ip_address):
+        """Charge one login attempt to the IP, subnet and username buckets.
+
+        Returns (allowed, retry_after_seconds). Call before verifying the password.
+        """
+        retry_after = 0.0
+        allowed = True
+        for rule, key in (('login_ip', ip_address),
+                          ('login_subnet', subnet_key(ip_address)),
+                          ('login_username', (username or '').lower())):
+            ok, wait = self.hit(rule, key)
+            if not ok:
+                allowed = False
+                retry_after = max(retry_after, wait)
+        if not allowed:
+            self.record_failure(username, ip_address)
+        return allowed, retry_after
+
+    def check_reset_request(self, email, ip_address):
+        """Charge a password reset request. Returns (ip_allowed, retry_after, email_allowed).
+
+        When only the email's bucket is empty the caller should answer as usual
+        but send nothing, so the limit doesn't reveal which addresses exist.
+        """
+        ip_allowed, retry_after = self.hit('reset_ip', ip_address)
+        if not ip_allowed:
+            return False, retry_after, False
+        return True, 0.0, self.hit('reset_email', (email or '').strip().lower())[0]
+
+    def check_reset_verify(self, ip_address):
+        """Charge one reset token check to the IP. Returns (allowed, retry_after_seconds)."""
+        return self.hit('reset_verify_ip', ip_address)
+
+    def record_failure(self, username, ip_address):
+        # Counted for both the account and the source, so either can trip detection.
+        self.failures.add(f'user:{(username or "").lower()}')
+        self.failures.add(f'ip:{ip_address}')
+
+    def recent_failures(self, username, ip_address):
+        """Rejected + failed attempts for this username or IP in the failure window."""
+        return max(self.failures.count(f'user:{(username or "").lower()}'),
+                   self.failures.count(f'ip:{ip_address}'))
+
+
+limiter = RateLimiter()
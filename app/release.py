@@ -0,0 +1,93 @@
+# app/release.py
+# One-off release tasks: apply migrations and make sure a default admin exists.
+# These used to run inside create_app(), i.e. in every gunicorn worker on every
+# boot, with workers racing each other on the migration. Now they run once per
+# deploy (`flask release`, wired up as the Procfile release phase), serialised
+# by a PostgreSQL advisory lock or, for SQLite, a file lock on the instance folder.
+import logging
+import contextlib
+import os
+
+from flask import current_app
+from sqlalchemy import text
+
+from app import db
+from app.hashing import password_hasher
+
+logger = logging.getLogger(__name__)
+
+# Arbitrary but fixed key shared by every process that runs the release.
+RELEASE_LOCK_KEY = 7212026
+
+
+@contextlib.contextmanager
+def release_lock():
+    """Hold an exclusive, cross-process lock for the duration of the block."""
+    if db.engine.dialect.name == 'postgresql':
+        # Session-level advisory lock on a dedicated connection; released on exit
+        # (or automatically by the server if this process dies).
+        with db.engine.connect() as connection:
+            connection.execute(text('SELECT pg_advisory_lock(:key)'), {'key': RELEASE_LOCK_KEY})
+            try:
+                yield
+            finally:
+                connection.execute(text('SELECT pg_advisory_unlock(:key)'), {'key': RELEASE_LOCK_KEY})
+        return
+
+    try:
+        import fcntl
+    except ImportError:  # Windows: single-host development only, no lock needed
+        yield
+        return
+    os.makedirs(current_app.instance_path, exist_ok=True)
+    with open(os.path.join(current_app.instance_path, 'release.lock'), 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def ensure_default_admin():
+    """Create the default admin from DEFAULT_ADMIN_* env vars if it doesn't exist."""
+    from app.models import User
+
+    default_admin_email = os.environ.get('DEFAULT_ADMIN_EMAIL') or 'admin@example.com' # Use env var or default
+    default_admin_password = os.environ.get('DEFAULT_ADMIN_PASSWORD') or 'StrongPassword123!' # Use env var or default
+    default_admin_username = os.environ.get('DEFAULT_ADMIN_USERNAME') or 'admin' # Use env var or default
+
+    admin_user = User.query.filter_by(email=default_admin_email).first()
+    if admin_user:
+        logger.info("Admin user '%s' already exists.", default_admin_email)
+        return False
+
+    logger.info("Creating default admin user: %s", default_admin_email)
+    new_admin = User(
+        username=default_admin_username,
+        email=default_admin_email,
+        password=password_hasher.hash(default_admin_password),
+        is_admin=True
+    )
+    db.session.add(new_admin)
+    try:
+        db.session.commit()
+        logger.info("Default admin user created successfully.")
+        return True
+    except Exception as e:
+        db.session.rollback()
+        logger.error("Error creating default admin user: %s", e)
+        return False
+
+
+def run_release(seed_admin=True):
+    """Apply pending migrations and seed the default admin, once, under the release lock."""
+    from flask_migrate import upgrade as db_upgrade
+    from app import init_migrations
+
+    init_migrations(current_app._get_current_object())
+    with release_lock():
+        logger.info("Attempting to run database migrations...")
+        db_upgrade() # Only applies unapplied migrations, so it is safe to run on every deploy
+        logger.info("Database migrations checked/applied.")
+        if seed_admin:
+            ensure_default_admin()
@@ -0,0 +1,141 @@
+# app/retention.py
+# Keeps login_activity bounded. Rows older than the retention window are rolled
+# up into login_activity_daily (one row per user per day) and then deleted, one
+# day per transaction so an interrupted run loses nothing. On PostgreSQL with a
+# monthly-partitioned login_activity (see the e1f83b6c0d25 migration), future
+# partitions are created ahead of time and emptied old ones are dropped.
+from datetime import date, datetime, time, timedelta
+
+from sqlalchemy import case, delete, func, select, text
+
+from app import db
+from app.db_utils import upsert
+from app.models import LoginActivity, LoginActivityDaily
+
+
+def _add_months(day, months):
+    month = day.month - 1 + months
+    return date(day.year + month // 12, month % 12 + 1, 1)
+
+
+def _next_day_with_rows(after, cutoff):
+    # First day on or after `after` (and before `cutoff`) that still has activity.
+    query = select(func.min(LoginActivity.timestamp)).where(LoginActivity.timestamp < cutoff)
+    if after is not None:
+        query = query.where(LoginActivity.timestamp >= after)
+    oldest = db.session.execute(query).scalar()
+    if oldest is None:
+        return None
+    if isinstance(oldest, str):  # SQLite hands back aggregates of DateTime columns as text
+        oldest = datetime.fromisoformat(oldest)
+    return oldest.date()
+
+
+def rollup_day(day):
+    """Add one day of LoginActivity to login_activity_daily and delete those rows."""
+    start = datetime.combine(day, time.min)
+    end = start + timedelta(days=1)
+    in_day = (LoginActivity.timestamp >= start) & (LoginActivity.timestamp < end)
+    totals = db.session.execute(
+        select(
+            LoginActivity.username,
+            func.count(),
+            func.sum(case((LoginActivity.is_suspicious, 1), else_=0)),
+            func.count(LoginActivity.ip_address.distinct()),
+        ).where(in_day).group_by(LoginActivity.username)
+    ).all()
+
+    table = LoginActivityDaily.__table__
+    # SQLite's two-argument max() is PostgreSQL's greatest().
+    greatest = func.max if db.session.get_bind().dialect.name == 'sqlite' else func.greatest
+    for username, logins, suspicious, distinct_ips in totals:
+        # Add to, rather than overwrite, a day that was partially rolled up before.
+        upsert(LoginActivityDaily, {
+            'day': day, 'username': username, 'logins': logins,
+            'suspicious_logins': suspicious or 0, 'distinct_ips': distinct_ips,
+        }, ['day', 'username'], {
+            'logins': table.c.logins + logins,
+            'suspicious_logins': table.c.suspicious_logins + (suspicious or 0),
+            'distinct_ips': greatest(table.c.distinct_ips, distinct_ips),
+        })
+    deleted = db.session.execute(delete(LoginActivity).where(in_day)).rowcount
+    db.session.commit()
+    return deleted
+
+
+def rollup_and_prune(retention_days, dry_run=False, progress=None):
+    """Roll up and delete every LoginActivity row older than retention_days.
+
+    Returns a dict with the number of days processed and rows removed.
+    """
+    cutoff = datetime.combine(date.today() - timedelta(days=retention_days), time.min)
+    stats = {'cutoff': cutoff, 'days': 0, 'rows': 0, 'partitions_dropped': []}
+
+    if dry_run:
+        stats['rows'] = db.session.execute(
+            select(func.count()).select_from(LoginActivity).where(LoginActivity.timestamp < cutoff)
+        ).scalar()
+        return stats
+
+    day = _next_day_with_rows(None, cutoff)
+    while day is not None:
+        stats['rows'] += rollup_day(day)
+        stats['days'] += 1
+        if progress:
+            progress(day, stats)
+        day = _next_day_with_rows(datetime.combine(day + timedelta(days=1), time.min), cutoff)
+
+    if is_partitioned():
+        stats['partitions_dropped'] = drop_partitions_before(cutoff.date())
+    return stats
+
+
+def is_partitioned():
+    if db.session.get_bind().dialect.name != 'postgresql':
+        return False
+    return db.session.execute(text(
+        "SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid "
+        "WHERE c.relname = 'login_activity'")).first() is not None
+
+
+def _partitions():
+    # (name, lower bound) for every monthly partition, parsed from the name.
+    names = db.session.execute(text(
+        "SELECT c.relname FROM pg_inherits i "
+        "JOIN pg_class c ON c.oid = i.inhrelid JOIN pg_class p ON p.oid = i.inhparent "
+        "WHERE p.relname = 'login_activity' AND c.relname LIKE 'login_activity_y%'")).scalars().all()
+    return sorted((name, date(int(name[16:20]), int(name[21:23]), 1)) for name in names)
+
+
+def ensure_monthly_partitions(months_ahead=3):
+    """Create any missing monthly partitions from this month to months_ahead out."""
+    if not is_partitioned():
+        return []
+    existing = {name for name, _ in _partitions()}
+    month = date.today().replace(day=1)
+    created = []
+    for _ in range(months_ahead + 1):
+        following = _add_months(month, 1)
+        name = f'login_activity_y{month.year}m{month.month:02d}'
+        if name not in existing:
+            db.session.execute(text(
+                f"CREATE TABLE {name} PARTITION OF login_activity "
+                f"FOR VALUES FROM ('{month.isoformat()}') TO ('{following.isoformat()}')"))
+            created.append(name)
+        month = following
+    db.session.commit()
+    return created
+
+
+def drop_partitions_before(cutoff_day):
+    """Drop monthly partitions that end on or before cutoff_day and hold no rows."""
+    dropped = []
+    for name, start in _partitions():
+        if _add_months(start, 1) > cutoff_day:
+            continue
+        if db.session.execute(text(f'SELECT 1 FROM {name} LIMIT 1')).first() is not None:
+            continue
+        db.session.execute(text(f'DROP TABLE {name}'))
+        dropped.append(name)
+    db.session.commit()
+    return dropped
@@ -1,17 +1,44 @@
 # app/routes.py
-from flask import Blueprint, render_template, request, redirect, url_for, flash, session, jsonify
-from app import db, mail # Import db and mail from app's __init__.py
-from app.models import User, LoginActivity # Correctly import models
+import logging
+from flask import Blueprint, render_template, request, redirect, url_for, flash, session, jsonify, Response, stream_with_context, send_file, abort
+from app import db # Import db from app's __init__.py
+from app.models import User # Correctly import models
 from flask_login import login_user, logout_user, login_required, current_user # Flask-Login functions/decorators
 
-from werkzeug.security import generate_password_hash, check_password_hash
-from flask_mail import Message # For sending emails in password reset
+from app.hashing import HashingOverloaded, password_hasher # Off-thread password hashing
 
+import math
 import socket # Assuming you still need this for IP address
-from app.ai.detect_anomaly import detect_anomaly # Your AI anomaly detection function
-from app.email_alerts import send_alert_email # Your email alert function
+from app.ai.model_registry import model_registry
+from app.ai.online import online_detector
+from app.ai.shadow import shadow_models
+from app.ratelimit import limiter # Login throttling
+from app.user_cache import user_cache # Cached current_user; role checks go to the database
+from app.activity import (ActivityQueryError, activity_page, activity_to_dict,
+                          parse_filters, parse_page_size)
+from app.export import ExportsBusy, csv_chunks, iter_activity, ndjson_chunks, pdf_export_status, start_pdf_export
+from app.events import record_login # Login event pipeline: scoring, activity log, alerts
+from app.outbox import enqueue_email # Queued email delivery for password resets
+from app.tokens import reset_tokens # Signed, single-use password reset tokens
+from app.metrics import instrument_blueprint
+from app.stats import dashboard_stats # Pre-aggregated dashboard numbers
+from app.database import replica_reads # Read-only views can use the read replica
+
+logger = logging.getLogger(__name__)
 
 main = Blueprint('main', __name__)
+# Per-request timing, structured request logs and the /metrics endpoint.
+instrument_blueprint(main)
+
+@main.errorhandler(HashingOverloaded)
+def hashing_overloaded(e):
+    # Shed load instead of letting requests pile up behind the hashing pool.
+    return 'The server is busy. Please try again in a moment.', 503, {'Retry-After': '1'}
+
+@main.errorhandler(ExportsBusy)
+def exports_busy(e):
+    # PDF renders are capped per worker; the admin retries once one finishes.
+    return 'Too many PDF exports are running. Please try again shortly.', 429, {'Retry-After': '30'}
 
 @main.route('/')
 def home():
@@ -38,7 +65,7 @@ def register():
         if User.query.filter_by(email=email).first():
             flash('Email already registered!', 'danger')
         else:
-            hashed_password = generate_password_hash(password)
+            hashed_password = password_hasher.hash(password)
             new_user = User(username=username, email=email, password=hashed_password)
             db.session.add(new_user)
             db.session.commit()
@@ -55,24 +82,34 @@ def login():
     if request.method == 'POST':
         username_input = request.form.get('username')
         password_input = request.form.get('password')
+        ip = request.remote_addr
+
+        # Throttle before touching the database or the (deliberately slow) password hash.
+        allowed, retry_after = limiter.check_login(username_input, ip)
+        if not allowed:
+            retry_after = max(1, math.ceil(retry_after))
+            flash(f'Too many login attempts. Try again in {retry_after} seconds.', 'danger')
+            return render_template('login.html'), 429, {'Retry-After': str(retry_after)}
 
         user = User.query.filter_by(username=username_input).first()
 
-        if user and check_password_hash(user.password, password_input):
+        if user and password_hasher.verify(user.password, password_input):
             # Log the user in with Flask-Login. 'remember=True' keeps them logged in.
             login_user(user, remember=True)
             flash('Login successful!', 'success')
 
-            # Log activity
-            ip = request.remote_addr
-            is_suspicious = detect_anomaly(username_input, ip)
-
-            new_activity = LoginActivity(username=username_input, ip_address=ip, is_suspicious=is_suspicious)
-            db.session.add(new_activity)
-            db.session.commit()
-
+            # Upgrade hashes made with an older method/cost while we have the plaintext.
+            if password_hasher.needs_rehash(user.password):
+                try:
+                    user.password = password_hasher.hash(password_input)
+                    db.session.commit()
+                except HashingOverloaded:
+                    pass  # try again next login rather than fail this one
+
+            # Scoring, LoginActivity, profile and alerts happen in the login event
+            # pipeline; unless it runs inline we don't wait for the verdict.
+            is_suspicious = record_login(user, ip, limiter.recent_failures(username_input, ip))
             if is_suspicious:
-                send_alert_email(user.email, user.username, ip)
                 flash('Suspicious login detected and alert sent!', 'warning')
 
             # Redirect to the 'next' page if it was set (e.g., from an @login_required redirect)
@@ -82,12 +119,14 @@ def login():
             else:
                 return redirect(next_page or url_for('main.user_dashboard'))
         else:
+            limiter.record_failure(username_input, ip)
             flash('Login failed. Check username and password.', 'danger')
     return render_template('login.html')
 
 @main.route('/logout')
 @login_required # Ensure only logged-in users can logout
 def logout():
+    user_cache.invalidate(current_user.id)
     logout_user() # Log the user out with Flask-Login
     flash('You have been logged out.', 'info')
     return redirect(url_for('main.home')) # Redirect to home or login page
@@ -101,28 +140,34 @@ def reset_password_request():
 
     if request.method == 'POST':
         email = request.form.get('email')
-        user = User.query.filter_by(email=email).first()
+        # Throttled per IP (429) and per address (silently: same answer, no email).
+        ip_allowed, retry_after, email_allowed = limiter.check_reset_request(email, request.remote_addr)
+        if not ip_allowed:
+            retry_after = max(1, math.ceil(retry_after))
+            flash(f'Too many password reset requests. Try again in {retry_after} seconds.', 'danger')
+            return render_template('reset_password_request.html'), 429, {'Retry-After': str(retry_after)}
+        user = User.query.filter_by(email=email).first() if email_allowed else None
         if user:
             # Send reset email
-            token = user.get_reset_token()
-            msg = Message(
-                subject="Password Reset Request for Your FRANCIS_IA Account",
-                sender=mail.default_sender, # Use the default sender configured in app/__init__.py
-                recipients=[user.email]
-            )
+            token = reset_tokens.issue(user)
             # IMPORTANT: Create a proper HTML template for this email in production!
             # For simplicity, using plain text here.
-            msg.body = f'''To reset your password, visit the following link:
+            body = f'''To reset your password, visit the following link:
 {url_for('main.reset_token', token=token, _external=True)}
 
 If you did not make this request then simply ignore this email and no changes will be made.
 '''
             try:
-                mail.send(msg)
+                # Queued in the outbox; SMTP happens on a background worker, not here.
+                enqueue_email(
+                    recipient=user.email,
+                    subject="Password Reset Request for Your FRANCIS_IA Account",
+                    body=body,
+                )
                 flash('An email has been sent with instructions to reset your password.', 'info')
-            except Exception as e:
+            except Exception:
                 # Log the actual error for debugging, but show generic message to user
-                print(f"Error sending password reset email: {e}")
+                logger.exception("Error queueing password reset email")
                 flash('Failed to send password reset email. Please try again later.', 'danger')
         else:
             # For security, always show a generic message if email not found
@@ -138,7 +183,14 @@ def reset_token(token):
     if current_user.is_authenticated: # Don't allow if already logged in
         return redirect(url_for('main.home'))
 
-    user = User.verify_reset_token(token)
+    allowed, retry_after = limiter.check_reset_verify(request.remote_addr)
+    if not allowed:
+        retry_after = max(1, math.ceil(retry_after))
+        flash(f'Too many attempts. Try again in {retry_after} seconds.', 'danger')
+        return render_template('reset_password_request.html'), 429, {'Retry-After': str(retry_after)}
+
+    # Forged or expired tokens are rejected without a query; used ones no longer match the password.
+    user = reset_tokens.verify(token)
     if user is None:
         flash('That is an invalid or expired token.', 'warning')
         return redirect(url_for('main.reset_password_request'))
@@ -150,26 +202,158 @@ def reset_token(token):
         if password != confirm_password:
             flash('Passwords do not match.', 'danger')
         else:
-            hashed_password = generate_password_hash(password)
-            user.password = hashed_password
-            db.session.commit()
+            hashed_password = password_hasher.hash(password)
+            # Compare-and-set on the old hash: a token replayed concurrently loses here.
+            if reset_tokens.consume(token, hashed_password) is None:
+                flash('That is an invalid or expired token.', 'warning')
+                return redirect(url_for('main.reset_password_request'))
             flash('Your password has been updated! You are now able to log in.', 'success')
             return redirect(url_for('main.login'))
 
-    return render_template('reset_token.html') # Create this template
+    return render_template('reset_yoken.html') # new password + confirmation form
 
 
 # Protected Dashboards
 @main.route('/admin_dashboard')
 @login_required # Protect this route: requires login
+@replica_reads # SELECTs may be served by DATABASE_REPLICA_URL
 def admin_dashboard():
-    if not current_user.is_admin: # Additional check for admin role
+    if not user_cache.is_admin(current_user.id): # Additional check for admin role, against the database
         flash('Access denied: You do not have admin privileges.', 'danger')
         return redirect(url_for('main.user_dashboard')) # Redirect to user dashboard if not admin
-    return render_template('admin_dashboard.html', user=current_user)
+    return render_template('admin_dashboard.html', user=current_user, stats=dashboard_stats())
+
+@main.route('/admin/model_info')
+@login_required
+def model_info():
+    # Lets operators check that every worker serves the same model version.
+    if not user_cache.is_admin(current_user.id):
+        return jsonify({'error': 'admin privileges required'}), 403
+    info = model_registry.info()
+    if shadow_models.enabled:
+        info['shadow'] = shadow_models.stats()
+    if online_detector.enabled:
+        info['online'] = online_detector.info()
+    return jsonify(info)
+
+@main.route('/admin/hash_stats')
+@login_required
+def hash_stats():
+    # Queue wait vs. hash time per worker: tells whether to add HASH_WORKERS or lower the cost.
+    if not user_cache.is_admin(current_user.id):
+        return jsonify({'error': 'admin privileges required'}), 403
+    return jsonify(password_hasher.stats())
+
+def _activity_request():
+    # Shared by the HTML and JSON activity views: filters, cursor and bounded page size.
+    from flask import current_app
+    filters = parse_filters(request.args)
+    limit = parse_page_size(request.args.get('limit'),
+                            current_app.config.get('ACTIVITY_PAGE_SIZE', 50),
+                            current_app.config.get('ACTIVITY_MAX_PAGE_SIZE', 500))
+    return activity_page(filters, request.args.get('cursor'), limit)
+
+@main.route('/activity_log')
+@login_required
+@replica_reads
+def activity_log():
+    if not user_cache.is_admin(current_user.id):
+        flash('Access denied: You do not have admin privileges.', 'danger')
+        return redirect(url_for('main.user_dashboard'))
+    try:
+        logs, next_cursor = _activity_request()
+    except ActivityQueryError as e:
+        flash(str(e), 'danger')
+        return redirect(url_for('main.activity_log'))
+    # Carry the current filters into the paging links, replacing only the cursor.
+    page_args = {key: value for key, value in request.args.items() if key != 'cursor'}
+    next_url = url_for('main.activity_log', cursor=next_cursor, **page_args) if next_cursor else None
+    return render_template('activity_log.html', logs=logs, filters=request.args, next_url=next_url,
+                           first_url=url_for('main.activity_log', **page_args), export_args=page_args)
+
+# Streaming exports: rows go from a server-side cursor straight into the response.
+EXPORT_FORMATS = {
+    'csv': (csv_chunks, 'text/csv'),
+    'ndjson': (ndjson_chunks, 'application/x-ndjson'),
+}
+
+@main.route('/activity_log/export.<fmt>')
+@login_required
+def export_activity(fmt):
+    if not user_cache.is_admin(current_user.id):
+        flash('Access denied: You do not have admin privileges.', 'danger')
+        return redirect(url_for('main.user_dashboard'))
+    try:
+        filters = parse_filters(request.args)
+    except ActivityQueryError as e:
+        flash(str(e), 'danger')
+        return redirect(url_for('main.activity_log'))
+
+    if fmt == 'pdf':
+        # PDFs are rendered by a background job; send the admin to its status page.
+        # Raises ExportsBusy (429) when this worker is already rendering its limit.
+        job_id = start_pdf_export(filters)
+        return redirect(url_for('main.export_status', job_id=job_id))
+    if fmt not in EXPORT_FORMATS:
+        abort(404)
+
+    encode, mimetype = EXPORT_FORMATS[fmt]
+    # stream_with_context keeps the database session open while the generator runs.
+    return Response(
+        stream_with_context(encode(iter_activity(filters))),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename=activity_log.{fmt}'},
+    )
+
+@main.route('/activity_log/exports/<job_id>')
+@login_required
+def export_status(job_id):
+    if not user_cache.is_admin(current_user.id):
+        flash('Access denied: You do not have admin privileges.', 'danger')
+        return redirect(url_for('main.user_dashboard'))
+    status, detail = pdf_export_status(job_id)
+    if status == 'missing':
+        abort(404)
+    return render_template('export_status.html', job_id=job_id, status=status,
+                           error=detail if status == 'failed' else None)
+
+@main.route('/activity_log/exports/<job_id>/download')
+@login_required
+def export_download(job_id):
+    if not user_cache.is_admin(current_user.id):
+        flash('Access denied: You do not have admin privileges.', 'danger')
+        return redirect(url_for('main.user_dashboard'))
+    status, pdf_path = pdf_export_status(job_id)
+    if status != 'done':
+        abort(404)
+    return send_file(pdf_path, mimetype='application/pdf', as_attachment=True,
+                     download_name='activity_log.pdf')
+
+@main.route('/api/activity')
+@login_required
+@replica_reads
+def api_activity():
+    if not user_cache.is_admin(current_user.id):
+        return jsonify({'error': 'admin privileges required'}), 403
+    try:
+        logs, next_cursor = _activity_request()
+    except ActivityQueryError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'items': [activity_to_dict(log) for log in logs], 'next_cursor': next_cursor})
+
+@main.route('/api/stats')
+@login_required
+@replica_reads
+def api_stats():
+    # Same numbers as the admin dashboard, from the rollup tables only.
+    if not user_cache.is_admin(current_user.id):
+        return jsonify({'error': 'admin privileges required'}), 403
+    hours = min(max(request.args.get('hours', 24, type=int), 1), 24 * 31)
+    return jsonify(dashboard_stats(hours=hours))
 
 @main.route('/user_dashboard')
 @login_required # Protect this route: requires login
+@replica_reads
 def user_dashboard():
     return render_template('user_dashboard.html', user=current_user)
 
@@ -0,0 +1,195 @@
+# app/stats.py
+# Pre-aggregated login statistics for the admin dashboard and /api/stats, so
+# neither ever runs a GROUP BY over login_activity.
+#
+# activity_rollup holds login and suspicious-login counts per minute and per
+# hour. The login event pipeline adds every batch it records to them in the
+# same transaction (record_activity), so the numbers are live. `flask
+# compact-stats` periodically recomputes recent closed buckets exactly from
+# login_activity (picking up rescored flags and anything missed), writes the
+# busiest IPs/usernames per hour into activity_top_key, and prunes old
+# per-minute rows. Run it with a large --hours once to backfill history.
+from datetime import datetime, timedelta
+
+from sqlalchemy import case, delete, func, insert, select
+
+from app import db
+from app.db_utils import upsert
+from app.models import ActivityRollup, ActivityTopKey, LoginActivity
+
+MINUTE = 'minute'
+HOUR = 'hour'
+# Native date truncation (date_trunc/strftime) and ON CONFLICT are needed.
+SUPPORTED_DIALECTS = ('postgresql', 'sqlite')
+TOP_KEY_COLUMNS = {'ip': LoginActivity.ip_address, 'username': LoginActivity.username}
+
+
+def _floor(when, granularity):
+    when = when.replace(second=0, microsecond=0)
+    return when.replace(minute=0) if granularity == HOUR else when
+
+
+def _as_datetime(value):
+    # SQLite hands back strftime() buckets as text.
+    return datetime.fromisoformat(value) if isinstance(value, str) else value
+
+
+def _bucket(granularity):
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'postgresql':
+        return func.date_trunc(granularity, LoginActivity.timestamp)
+    return func.strftime('%Y-%m-%d %H:%M:00' if granularity == MINUTE else '%Y-%m-%d %H:00:00',
+                         LoginActivity.timestamp)
+
+
+def _scored(start, end):
+    # Rows that worker mode inserted but hasn't scored yet (is_suspicious NULL)
+    # are left out: record_activity() counts them once they are scored.
+    return ((LoginActivity.timestamp >= start) & (LoginActivity.timestamp < end)
+            & LoginActivity.is_suspicious.isnot(None))
+
+
+def record_activity(timestamps, flags):
+    """Add a batch of just-recorded logins to the minute and hour rollups.
+
+    One upsert per bucket touched (usually two); the caller commits.
+    """
+    counts = {}
+    for when, flag in zip(timestamps, flags):
+        for granularity in (MINUTE, HOUR):
+            totals = counts.setdefault((granularity, _floor(when, granularity)), [0, 0])
+            totals[0] += 1
+            totals[1] += 1 if flag else 0
+    # Sorted, so concurrent workers lock the same rows in the same order.
+    for (granularity, bucket), (logins, suspicious) in sorted(counts.items()):
+        upsert(ActivityRollup,
+               {'granularity': granularity, 'bucket': bucket, 'logins': logins, 'suspicious_logins': suspicious},
+               ['granularity', 'bucket'],
+               {'logins': ActivityRollup.logins + logins,
+                'suspicious_logins': ActivityRollup.suspicious_logins + suspicious})
+
+
+def _recompute_rollups(granularity, start, end):
+    bucket = _bucket(granularity)
+    in_range = _scored(start, end)
+    rows = db.session.execute(
+        select(bucket, func.count(), func.sum(case((LoginActivity.is_suspicious, 1), else_=0)))
+        .where(in_range).group_by(bucket)
+    ).all()
+    db.session.execute(delete(ActivityRollup).where(
+        (ActivityRollup.granularity == granularity) & (ActivityRollup.bucket >= start) & (ActivityRollup.bucket < end)))
+    if rows:
+        db.session.execute(insert(ActivityRollup), [
+            {'granularity': granularity, 'bucket': _as_datetime(when), 'logins': logins,
+             'suspicious_logins': int(suspicious or 0)}
+            for when, logins, suspicious in rows
+        ])
+    return len(rows)
+
+
+def _recompute_top_keys(hour, top_n):
+    in_hour = _scored(hour, hour + timedelta(hours=1))
+    rows = []
+    for kind, column in TOP_KEY_COLUMNS.items():
+        logins = func.count()
+        suspicious = func.sum(case((LoginActivity.is_suspicious, 1), else_=0))
+        query = select(column, logins, suspicious).where(in_hour).group_by(column)
+        # The busiest keys and the most-flagged ones can differ; keep both lists.
+        busiest = db.session.execute(query.order_by(logins.desc()).limit(top_n)).all()
+        flagged = db.session.execute(query.order_by(suspicious.desc()).limit(top_n)).all()
+        for key, key_logins, key_suspicious in {row[0]: row for row in busiest + flagged}.values():
+            rows.append({'kind': kind, 'hour': hour, 'key': key, 'logins': key_logins,
+                         'suspicious_logins': int(key_suspicious or 0)})
+    db.session.execute(delete(ActivityTopKey).where(ActivityTopKey.hour == hour))
+    if rows:
+        db.session.execute(insert(ActivityTopKey), rows)
+
+
+def compact_stats(hours=3, top_n=20, minute_retention_hours=48, now=None):
+    """Recompute the last `hours` of rollups and top keys from login_activity.
+
+    Only closed minutes/hours are rewritten (the open ones keep receiving
+    increments); top keys are rewritten for every hour, including the current
+    one. Commits once per hour of data. Returns counters.
+
+    Raises ValueError on databases other than PostgreSQL and SQLite.
+    """
+    dialect = db.session.get_bind().dialect.name
+    if dialect not in SUPPORTED_DIALECTS:
+        raise ValueError(f"compact-stats supports {' and '.join(SUPPORTED_DIALECTS)}, not {dialect}")
+    now = now or datetime.utcnow()
+    start = _floor(now - timedelta(hours=hours), HOUR)
+    # A backfill with a huge --hours starts at the first login, not years of empty hours.
+    first = db.session.scalar(select(func.min(LoginActivity.timestamp)).where(LoginActivity.timestamp >= start))
+    start = _floor(first, HOUR) if first is not None else _floor(now, HOUR)
+    current_hour = _floor(now, HOUR)
+    stats = {'hours': 0, 'minute_buckets': 0, 'hour_buckets': 0, 'minutes_pruned': 0}
+
+    hour = start
+    while hour <= current_hour:
+        hour_end = hour + timedelta(hours=1)
+        stats['minute_buckets'] += _recompute_rollups(MINUTE, hour, min(hour_end, _floor(now, MINUTE)))
+        if hour_end <= now:
+            stats['hour_buckets'] += _recompute_rollups(HOUR, hour, hour_end)
+        _recompute_top_keys(hour, top_n)
+        db.session.commit()
+        stats['hours'] += 1
+        hour = hour_end
+
+    if minute_retention_hours:
+        cutoff = now - timedelta(hours=minute_retention_hours)
+        stats['minutes_pruned'] = db.session.execute(delete(ActivityRollup).where(
+            (ActivityRollup.granularity == MINUTE) & (ActivityRollup.bucket < cutoff))).rowcount
+        db.session.commit()
+    return stats
+
+
+def _series(granularity, since, count, step):
+    rows = db.session.execute(
+        select(ActivityRollup.bucket, ActivityRollup.logins, ActivityRollup.suspicious_logins)
+        .where((ActivityRollup.granularity == granularity) & (ActivityRollup.bucket >= since))
+    ).all()
+    by_bucket = {bucket: (logins, suspicious) for bucket, logins, suspicious in rows}
+    series = []
+    for i in range(count):
+        bucket = since + step * i
+        logins, suspicious = by_bucket.get(bucket, (0, 0))
+        series.append({'bucket': bucket.isoformat(), 'logins': logins, 'suspicious_logins': suspicious})
+    return series
+
+
+def _top_keys(kind, since, limit):
+    logins = func.sum(ActivityTopKey.logins)
+    suspicious = func.sum(ActivityTopKey.suspicious_logins)
+    rows = db.session.execute(
+        select(ActivityTopKey.key, logins, suspicious)
+        .where((ActivityTopKey.kind == kind) & (ActivityTopKey.hour >= since))
+        .group_by(ActivityTopKey.key)
+        .order_by(suspicious.desc(), logins.desc())
+        .limit(limit)
+    ).all()
+    return [{'key': key, 'logins': int(key_logins), 'suspicious_logins': int(key_suspicious)}
+            for key, key_logins, key_suspicious in rows]
+
+
+def dashboard_stats(hours=24, top_n=10, now=None):
+    """Everything the admin dashboard shows, read from the rollup tables only."""
+    now = now or datetime.utcnow()
+    since_hour = _floor(now, HOUR) - timedelta(hours=hours - 1)
+    since_minute = _floor(now, MINUTE) - timedelta(minutes=59)
+    hourly = _series(HOUR, since_hour, hours, timedelta(hours=1))
+    logins = sum(bucket['logins'] for bucket in hourly)
+    suspicious = sum(bucket['suspicious_logins'] for bucket in hourly)
+    return {
+        'generated_at': now.isoformat(),
+        'hours': hours,
+        'logins': logins,
+        'suspicious_logins': suspicious,
+        'suspicious_rate': suspicious / logins if logins else 0.0,
+        'hourly': hourly,
+        'per_minute': _series(MINUTE, since_minute, 60, timedelta(minutes=1)),
+        # Top keys are exact per hour and summed over the window (approximate
+        # beyond each hour's top list); refreshed by compact-stats.
+        'top_ips': _top_keys('ip', since_hour, top_n),
+        'top_usernames': _top_keys('username', since_hour, top_n),
+    }
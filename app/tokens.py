@@ -0,0 +1,93 @@
+# app/tokens.py
+# Password reset tokens. The serializer is built once per SECRET_KEY instead of
+# on every call, and a token that is forged, mangled or expired is rejected
+# from its signature alone, without touching the database.
+#
+# Each token carries a fingerprint of the user's password hash at the time it
+# was issued. Resetting the password changes the hash, so every outstanding
+# token (including the one just used) stops verifying: single use without a
+# tokens table. The reset itself is a compare-and-set UPDATE on the old hash,
+# so two requests racing with the same token can't both succeed.
+import hashlib
+
+from flask import current_app
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+from sqlalchemy import update
+
+from app import db
+from app.database import primary
+from app.models import User
+
+RESET_SALT = 'password-reset'
+
+
+def password_fingerprint(password_hash):
+    # Short and keyed by purpose; says nothing useful about the (salted) hash.
+    return hashlib.blake2b(password_hash.encode('utf-8'), digest_size=8, person=b'reset-token').hexdigest()
+
+
+class ResetTokens:
+    def __init__(self):
+        self.max_age = 1800
+        self._cached = (None, None)  # (SECRET_KEY, serializer), swapped as one reference
+
+    def init_app(self, app):
+        self.max_age = int(app.config.get('RESET_TOKEN_MAX_AGE', self.max_age))
+        self._cached = (None, None)
+        app.extensions['reset_tokens'] = self
+
+    def _serializer(self):
+        secret = current_app.config['SECRET_KEY']
+        cached_secret, serializer = self._cached
+        if serializer is None or cached_secret != secret:
+            serializer = URLSafeTimedSerializer(secret, salt=RESET_SALT)
+            self._cached = (secret, serializer)
+        return serializer
+
+    def issue(self, user):
+        """A URL-safe reset token for user, valid for RESET_TOKEN_MAX_AGE seconds."""
+        return self._serializer().dumps({'user_id': user.id, 'fp': password_fingerprint(user.password)})
+
+    def peek(self, token):
+        """(user_id, fingerprint) if the token is authentic and unexpired, else None. No database access."""
+        try:
+            payload = self._serializer().loads(token, max_age=self.max_age)
+            return int(payload['user_id']), str(payload['fp'])
+        except (BadSignature, KeyError, TypeError, ValueError):
+            return None
+
+    def verify(self, token):
+        """The User a token was issued to, or None if it is invalid, expired or already used."""
+        claims = self.peek(token)
+        if claims is None:
+            return None
+        user_id, fingerprint = claims
+        with primary():  # a replica may not have seen the reset that used this token yet
+            user = db.session.get(User, user_id)
+        if user is None or password_fingerprint(user.password) != fingerprint:
+            return None
+        return user
+
+    def consume(self, token, new_password_hash):
+        """Set the new password hash if the token is still valid. Returns the User, or None.
+
+        Only succeeds if the password is still the one the token was issued
+        against, so a token works once even under concurrent requests.
+        """
+        from app.user_cache import user_cache
+
+        user = self.verify(token)
+        if user is None:
+            return None
+        old_password_hash = user.password
+        changed = db.session.execute(
+            update(User).where(User.id == user.id, User.password == old_password_hash)
+            .values(password=new_password_hash)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        db.session.commit()
+        user_cache.invalidate(user.id)  # bulk UPDATEs skip the ORM listeners
+        return user if changed else None
+
+
+reset_tokens = ResetTokens()
@@ -0,0 +1,78 @@
+# app/user_cache.py
+# Flask-Login calls user_loader on every authenticated request. Instead of a
+# SELECT per page view, the user's columns are kept in a small per-worker LRU
+# with a TTL and turned back into a session-attached User without a query.
+#
+# Entries are dropped whenever a User row is updated or deleted through the ORM
+# in this process (password reset, role changes) and on logout. Other workers
+# only notice after USER_CACHE_TTL, so anything that grants admin access must
+# ask the database via is_admin() rather than trust current_user.is_admin.
+from sqlalchemy import event, select
+from sqlalchemy.orm import make_transient_to_detached, object_session
+
+from app import db
+from app.cache import TTLCache
+from app.database import REPLICA_BIND, primary, read_replica
+from app.models import User
+
+_COLUMNS = ('id', 'username', 'email', 'password', 'is_admin')
+
+
+class UserCache:
+    def __init__(self):
+        self.cache = TTLCache(max_size=0)
+
+    def init_app(self, app):
+        self.cache = TTLCache(app.config.get('USER_CACHE_SIZE', 10000),
+                              app.config.get('USER_CACHE_TTL', 60.0))
+        app.extensions['user_cache'] = self
+
+    def load(self, user_id):
+        """Return the User for user_id, attached to the current session, or None."""
+        values = self.cache.get(user_id)
+        if values is None:
+            with read_replica():
+                user = db.session.get(User, user_id)
+            if user is None and db.engines.get(REPLICA_BIND) is not None:
+                user = db.session.get(User, user_id)  # maybe not replicated yet
+            if user is not None:
+                self.cache.put(user_id, {name: getattr(user, name) for name in _COLUMNS})
+            return user
+
+        # A fresh instance per request (cached values are shared, instances are
+        # not), marked as already persisted and merged without a SELECT.
+        user = User(**values)
+        make_transient_to_detached(user)
+        return db.session.merge(user, load=False)
+
+    def invalidate(self, user_id=None):
+        """Forget one cached user, or all of them when user_id is None."""
+        if user_id is None:
+            self.cache.clear()
+        else:
+            self.cache.invalidate(user_id)
+
+    def is_admin(self, user_id):
+        # Authoritative role check, straight from the primary database.
+        with primary():
+            return bool(db.session.execute(select(User.is_admin).where(User.id == user_id)).scalar())
+
+
+user_cache = UserCache()
+
+
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def _user_changed(mapper, connection, target):
+    # Drop it at flush time, and again after commit in case another request
+    # re-cached the old row in between. Bulk query.update() bypasses this.
+    user_cache.invalidate(target.id)
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault('changed_user_ids', set()).add(target.id)
+
+
+@event.listens_for(db.session, 'after_commit')
+def _user_committed(session):
+    for user_id in session.info.pop('changed_user_ids', ()):
+        user_cache.invalidate(user_id)
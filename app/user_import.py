@@ -0,0 +1,199 @@
+# app/user_import.py
+# Bulk user provisioning (`flask import-users users.csv`), for onboarding
+# thousands of accounts at once instead of one create_admin.py run each.
+#
+# The file is streamed (CSV with a header row, or NDJSON with one object per
+# line) and never held in memory. Existing usernames and emails are loaded into
+# sets once up front, so checking a row costs no query; passwords are hashed
+# across a process pool while the previous batch is inserted; and rows go in
+# with one multi-row INSERT and one commit per batch. Every rejected row is
+# reported with its line number and reason.
+#
+# Fields: username, email, and either password (hashed here with
+# PASSWORD_HASH_METHOD) or password_hash (an existing werkzeug hash, e.g. from
+# another deployment), plus an optional is_admin.
+import csv
+import json
+import multiprocessing
+import os
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+from sqlalchemy import insert, select
+from sqlalchemy.exc import IntegrityError
+from werkzeug.security import generate_password_hash
+
+from app import db
+from app.models import User
+
+USERNAME_MAX_LENGTH = User.__table__.c.username.type.length
+EMAIL_MAX_LENGTH = User.__table__.c.email.type.length
+PASSWORD_HASH_MAX_LENGTH = User.__table__.c.password.type.length
+_TRUE = ('1', 'true', 'yes', 'y')
+
+# One row that passed validation; password is plain text unless hashed is set.
+ImportRow = namedtuple('ImportRow', ['line', 'username', 'email', 'password', 'hashed', 'is_admin'])
+RejectedRow = namedtuple('RejectedRow', ['line', 'username', 'email', 'error'])
+
+
+def _hash_passwords(passwords, method):
+    # Runs in a pool process: one task per chunk keeps the pickling overhead low.
+    return [generate_password_hash(password, method) for password in passwords]
+
+
+def read_records(path, file_format=None):
+    """Yield (line number, dict) for every record in a CSV or NDJSON file, streaming."""
+    file_format = file_format or ('ndjson' if path.endswith(('.ndjson', '.jsonl', '.json')) else 'csv')
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        if file_format == 'csv':
+            reader = csv.DictReader(f)
+            for record in reader:
+                yield reader.line_num, record
+            return
+        for line_number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                yield line_number, ValueError(f'invalid JSON: {e}')
+                continue
+            yield line_number, record if isinstance(record, dict) else ValueError('expected a JSON object')
+
+
+def _validate(line, record, usernames, emails):
+    # ImportRow, or the reason the record is rejected. Reserves the username and
+    # email on success so later duplicates in the same file are caught too.
+    if isinstance(record, Exception):
+        return str(record)
+    username = str(record.get('username') or '').strip()
+    email = str(record.get('email') or '').strip()
+    password = record.get('password')
+    password_hash = str(record.get('password_hash') or '').strip()
+    if not username or not email:
+        return 'username and email are required'
+    if len(username) > USERNAME_MAX_LENGTH:
+        return f'username is longer than {USERNAME_MAX_LENGTH} characters'
+    if len(email) > EMAIL_MAX_LENGTH or '@' not in email:
+        return 'invalid email'
+    if password_hash:
+        if password_hash.count('$') != 2 or len(password_hash) > PASSWORD_HASH_MAX_LENGTH:
+            return 'password_hash is not a werkzeug password hash'
+    elif not password:
+        return 'password or password_hash is required'
+    if username in usernames:
+        return 'username already exists'
+    if email.lower() in emails:
+        return 'email already exists'
+    usernames.add(username)
+    emails.add(email.lower())
+    is_admin = str(record.get('is_admin') or '').strip().lower() in _TRUE or record.get('is_admin') is True
+    return ImportRow(line, username, email, password_hash or str(password), bool(password_hash), is_admin)
+
+
+class UserImporter:
+    # Holds the pool and the known username/email sets for one import run.
+
+    def __init__(self, batch_size=1000, workers=None, method=None, dry_run=False):
+        from flask import current_app
+
+        self.batch_size = batch_size
+        self.workers = (os.cpu_count() or 1) if workers is None else workers
+        self.method = method or current_app.config.get('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1')
+        self.dry_run = dry_run
+        self.errors = []
+        self.stats = {'read': 0, 'imported': 0, 'rejected': 0, 'batches': 0, 'seconds': 0.0}
+        self._pool = None
+
+    def _known_identities(self):
+        usernames, emails = set(), set()
+        for username, email in db.session.execute(select(User.username, User.email)):
+            usernames.add(username)
+            emails.add(email.lower())
+        return usernames, emails
+
+    def _reject(self, line, record, error):
+        fields = record if isinstance(record, dict) else {}
+        self.errors.append(RejectedRow(line, fields.get('username'), fields.get('email'), error))
+        self.stats['rejected'] += 1
+
+    def _submit_hashes(self, batch):
+        # Futures (or, without a pool, finished lists) with one hash per plain-text password.
+        passwords = [row.password for row in batch if not row.hashed]
+        if self.dry_run:
+            return []
+        if self._pool is None:
+            return [_hash_passwords(passwords, self.method)]
+        chunk = max(1, -(-len(passwords) // (self.workers * 4)))
+        return [self._pool.submit(_hash_passwords, passwords[i:i + chunk], self.method)
+                for i in range(0, len(passwords), chunk)]
+
+    def _insert(self, batch, pending_hashes):
+        self.stats['batches'] += 1
+        if self.dry_run:
+            self.stats['imported'] += len(batch)
+            return
+        hashes = iter([h for part in pending_hashes for h in (part if isinstance(part, list) else part.result())])
+        values = [{'username': row.username, 'email': row.email, 'is_admin': row.is_admin,
+                   'password': row.password if row.hashed else next(hashes)} for row in batch]
+        try:
+            db.session.execute(insert(User), values)
+            db.session.commit()
+            self.stats['imported'] += len(values)
+            return
+        except IntegrityError:
+            db.session.rollback()
+        # Someone created a clashing account since the sets were loaded: retry
+        # row by row so only the offending rows are rejected.
+        for row, row_values in zip(batch, values):
+            try:
+                with db.session.begin_nested():
+                    db.session.execute(insert(User), [row_values])
+                self.stats['imported'] += 1
+            except IntegrityError:
+                self._reject(row.line, row._asdict(), 'username or email already exists')
+        db.session.commit()
+
+    def run(self, records, progress=None):
+        """Import (line, record) pairs as produced by read_records(). Returns the stats."""
+        started = time.perf_counter()
+        usernames, emails = self._known_identities()
+        if self.workers > 0:
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+            self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+        try:
+            batch = []
+            previous = None  # (batch, hash futures) still being hashed
+            for line, record in records:
+                self.stats['read'] += 1
+                row = _validate(line, record, usernames, emails)
+                if isinstance(row, str):
+                    self._reject(line, record, row)
+                    continue
+                batch.append(row)
+                if len(batch) >= self.batch_size:
+                    # Start hashing this batch, then insert the previous one meanwhile.
+                    current = (batch, self._submit_hashes(batch))
+                    if previous:
+                        self._insert(*previous)
+                        if progress:
+                            progress(self.stats, time.perf_counter() - started)
+                    previous, batch = current, []
+            if previous:
+                self._insert(*previous)
+            if batch:
+                self._insert(batch, self._submit_hashes(batch))
+        finally:
+            if self._pool is not None:
+                self._pool.shutdown(cancel_futures=True)
+                self._pool = None
+        self.stats['seconds'] = round(time.perf_counter() - started, 2)
+        return self.stats
+
+    def write_error_report(self, path):
+        with open(path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(RejectedRow._fields)
+            writer.writerows(self.errors)
@@ -0,0 +1,269 @@
+# benchmarks/auth.py
+# Benchmarks for the authentication and detection hot paths, driven through
+# create_app() and the Flask test client so they measure what a request costs
+# (routing, session, hashing, queries, templates), minus the network.
+#
+#   python -m benchmarks.auth                                  # throwaway SQLite file
+#   python -m benchmarks.auth --database-url postgresql://localhost/francis_bench
+#   python -m benchmarks.auth --output after.json --compare before.json
+#
+# Point --database-url at a scratch database: tables are created if missing
+# and bench_* users and LoginActivity rows are added to it. Results (ops/s and
+# p50/p95/p99 per case) are printed and saved as JSON for comparing commits.
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+
+import numpy as np
+
+BENCH_PASSWORD = 'BenchPassword123!'
+CASES = ['login_success', 'login_failure', 'register', 'dashboard', 'detect_single', 'detect_batch',
+         'reset_issue', 'reset_verify', 'reset_verify_invalid']
+
+
+def summarize(samples, ops_per_sample=1):
+    """ops/s and latency percentiles (ms) for a list of per-sample seconds."""
+    samples = np.asarray(samples, dtype=float)
+    total = float(samples.sum())
+    p50, p95, p99 = np.percentile(samples, [50, 95, 99]) * 1000
+    return {
+        'samples': len(samples),
+        'ops_per_sample': ops_per_sample,
+        'total_seconds': round(total, 4),
+        'ops_per_second': round(len(samples) * ops_per_sample / total, 1) if total else None,
+        'mean_ms': round(float(samples.mean()) * 1000, 3),
+        'p50_ms': round(float(p50), 3),
+        'p95_ms': round(float(p95), 3),
+        'p99_ms': round(float(p99), 3),
+        'max_ms': round(float(samples.max()) * 1000, 3),
+    }
+
+
+def timed(fn, iterations, warmup):
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+def _ip(rng):
+    return f'{rng.randint(1, 223)}.{rng.randint(0, 255)}.{rng.randint(0, 255)}.{rng.randint(1, 254)}'
+
+
+def seed(app, users, activity, rng):
+    """Make sure bench_user_0..users-1 exist and at least `activity` LoginActivity rows."""
+    from sqlalchemy import func, insert, select
+    from app import db
+    from app.hashing import password_hasher
+    from app.models import LoginActivity, User
+
+    with app.app_context():
+        db.create_all()
+        existing = set(db.session.execute(
+            select(User.username).where(User.username.like('bench_user_%'))).scalars())
+        # One hash shared by every bench user: seeding shouldn't take users * hash time.
+        hashed = password_hasher.hash(BENCH_PASSWORD)
+        missing = [{'username': f'bench_user_{i}', 'email': f'bench_user_{i}@bench.invalid',
+                    'password': hashed, 'is_admin': False}
+                   for i in range(users) if f'bench_user_{i}' not in existing]
+        for start in range(0, len(missing), 5000):
+            db.session.execute(insert(User), missing[start:start + 5000])
+
+        have = db.session.execute(select(func.count()).select_from(LoginActivity)).scalar()
+        now = datetime.utcnow()
+        rows = []
+        for _ in range(max(activity - have, 0)):
+            rows.append({'username': f'bench_user_{rng.randrange(users)}', 'ip_address': _ip(rng),
+                         'timestamp': now - timedelta(seconds=rng.randrange(90 * 86400)),
+                         'is_suspicious': rng.random() < 0.05})
+            if len(rows) == 10000:
+                db.session.execute(insert(LoginActivity), rows)
+                rows = []
+        if rows:
+            db.session.execute(insert(LoginActivity), rows)
+        db.session.commit()
+
+
+def run_cases(app, args, rng):
+    from app import db
+    from app.ai.detect_anomaly import detect_anomaly, score_batch
+
+    results = {}
+    usernames = [f'bench_user_{i}' for i in range(args.users)]
+
+    def login(password):
+        client = app.test_client()
+        response = client.post('/login', data={'username': rng.choice(usernames), 'password': password},
+                               environ_base={'REMOTE_ADDR': _ip(rng)})
+        expected = 302 if password == BENCH_PASSWORD else 200
+        if response.status_code != expected:
+            raise RuntimeError(f'/login returned {response.status_code}, expected {expected}')
+
+    def register():
+        name = f'bench_reg_{uuid.uuid4().hex[:12]}'
+        response = app.test_client().post('/register', data={
+            'username': name, 'email': f'{name}@bench.invalid', 'password': BENCH_PASSWORD})
+        if response.status_code != 302:
+            raise RuntimeError(f'/register returned {response.status_code}')
+
+    dashboard_client = app.test_client()
+    dashboard_client.post('/login', data={'username': usernames[0], 'password': BENCH_PASSWORD})
+
+    def dashboard():
+        response = dashboard_client.get('/user_dashboard')
+        if response.status_code != 200:
+            raise RuntimeError(f'/user_dashboard returned {response.status_code}')
+
+    selected = args.cases or CASES
+    if 'login_success' in selected:
+        results['login_success'] = summarize(timed(lambda: login(BENCH_PASSWORD), args.iterations, args.warmup))
+    if 'login_failure' in selected:
+        results['login_failure'] = summarize(timed(lambda: login('wrong-password'), args.iterations, args.warmup))
+    if 'register' in selected:
+        results['register'] = summarize(timed(register, args.iterations, args.warmup))
+    if 'dashboard' in selected:
+        results['dashboard'] = summarize(timed(dashboard, args.iterations, args.warmup))
+
+    with app.app_context():
+        if 'detect_single' in selected:
+            results['detect_single'] = summarize(timed(
+                lambda: detect_anomaly(rng.choice(usernames), _ip(rng)), args.iterations, args.warmup))
+        if 'detect_batch' in selected:
+            batch_users = [rng.choice(usernames) for _ in range(args.batch_size)]
+            batch_ips = [_ip(rng) for _ in range(args.batch_size)]
+            samples = timed(lambda: score_batch(batch_users, batch_ips),
+                            max(args.iterations // 10, 5), args.warmup)
+            results['detect_batch'] = summarize(samples, ops_per_sample=args.batch_size)
+
+        # Reset tokens: issuing, verifying a valid one (one primary-key lookup)
+        # and rejecting a tampered one (signature only, no query).
+        from app.models import User
+        from app.tokens import reset_tokens
+        reset_users = User.query.filter(User.username.in_(usernames[:100])).all()
+        tokens = [reset_tokens.issue(user) for user in reset_users]
+        if 'reset_issue' in selected:
+            results['reset_issue'] = summarize(timed(
+                lambda: reset_tokens.issue(rng.choice(reset_users)), args.iterations, args.warmup))
+        if 'reset_verify' in selected:
+            def verify():
+                if reset_tokens.verify(rng.choice(tokens)) is None:
+                    raise RuntimeError('a freshly issued reset token did not verify')
+                db.session.remove()  # fresh identity map, like a new request
+            results['reset_verify'] = summarize(timed(verify, args.iterations, args.warmup))
+        if 'reset_verify_invalid' in selected:
+            tampered = [token[:-4] + ('AAAA' if not token.endswith('AAAA') else 'BBBB') for token in tokens]
+            results['reset_verify_invalid'] = summarize(timed(
+                lambda: reset_tokens.verify(rng.choice(tampered)), args.iterations, args.warmup))
+    return results
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(current, baseline_path):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    print(f"\nvs {baseline_path} (commit {baseline['meta'].get('commit')}):")
+    for case, result in current['results'].items():
+        before = baseline['results'].get(case)
+        if not before:
+            continue
+        changes = []
+        for key in ('ops_per_second', 'p50_ms', 'p95_ms', 'p99_ms'):
+            if before.get(key):
+                changes.append(f'{key} {(result[key] - before[key]) / before[key] * 100:+.1f}%')
+        print(f'  {case:20s} ' + '  '.join(changes))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the login, registration and anomaly detection hot paths.')
+    parser.add_argument('--database-url', help='Scratch database (default: a new temporary SQLite file).')
+    parser.add_argument('--users', type=int, default=1000, help='bench_* users to seed.')
+    parser.add_argument('--activity', type=int, default=100000, help='LoginActivity rows to seed.')
+    parser.add_argument('--iterations', type=int, default=200, help='Timed requests per case.')
+    parser.add_argument('--warmup', type=int, default=10, help='Untimed requests per case first.')
+    parser.add_argument('--batch-size', type=int, default=1000, help='Logins per score_batch call.')
+    parser.add_argument('--events-mode', default='inline', choices=['inline', 'thread', 'worker'],
+                        help='LOGIN_EVENTS_MODE while benchmarking (inline times the whole login).')
+    parser.add_argument('--hash-workers', type=int, default=None, help='HASH_WORKERS (default: config).')
+    parser.add_argument('--case', dest='cases', action='append', choices=CASES, help='Only run this case (repeatable).')
+    parser.add_argument('--seed', type=int, default=1234, help='Random seed, for repeatable data.')
+    parser.add_argument('--output', default=None, help='Write results JSON here.')
+    parser.add_argument('--compare', default=None, help='Baseline results JSON to diff against.')
+    args = parser.parse_args(argv)
+
+    database_url = args.database_url
+    if not database_url:
+        database_url = 'sqlite:///' + os.path.join(tempfile.mkdtemp(prefix='francis-bench-'), 'bench.db')
+    # Configure through the environment before create_app() reads config.py.
+    os.environ.update({
+        'DATABASE_URL': database_url,
+        'RUN_RELEASE_ON_STARTUP': '0',
+        'RATELIMIT_ENABLED': '0',  # we're the credential stuffer here
+        'OUTBOX_WORKERS': '0',
+        'LOGIN_EVENTS_MODE': args.events_mode,
+    })
+    if args.hash_workers is not None:
+        os.environ['HASH_WORKERS'] = str(args.hash_workers)
+
+    from app import create_app
+    started = time.perf_counter()
+    app = create_app()
+    create_app_seconds = time.perf_counter() - started
+
+    rng = random.Random(args.seed)
+    print(f'Seeding {args.users} users / {args.activity} activity rows...', file=sys.stderr)
+    seed(app, args.users, args.activity, rng)
+
+    with app.app_context():
+        from app import db
+        dialect = db.engine.dialect.name
+
+    output = {
+        'meta': {
+            'commit': _git_commit(),
+            'timestamp': datetime.utcnow().isoformat(timespec='seconds') + 'Z',
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'dialect': dialect,
+            'create_app_seconds': round(create_app_seconds, 3),
+            'password_hash_method': app.config.get('PASSWORD_HASH_METHOD'),
+            'hash_workers': app.config.get('HASH_WORKERS'),
+            'args': {k: v for k, v in vars(args).items() if k not in ('output', 'compare')},
+        },
+        'results': run_cases(app, args, rng),
+    }
+
+    print(f"{'case':20s} {'ops/s':>10s} {'p50 ms':>9s} {'p95 ms':>9s} {'p99 ms':>9s}")
+    for case, result in output['results'].items():
+        print(f"{case:20s} {result['ops_per_second']:>10} {result['p50_ms']:>9} "
+              f"{result['p95_ms']:>9} {result['p99_ms']:>9}")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(output, f, indent=2)
+        print(f'Saved {args.output}', file=sys.stderr)
+    if args.compare:
+        compare(output, args.compare)
+    return output
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,172 @@
+# benchmarks/startup.py
+# Cold-start benchmark: how long a fresh process takes to import the app and
+# run create_app(), how much memory it holds afterwards, and where the import
+# time goes (python -X importtime, summarised). Each run is a new interpreter,
+# so nothing is cached between runs except the OS page cache.
+#
+#   python -m benchmarks.startup
+#   python -m benchmarks.startup --runs 10 --output after.json --compare before.json
+#   python -m benchmarks.startup --max-boot-ms 1500 --forbid-heavy   # fail a CI job on regressions
+#
+# -X importtime adds its own overhead, so compare import reports with each
+# other rather than with boot_ms.
+#
+# Heavy libraries that only batch jobs need (pandas, scikit-learn, alembic,
+# pdfkit...) are listed if a web worker's boot imported them.
+import argparse
+import json
+import os
+import platform
+import re
+import subprocess
+import sys
+import tempfile
+from datetime import datetime
+
+import numpy as np
+
+# Imported by CLI or batch code only; a web worker boot should not load them.
+HEAVY_MODULES = ['pandas', 'sklearn', 'scipy', 'joblib', 'alembic', 'flask_migrate', 'pdfkit', 'matplotlib']
+
+# What a gunicorn worker does on boot (wsgi.py), timed from inside the child.
+CHILD_SCRIPT = '''
+import json, resource, sys, time
+started = time.perf_counter()
+from app import create_app
+imported = time.perf_counter()
+app = create_app()
+finished = time.perf_counter()
+print(json.dumps({
+    'import_ms': (imported - started) * 1000,
+    'create_app_ms': (finished - imported) * 1000,
+    'boot_ms': (finished - started) * 1000,
+    'rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    'modules': len(sys.modules),
+    'heavy': sorted(name for name in %r if name in sys.modules),
+}))
+'''
+
+_IMPORTTIME = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$')
+
+
+def parse_importtime(stderr):
+    """[(module, self_us, cumulative_us, depth)] from -X importtime output."""
+    entries = []
+    for line in stderr.splitlines():
+        match = _IMPORTTIME.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            entries.append((name, int(self_us), int(cumulative_us), len(indent) // 2))
+    return entries
+
+
+def import_report(entries, top):
+    """Slowest outermost imports (cumulative) and modules (self time), in milliseconds."""
+    # Outermost imports only (nested entries are already in their parent's
+    # cumulative time); create_app()'s deferred imports show up here too.
+    outermost = {name: cumulative_us for name, _, cumulative_us, depth in entries if depth == 0}
+    by_self = sorted(entries, key=lambda entry: entry[1], reverse=True)[:top]
+    return {
+        'outermost_cumulative_ms': {name: round(us / 1000, 1) for name, us in
+                                    sorted(outermost.items(), key=lambda item: item[1], reverse=True)[:top]},
+        'modules_self_ms': {name: round(self_us / 1000, 1) for name, self_us, _, _ in by_self},
+    }
+
+
+def run_once(env):
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', CHILD_SCRIPT % (HEAVY_MODULES,)],
+                            capture_output=True, text=True, env=env, cwd=os.getcwd())
+    if result.returncode != 0:
+        raise RuntimeError(f'create_app() failed:\n{result.stderr[-2000:]}')
+    measurements = json.loads(result.stdout.strip().splitlines()[-1])
+    return measurements, parse_importtime(result.stderr)
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(current, baseline_path):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    print(f"\nvs {baseline_path} (commit {baseline['meta'].get('commit')}):")
+    for key, value in current['results'].items():
+        before = baseline['results'].get(key)
+        if isinstance(value, (int, float)) and before:
+            print(f'  {key:15s} {before:>9} -> {value:>9}  ({(value - before) / before * 100:+.1f}%)')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark app import + create_app() in fresh processes.')
+    parser.add_argument('--runs', type=int, default=5, help='Fresh interpreters to time (median is reported).')
+    parser.add_argument('--top', type=int, default=15, help='Entries in the import-time report.')
+    parser.add_argument('--database-url', help='DATABASE_URL for the child (default: a throwaway SQLite file).')
+    parser.add_argument('--no-model-preload', action='store_true', help='Set ANOMALY_MODEL_PRELOAD=0.')
+    parser.add_argument('--max-boot-ms', type=float, default=None, help='Exit 1 if the median boot is slower.')
+    parser.add_argument('--forbid-heavy', action='store_true', help='Exit 1 if a HEAVY_MODULES entry was imported.')
+    parser.add_argument('--output', default=None, help='Write results JSON here.')
+    parser.add_argument('--compare', default=None, help='Baseline results JSON to diff against.')
+    args = parser.parse_args(argv)
+
+    env = dict(os.environ, RUN_RELEASE_ON_STARTUP='0', PYTHONWARNINGS='ignore',
+               DATABASE_URL=args.database_url or 'sqlite:///' + os.path.join(tempfile.mkdtemp(prefix='francis-boot-'), 'boot.db'))
+    if args.no_model_preload:
+        env['ANOMALY_MODEL_PRELOAD'] = '0'
+
+    runs = []
+    for i in range(args.runs):
+        runs.append(run_once(env))
+        print(f"run {i + 1}: boot {runs[-1][0]['boot_ms']:.0f} ms, rss {runs[-1][0]['rss_mb']:.1f} MB", file=sys.stderr)
+    # Report the import breakdown of the median run.
+    boots = [measurements['boot_ms'] for measurements, _ in runs]
+    median_run = runs[int(np.argsort(boots)[len(boots) // 2])]
+
+    results = {key: round(float(np.median([m[key] for m, _ in runs])), 1)
+               for key in ('boot_ms', 'import_ms', 'create_app_ms', 'rss_mb', 'modules')}
+    output = {
+        'meta': {
+            'commit': _git_commit(),
+            'timestamp': datetime.utcnow().isoformat(timespec='seconds') + 'Z',
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'args': {k: v for k, v in vars(args).items() if k not in ('output', 'compare')},
+        },
+        'results': results,
+        'heavy_modules': median_run[0]['heavy'],
+        'imports': import_report(median_run[1], args.top),
+    }
+
+    for key, value in results.items():
+        print(f'{key:15s} {value:>9}')
+    print('heavy modules   ' + (', '.join(output['heavy_modules']) or 'none'))
+    print('\nslowest outermost imports (cumulative ms):')
+    for name, ms in output['imports']['outermost_cumulative_ms'].items():
+        print(f'  {name:30s} {ms:>8}')
+    print('slowest modules (self ms):')
+    for name, ms in output['imports']['modules_self_ms'].items():
+        print(f'  {name:30s} {ms:>8}')
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(output, f, indent=2)
+        print(f'Saved {args.output}', file=sys.stderr)
+    if args.compare:
+        compare(output, args.compare)
+
+    failed = False
+    if args.max_boot_ms and results['boot_ms'] > args.max_boot_ms:
+        print(f"FAIL: median boot {results['boot_ms']} ms > {args.max_boot_ms} ms", file=sys.stderr)
+        failed = True
+    if args.forbid_heavy and output['heavy_modules']:
+        print(f"FAIL: boot imported {', '.join(output['heavy_modules'])}", file=sys.stderr)
+        failed = True
+    if failed:
+        sys.exit(1)
+    return output
+
+
+if __name__ == '__main__':
+    main()
@@ -5,12 +5,26 @@ class Config:
     # Use os.environ.get to fetch from environment variables (recommended for deployment)
     # Provide a strong fallback or ensure .env is correctly loaded.
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'francislota08_super_secure_key'
+    # Seconds a password reset link stays valid; each link also stops working once used (app/tokens.py).
+    RESET_TOKEN_MAX_AGE = int(os.environ.get('RESET_TOKEN_MAX_AGE') or 1800)
 
     # Database configuration
     # For SQLite, it's relative to the instance folder
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or 'sqlite:///instance/site.db'
     SQLALCHEMY_TRACK_MODIFICATIONS = False # Recommended: silence Flask-SQLAlchemy warnings
 
+    # Connection pool per worker process (app/database.py); sizing is ignored for in-memory SQLite.
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE') or 5) # connections kept open
+    DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW') or 10) # extra connections allowed under load
+    DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT') or 30) # seconds to wait for a free connection
+    DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE') or 1800) # reconnect connections older than this (-1: never)
+    DB_POOL_PRE_PING = os.environ.get('DB_POOL_PRE_PING', '1') != '0' # test connections on checkout
+    DB_STATEMENT_TIMEOUT_MS = int(os.environ.get('DB_STATEMENT_TIMEOUT_MS') or 0) # PostgreSQL statement_timeout; 0 = server default
+    # Read replica for dashboards, activity reads and the user loader; writes always go to the primary.
+    DATABASE_REPLICA_URL = os.environ.get('DATABASE_REPLICA_URL')
+    # After a request writes, that client reads from the primary for this many seconds (replication lag).
+    DB_REPLICA_STICKY_SECONDS = float(os.environ.get('DB_REPLICA_STICKY_SECONDS') or 5)
+
     # Flask-Mail configuration
     # Ensure these are set in your .env file in production
     MAIL_SERVER = os.environ.get('MAIL_SERVER') or 'smtp.googlemail.com'
@@ -19,4 +33,123 @@ class Config:
     MAIL_USERNAME = os.environ.get('francislota08@gmail') # Your email for sending
     MAIL_PASSWORD = os.environ.get('quitsgfjavbunkgx') # Your email password/app password
     MAIL_DEFAULT_SENDER = os.environ.get('MAIL_DEFAULT_SENDER') or 'francislota08@gmail' # Email from which alerts/resets are sent
-    
\ No newline at end of file
+
+    # Logging and metrics (app/logging_setup.py, app/metrics.py)
+    LOG_LEVEL = os.environ.get('LOG_LEVEL') or 'INFO'
+    LOG_FORMAT = os.environ.get('LOG_FORMAT') or 'text' # 'json' for one JSON object per line
+    # /metrics answers scrapers sending "Authorization: Bearer <METRICS_TOKEN>" and logged-in admins;
+    # METRICS_PUBLIC=1 opens it to anyone (only behind a private network).
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+    METRICS_PUBLIC = os.environ.get('METRICS_PUBLIC', '0') == '1'
+
+    # Startup
+    # Run migrations + default admin seeding inside create_app(). Off by default: use `flask release`.
+    RUN_RELEASE_ON_STARTUP = os.environ.get('RUN_RELEASE_ON_STARTUP', '0') == '1'
+    # create_app() logs a warning when it takes longer than this (milliseconds); 0 disables the check.
+    COLD_START_BUDGET_MS = float(os.environ.get('COLD_START_BUDGET_MS') or 2000)
+
+    # Anomaly model
+    # Path to the pickled model; defaults to app/ai/model/model.pkl when unset.
+    ANOMALY_MODEL_PATH = os.environ.get('ANOMALY_MODEL_PATH')
+    # Load the model inside create_app() so the first login doesn't pay for it.
+    ANOMALY_MODEL_PRELOAD = os.environ.get('ANOMALY_MODEL_PRELOAD', '1') != '0'
+    # Seconds between checks of the model file for a new version.
+    ANOMALY_MODEL_CHECK_INTERVAL = float(os.environ.get('ANOMALY_MODEL_CHECK_INTERVAL') or 5)
+    # 'auto' loads model.forest.npz (memory-mapped, no pickle) when it exists, else model.pkl;
+    # 'forest' requires the export, 'pickle' ignores it.
+    ANOMALY_MODEL_FORMAT = os.environ.get('ANOMALY_MODEL_FORMAT') or 'auto'
+    # Shadow models scored on live logins without affecting verdicts (app/ai/shadow.py):
+    # comma-separated "name=path/to/model.pkl" entries; compare with `flask shadow-report`.
+    ANOMALY_SHADOW_MODELS = os.environ.get('ANOMALY_SHADOW_MODELS') or ''
+    ANOMALY_SHADOW_SAMPLE_RATE = float(os.environ.get('ANOMALY_SHADOW_SAMPLE_RATE') or 1.0) # share of logins shadowed
+    ANOMALY_SHADOW_QUEUE_SIZE = int(os.environ.get('ANOMALY_SHADOW_QUEUE_SIZE') or 1000) # jobs; more are dropped
+    # Streaming half-space-trees detector updated by every login (app/ai/online.py):
+    # 'off', 'observe' (scored and learnt only), 'confirm' (IsolationForest flags need its agreement)
+    # or 'replace' (its verdict is used instead).
+    ANOMALY_ONLINE_MODE = os.environ.get('ANOMALY_ONLINE_MODE') or 'off'
+    ANOMALY_ONLINE_PATH = os.environ.get('ANOMALY_ONLINE_PATH') # checkpoint; defaults to <instance>/online_model.npz
+    ANOMALY_ONLINE_TREES = int(os.environ.get('ANOMALY_ONLINE_TREES') or 25)
+    ANOMALY_ONLINE_DEPTH = int(os.environ.get('ANOMALY_ONLINE_DEPTH') or 10) # memory is trees x 2^(depth+1) counters
+    ANOMALY_ONLINE_WINDOW = int(os.environ.get('ANOMALY_ONLINE_WINDOW') or 1000) # logins per window; adapts within two
+    ANOMALY_ONLINE_QUANTILE = float(os.environ.get('ANOMALY_ONLINE_QUANTILE') or 0.02) # flag the sparsest share, judged on the previous window
+    ANOMALY_ONLINE_CHECKPOINT_SECONDS = float(os.environ.get('ANOMALY_ONLINE_CHECKPOINT_SECONDS') or 300)
+    # Compiled IP range table (`flask build-ipinfo`); defaults to <instance>/ipinfo.npz.
+    IPINFO_PATH = os.environ.get('IPINFO_PATH')
+
+    # Logged-in user cache (app/user_cache.py). Admin access is always re-checked against the database.
+    USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE') or 10000) # Users kept per worker; 0 disables the cache
+    USER_CACHE_TTL = float(os.environ.get('USER_CACHE_TTL') or 60) # Seconds before a cached user is re-read
+
+    # Password hashing (app/hashing.py)
+    # werkzeug method string including its cost; older hashes are upgraded on the next login.
+    PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD') or 'scrypt:32768:8:1'
+    # Hashing processes per web worker; 0 hashes inline. By default the CPUs are shared out across
+    # the WEB_CONCURRENCY gunicorn workers instead of every worker starting one process per CPU.
+    HASH_WORKERS = int(os.environ.get('HASH_WORKERS')
+                       or max(1, (os.cpu_count() or 1) // int(os.environ.get('WEB_CONCURRENCY') or 2)))
+    HASH_QUEUE_SIZE = int(os.environ.get('HASH_QUEUE_SIZE') or 32) # Jobs allowed to wait beyond HASH_WORKERS before returning 503
+    HASH_TIMEOUT = float(os.environ.get('HASH_TIMEOUT') or 10) # Seconds to wait for one hash before giving up
+
+    # Flag an otherwise normal login when its username or IP had at least this many
+    # rejected/failed attempts in the last RATELIMIT_FAILURE_WINDOW seconds; 0 disables.
+    ANOMALY_FAILURE_THRESHOLD = int(os.environ.get('ANOMALY_FAILURE_THRESHOLD') or 5)
+
+    # Login rate limiting (app/ratelimit.py). Limits are "<attempts>/<seconds>" token buckets.
+    RATELIMIT_ENABLED = os.environ.get('RATELIMIT_ENABLED', '1') != '0'
+    # 'memory' keeps buckets per worker process; 'sql' shares them through the database.
+    RATELIMIT_BACKEND = os.environ.get('RATELIMIT_BACKEND') or 'memory'
+    RATELIMIT_LOGIN_PER_IP = os.environ.get('RATELIMIT_LOGIN_PER_IP') or '10/60'
+    RATELIMIT_LOGIN_PER_SUBNET = os.environ.get('RATELIMIT_LOGIN_PER_SUBNET') or '50/60' # /24 (IPv4) or /64 (IPv6)
+    RATELIMIT_LOGIN_PER_USERNAME = os.environ.get('RATELIMIT_LOGIN_PER_USERNAME') or '5/60'
+    RATELIMIT_RESET_PER_IP = os.environ.get('RATELIMIT_RESET_PER_IP') or '5/300' # Password reset requests
+    RATELIMIT_RESET_PER_EMAIL = os.environ.get('RATELIMIT_RESET_PER_EMAIL') or '3/3600' # Reset emails sent per address
+    RATELIMIT_RESET_VERIFY_PER_IP = os.environ.get('RATELIMIT_RESET_VERIFY_PER_IP') or '20/300' # Reset token checks
+    RATELIMIT_MAX_KEYS = int(os.environ.get('RATELIMIT_MAX_KEYS') or 100000) # Buckets kept in memory per worker
+    # 'sql' backend: about one new bucket in this many also deletes fully refilled ones (0: only `flask prune-rate-limits`).
+    RATELIMIT_PRUNE_EVERY = int(os.environ.get('RATELIMIT_PRUNE_EVERY') or 1000)
+    RATELIMIT_FAILURE_WINDOW = float(os.environ.get('RATELIMIT_FAILURE_WINDOW') or 900)
+
+    # Login event pipeline (app/events.py): where scoring, LoginActivity inserts and alerts run.
+    # 'inline' (in the request), 'thread' (background thread per web worker) or 'worker'
+    # (`flask login-event-worker` scores rows the request inserted).
+    LOGIN_EVENTS_MODE = os.environ.get('LOGIN_EVENTS_MODE') or 'thread'
+    LOGIN_EVENTS_QUEUE_SIZE = int(os.environ.get('LOGIN_EVENTS_QUEUE_SIZE') or 10000) # Events buffered per worker in thread mode
+    LOGIN_EVENTS_BATCH_SIZE = int(os.environ.get('LOGIN_EVENTS_BATCH_SIZE') or 500) # Events scored/inserted per batch
+    # When the queue is full: 'inline' (process in the request), 'block' (wait, then inline) or 'drop'.
+    LOGIN_EVENTS_OVERFLOW = os.environ.get('LOGIN_EVENTS_OVERFLOW') or 'inline'
+    LOGIN_EVENTS_BLOCK_TIMEOUT = float(os.environ.get('LOGIN_EVENTS_BLOCK_TIMEOUT') or 0.05) # Seconds, for 'block'
+    LOGIN_EVENTS_POLL_INTERVAL = float(os.environ.get('LOGIN_EVENTS_POLL_INTERVAL') or 1) # Worker mode idle sleep
+
+    # Per-user login profiles (app/profiles.py)
+    PROFILE_CACHE_SIZE = int(os.environ.get('PROFILE_CACHE_SIZE') or 10000) # Profiles kept per worker; 0 disables the cache
+    PROFILE_CACHE_TTL = float(os.environ.get('PROFILE_CACHE_TTL') or 300) # Seconds before a cached profile is re-read
+    PROFILE_MAX_KNOWN_IPS = int(os.environ.get('PROFILE_MAX_KNOWN_IPS') or 16) # Recent IPs remembered per user
+
+    # Activity log pagination (app/activity.py)
+    ACTIVITY_PAGE_SIZE = int(os.environ.get('ACTIVITY_PAGE_SIZE') or 50)
+    ACTIVITY_MAX_PAGE_SIZE = int(os.environ.get('ACTIVITY_MAX_PAGE_SIZE') or 500) # Upper bound for ?limit=
+
+    # Activity log exports (app/export.py)
+    EXPORT_DIR = os.environ.get('EXPORT_DIR') # Where PDF export jobs write; defaults to <instance>/exports
+    EXPORT_MAX_AGE_SECONDS = int(os.environ.get('EXPORT_MAX_AGE_SECONDS') or 86400) # Finished exports are deleted after this
+    EXPORT_PDF_WORKERS = int(os.environ.get('EXPORT_PDF_WORKERS') or 1) # PDFs rendered at once per worker; more get a 429
+
+    # Activity retention (app/retention.py): raw LoginActivity older than this many days is
+    # rolled up into login_activity_daily by `flask rollup-activity`. 0 keeps everything.
+    ACTIVITY_RETENTION_DAYS = int(os.environ.get('ACTIVITY_RETENTION_DAYS') or 0)
+
+    # Dashboard statistics (app/stats.py), maintained by `flask compact-stats`.
+    STATS_COMPACT_HOURS = int(os.environ.get('STATS_COMPACT_HOURS') or 3) # recent hours recomputed exactly per run
+    STATS_TOP_KEYS = int(os.environ.get('STATS_TOP_KEYS') or 20) # IPs/usernames kept per hour
+    STATS_MINUTE_RETENTION_HOURS = int(os.environ.get('STATS_MINUTE_RETENTION_HOURS') or 48) # per-minute rows kept
+
+    # Email outbox (app/outbox.py)
+    # Delivery threads per web worker; set to 0 and run `flask outbox-worker` to deliver out of process.
+    OUTBOX_WORKERS = int(os.environ.get('OUTBOX_WORKERS') or 1)
+    OUTBOX_BATCH_SIZE = int(os.environ.get('OUTBOX_BATCH_SIZE') or 50) # Messages sent per SMTP connection
+    OUTBOX_POLL_INTERVAL = float(os.environ.get('OUTBOX_POLL_INTERVAL') or 5) # Seconds between idle polls
+    OUTBOX_MAX_ATTEMPTS = int(os.environ.get('OUTBOX_MAX_ATTEMPTS') or 5)
+    OUTBOX_BACKOFF_SECONDS = float(os.environ.get('OUTBOX_BACKOFF_SECONDS') or 30) # First retry delay, doubled per attempt
+    OUTBOX_BACKOFF_MAX_SECONDS = float(os.environ.get('OUTBOX_BACKOFF_MAX_SECONDS') or 3600)
+    OUTBOX_LEASE_SECONDS = float(os.environ.get('OUTBOX_LEASE_SECONDS') or 300) # Reclaim messages stuck in 'sending' after this
+    OUTBOX_DEDUPE_WINDOW = float(os.environ.get('OUTBOX_DEDUPE_WINDOW') or 600) # Same user+IP alert is sent once per window
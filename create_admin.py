@@ -3,7 +3,7 @@
 from app import create_app, db
 from app.models import User # Corrected import path for models
 
-from werkzeug.security import generate_password_hash # For password hashing
+from app.hashing import password_hasher # For password hashing
 
 def create_admin_user():
     # Create an app instance using the factory
@@ -25,7 +25,7 @@ def create_admin_user():
             print(f"Error: User with email '{email}' already exists. Please use a different email.")
             return
 
-        hashed_password = generate_password_hash(password)
+        hashed_password = password_hasher.hash(password)
         new_admin = User(username=username, email=email, password=hashed_password, is_admin=True)
 
         try:
@@ -0,0 +1,38 @@
+# gunicorn.conf.py
+# Read automatically by `gunicorn run:app` (Procfile) from the project root.
+#
+# With preload_app the master imports the app and runs create_app() once, and
+# every worker is forked from it, sharing those pages copy-on-write: imported
+# modules, compiled templates, the memory-mapped model and IP range table.
+# What must not cross a fork is rebuilt per worker: the password hashing pool,
+# the login event / shadow threads and the online detector notice the new pid
+# on first use, and post_fork() below drops any database connections the
+# master opened.
+#
+# Compare boots with `python -m benchmarks.startup`.
+import gc
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+workers = int(os.environ.get('WEB_CONCURRENCY') or 2)
+threads = int(os.environ.get('GUNICORN_THREADS') or 1)
+timeout = int(os.environ.get('GUNICORN_TIMEOUT') or 30)
+preload_app = os.environ.get('GUNICORN_PRELOAD', '1') != '0'
+
+
+def when_ready(server):
+    # Runs in the master after the (preloaded) app is loaded, before any fork.
+    # Frozen objects are skipped by the collector, so collections in the
+    # workers stop writing to, and thereby copying, the shared pages.
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    if not server.cfg.preload_app:
+        return
+    from app import db
+    app = server.app.wsgi()
+    with app.app_context():
+        for engine in db.engines.values():
+            # close=False: the master's sockets aren't ours to close; just start a fresh pool.
+            engine.dispose(close=False)
@@ -0,0 +1,37 @@
+"""Add shadow_verdict table for shadow model evaluation
+
+Revision ID: 5d8e2f1a6b34
+Revises: 0b6e4d2a9c17
+Create Date: 2026-10-18 14:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5d8e2f1a6b34'
+down_revision = '0b6e4d2a9c17'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('shadow_verdict',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('shadow', sa.String(length=64), nullable=False),
+        sa.Column('shadow_version', sa.String(length=12), nullable=False),
+        sa.Column('primary_version', sa.String(length=12), nullable=False),
+        sa.Column('primary_flag', sa.Boolean(), nullable=False),
+        sa.Column('shadow_flag', sa.Boolean(), nullable=False),
+        sa.Column('primary_score', sa.Float(), nullable=False),
+        sa.Column('shadow_score', sa.Float(), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_shadow_verdict_shadow_created_at', 'shadow_verdict', ['shadow', 'created_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_shadow_verdict_shadow_created_at', table_name='shadow_verdict')
+    op.drop_table('shadow_verdict')
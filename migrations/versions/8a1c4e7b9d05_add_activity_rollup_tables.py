@@ -0,0 +1,39 @@
+"""Add activity_rollup and activity_top_key tables for dashboard statistics
+
+Revision ID: 8a1c4e7b9d05
+Revises: 5d8e2f1a6b34
+Create Date: 2026-10-18 15:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8a1c4e7b9d05'
+down_revision = '5d8e2f1a6b34'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('activity_rollup',
+        sa.Column('granularity', sa.String(length=8), nullable=False),
+        sa.Column('bucket', sa.DateTime(), nullable=False),
+        sa.Column('logins', sa.Integer(), nullable=False),
+        sa.Column('suspicious_logins', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('granularity', 'bucket')
+    )
+    op.create_table('activity_top_key',
+        sa.Column('kind', sa.String(length=16), nullable=False),
+        sa.Column('hour', sa.DateTime(), nullable=False),
+        sa.Column('key', sa.String(length=150), nullable=False),
+        sa.Column('logins', sa.Integer(), nullable=False),
+        sa.Column('suspicious_logins', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('kind', 'hour', 'key')
+    )
+
+
+def downgrade():
+    op.drop_table('activity_top_key')
+    op.drop_table('activity_rollup')
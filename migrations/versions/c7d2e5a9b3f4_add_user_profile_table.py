@@ -0,0 +1,33 @@
+"""Add user_profile table for per-user login history
+
+Revision ID: c7d2e5a9b3f4
+Revises: a41c9e7d2f10
+Create Date: 2026-10-18 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c7d2e5a9b3f4'
+down_revision = 'a41c9e7d2f10'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('user_profile',
+        sa.Column('username', sa.String(length=150), nullable=False),
+        sa.Column('login_count', sa.Integer(), nullable=False),
+        sa.Column('first_seen', sa.DateTime(), nullable=True),
+        sa.Column('last_seen', sa.DateTime(), nullable=True),
+        sa.Column('known_ips', sa.Text(), nullable=False),
+        sa.Column('hour_histogram', sa.String(length=200), nullable=False),
+        sa.Column('recent_rate', sa.Float(), nullable=False),
+        sa.PrimaryKeyConstraint('username')
+    )
+
+
+def downgrade():
+    op.drop_table('user_profile')
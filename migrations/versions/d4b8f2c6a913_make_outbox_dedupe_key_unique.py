@@ -0,0 +1,35 @@
+"""Make outbox_message.dedupe_key unique so concurrent alerts are queued once
+
+Revision ID: d4b8f2c6a913
+Revises: 8a1c4e7b9d05
+Create Date: 2026-10-19 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd4b8f2c6a913'
+down_revision = '8a1c4e7b9d05'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Only the newest message per key keeps it; older ones are past their
+    # window or were the duplicates the unique index now prevents.
+    op.execute(sa.text(
+        "UPDATE outbox_message SET dedupe_key = NULL "
+        "WHERE dedupe_key IS NOT NULL AND id NOT IN "
+        "(SELECT MAX(id) FROM outbox_message WHERE dedupe_key IS NOT NULL GROUP BY dedupe_key)"
+    ))
+    with op.batch_alter_table('outbox_message', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_outbox_message_dedupe_key'))
+        batch_op.create_index(batch_op.f('ix_outbox_message_dedupe_key'), ['dedupe_key'], unique=True)
+
+
+def downgrade():
+    with op.batch_alter_table('outbox_message', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_outbox_message_dedupe_key'))
+        batch_op.create_index(batch_op.f('ix_outbox_message_dedupe_key'), ['dedupe_key'], unique=False)
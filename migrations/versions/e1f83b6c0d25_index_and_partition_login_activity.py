@@ -0,0 +1,157 @@
+"""Index login_activity, add login_activity_daily, optional monthly partitions
+
+Revision ID: e1f83b6c0d25
+Revises: c7d2e5a9b3f4
+Create Date: 2026-10-18 11:00:00.000000
+
+Set LOGIN_ACTIVITY_PARTITIONING=monthly when running this migration against
+PostgreSQL to convert login_activity into a table partitioned by month on
+timestamp. SQLite (and PostgreSQL without the variable) only gets the indexes.
+
+Either way login_activity.timestamp becomes NOT NULL (the partition key has to
+be); rows without one are backfilled with the migration time (UTC).
+
+"""
+import os
+from datetime import date
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e1f83b6c0d25'
+down_revision = 'c7d2e5a9b3f4'
+branch_labels = None
+depends_on = None
+
+INDEXES = [
+    ('ix_login_activity_timestamp', ['timestamp']),
+    ('ix_login_activity_username_timestamp', ['username', 'timestamp']),
+    ('ix_login_activity_ip_address_timestamp', ['ip_address', 'timestamp']),
+    ('ix_login_activity_is_suspicious_timestamp', ['is_suspicious', 'timestamp']),
+]
+# Monthly partitions created past the newest existing row.
+MONTHS_AHEAD = 3
+
+
+def _is_postgresql():
+    return op.get_bind().dialect.name == 'postgresql'
+
+
+def _utc_now():
+    # The app stores naive UTC datetimes (datetime.utcnow).
+    return "(now() AT TIME ZONE 'utc')" if _is_postgresql() else 'CURRENT_TIMESTAMP'
+
+
+def _add_months(day, months):
+    month = day.month - 1 + months
+    return date(day.year + month // 12, month % 12 + 1, 1)
+
+
+def _partition_by_month():
+    # Rebuild login_activity as a range-partitioned table. The primary key has to
+    # include the partition key, which makes timestamp NOT NULL: NULLs are
+    # backfilled while copying. The default partition takes timestamps past the
+    # last monthly partition until `flask activity-partitions` creates more.
+    bind = op.get_bind()
+    op.execute('ALTER TABLE login_activity RENAME TO login_activity_unpartitioned')
+    op.execute('ALTER TABLE login_activity_unpartitioned RENAME CONSTRAINT login_activity_pkey TO login_activity_unpartitioned_pkey')
+    op.execute("""
+        CREATE TABLE login_activity (
+            id INTEGER NOT NULL DEFAULT nextval('login_activity_id_seq'),
+            username VARCHAR(150) NOT NULL,
+            ip_address VARCHAR(100) NOT NULL,
+            timestamp TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+            is_suspicious BOOLEAN,
+            PRIMARY KEY (id, timestamp)
+        ) PARTITION BY RANGE (timestamp)
+    """)
+    # Keep the id sequence alive when the old table is dropped.
+    op.execute('ALTER SEQUENCE login_activity_id_seq OWNED BY login_activity.id')
+    op.execute('CREATE TABLE login_activity_default PARTITION OF login_activity DEFAULT')
+
+    op.execute(f'UPDATE login_activity_unpartitioned SET timestamp = {_utc_now()} WHERE timestamp IS NULL')
+    oldest, newest = bind.execute(sa.text(
+        'SELECT min(timestamp), max(timestamp) FROM login_activity_unpartitioned')).one()
+    today = date.today()
+    month = (oldest.date() if oldest else today).replace(day=1)
+    last = _add_months(max(newest.date() if newest else today, today).replace(day=1), MONTHS_AHEAD)
+    while month <= last:
+        following = _add_months(month, 1)
+        op.execute(
+            f"CREATE TABLE login_activity_y{month.year}m{month.month:02d} PARTITION OF login_activity "
+            f"FOR VALUES FROM ('{month.isoformat()}') TO ('{following.isoformat()}')"
+        )
+        month = following
+
+    op.execute('INSERT INTO login_activity SELECT id, username, ip_address, timestamp, is_suspicious '
+               'FROM login_activity_unpartitioned')
+    op.execute('DROP TABLE login_activity_unpartitioned')
+
+
+def _unpartition():
+    op.execute('ALTER TABLE login_activity RENAME TO login_activity_partitioned')
+    op.execute("""
+        CREATE TABLE login_activity (
+            id INTEGER NOT NULL DEFAULT nextval('login_activity_id_seq'),
+            username VARCHAR(150) NOT NULL,
+            ip_address VARCHAR(100) NOT NULL,
+            timestamp TIMESTAMP WITHOUT TIME ZONE,
+            is_suspicious BOOLEAN,
+            CONSTRAINT login_activity_pkey PRIMARY KEY (id)
+        )
+    """)
+    op.execute('ALTER SEQUENCE login_activity_id_seq OWNED BY login_activity.id')
+    op.execute('INSERT INTO login_activity SELECT id, username, ip_address, timestamp, is_suspicious '
+               'FROM login_activity_partitioned')
+    op.execute('DROP TABLE login_activity_partitioned CASCADE')
+
+
+def _is_partitioned():
+    return op.get_bind().execute(sa.text(
+        "SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid "
+        "WHERE c.relname = 'login_activity'")).first() is not None
+
+
+def upgrade():
+    op.create_table('login_activity_daily',
+        sa.Column('day', sa.Date(), nullable=False),
+        sa.Column('username', sa.String(length=150), nullable=False),
+        sa.Column('logins', sa.Integer(), nullable=False),
+        sa.Column('suspicious_logins', sa.Integer(), nullable=False),
+        sa.Column('distinct_ips', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('day', 'username')
+    )
+
+    if _is_postgresql() and os.environ.get('LOGIN_ACTIVITY_PARTITIONING') == 'monthly':
+        _partition_by_month()
+        # Indexes on a partitioned parent are created on every partition.
+        for name, columns in INDEXES:
+            op.create_index(name, 'login_activity', columns, unique=False)
+    elif _is_postgresql():
+        op.execute(f'UPDATE login_activity SET timestamp = {_utc_now()} WHERE timestamp IS NULL')
+        op.alter_column('login_activity', 'timestamp', existing_type=sa.DateTime(), nullable=False)
+        # Build the indexes without locking out writes on a large live table.
+        with op.get_context().autocommit_block():
+            for name, columns in INDEXES:
+                op.create_index(name, 'login_activity', columns, unique=False,
+                                postgresql_concurrently=True, if_not_exists=True)
+    else:
+        op.execute(f'UPDATE login_activity SET timestamp = {_utc_now()} WHERE timestamp IS NULL')
+        with op.batch_alter_table('login_activity', schema=None) as batch_op:
+            batch_op.alter_column('timestamp', existing_type=sa.DateTime(), nullable=False)
+            for name, columns in INDEXES:
+                batch_op.create_index(name, columns, unique=False)
+
+
+def downgrade():
+    if _is_postgresql() and _is_partitioned():
+        _unpartition()
+    else:
+        with op.batch_alter_table('login_activity', schema=None) as batch_op:
+            for name, _ in reversed(INDEXES):
+                batch_op.drop_index(name)
+            batch_op.alter_column('timestamp', existing_type=sa.DateTime(), nullable=True)
+
+    op.drop_table('login_activity_daily')
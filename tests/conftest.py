@@ -0,0 +1,44 @@
+# tests/conftest.py
+# The app reads its settings from the environment when config.py is imported,
+# so the test settings are put in place before anything from the app loads.
+# Every test gets empty tables in a throwaway SQLite file and empty caches.
+import os
+import tempfile
+
+import pytest
+
+_DB_DIR = tempfile.mkdtemp(prefix='francis-tests-')
+os.environ.update({
+    'DATABASE_URL': 'sqlite:///' + os.path.join(_DB_DIR, 'test.db'),
+    'RUN_RELEASE_ON_STARTUP': '0',
+    'ANOMALY_MODEL_PRELOAD': '0',
+    'LOGIN_EVENTS_MODE': 'inline',
+    'OUTBOX_WORKERS': '0',
+    'HASH_WORKERS': '0',
+    'RATELIMIT_ENABLED': '0',
+})
+
+
+@pytest.fixture(scope='session')
+def app():
+    from app import create_app
+
+    app = create_app()
+    app.config.update(TESTING=True)
+    return app
+
+
+@pytest.fixture
+def db(app):
+    from app import db
+    from app.profiles import profile_store
+    from app.user_cache import user_cache
+
+    with app.app_context():
+        db.create_all()
+        yield db
+        db.session.remove()
+        db.drop_all()
+    # Row ids start over in the next test; nothing cached may outlive them.
+    user_cache.invalidate()
+    profile_store.invalidate()
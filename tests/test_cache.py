@@ -0,0 +1,39 @@
+from app.cache import TTLCache
+
+
+def test_cache_evicts_least_recently_used():
+    cache = TTLCache(max_size=2, ttl=60)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1  # 'b' is now the least recently used
+    cache.put('c', 3)
+    assert cache.get('b') is None
+    assert (cache.get('a'), cache.get('c')) == (1, 3)
+    assert cache.evictions == 1
+    assert len(cache) == 2
+
+
+def test_cache_expires_entries_after_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr('app.cache.time.monotonic', lambda: now[0])
+    cache = TTLCache(max_size=10, ttl=30)
+    cache.put('a', 1)
+    now[0] += 29
+    assert cache.get('a') == 1
+    now[0] += 1
+    assert cache.get('a') is None
+    assert len(cache) == 0
+
+
+def test_cache_invalidate_and_disabled():
+    cache = TTLCache(max_size=10, ttl=60)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    cache.invalidate('a')
+    assert cache.get('a') is None and cache.get('b') == 2
+    cache.clear()
+    assert len(cache) == 0
+
+    disabled = TTLCache(max_size=0)
+    disabled.put('a', 1)
+    assert disabled.get('a') is None
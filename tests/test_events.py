@@ -0,0 +1,100 @@
+import os
+import queue
+import threading
+from datetime import datetime
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+from sqlalchemy import select
+
+from app import events
+from app.events import LoginEvent, LoginEventPipeline, process_pending
+from app.models import LoginActivity, User
+
+
+class _Encoder:
+    use_profile = False
+
+    def encode_many(self, usernames, ip_addresses, profiles):
+        return np.array([[1.0 if username == 'mallory' else 0.0] for username in usernames])
+
+
+@pytest.fixture(autouse=True)
+def scoring(monkeypatch):
+    # 'mallory' is the only anomaly; alerts are recorded instead of queued.
+    model = SimpleNamespace(decision_function=lambda features: 0.5 - features[:, 0])
+    loaded = SimpleNamespace(encoder=_Encoder(), model=model, version='test', observe_only=False)
+    monkeypatch.setattr(events.model_registry, 'get', lambda: loaded)
+    alerts = []
+    monkeypatch.setattr(events, 'send_alert_email', lambda email, username, ip: alerts.append(username))
+    return alerts
+
+
+def _event(username='alice'):
+    return LoginEvent(username, f'{username}@example.com', '10.0.0.1', datetime(2026, 1, 1, 9), 0)
+
+
+def _activity(db):
+    return db.session.execute(select(LoginActivity.username, LoginActivity.is_suspicious)
+                              .order_by(LoginActivity.id)).all()
+
+
+@pytest.fixture
+def full_queue(app, monkeypatch):
+    # A thread-mode pipeline whose queue is full and whose consumer never drains it.
+    monkeypatch.setitem(app.config, 'LOGIN_EVENTS_MODE', 'thread')
+    pipeline = LoginEventPipeline()
+    stop = threading.Event()
+    pipeline._thread = threading.Thread(target=stop.wait, daemon=True)
+    pipeline._thread.start()
+    pipeline._pid = os.getpid()
+    pipeline._queue = queue.Queue(maxsize=1)
+    pipeline._queue.put_nowait(_event('queued'))
+    yield pipeline
+    stop.set()
+
+
+def test_inline_mode_processes_in_the_request(app, db, monkeypatch, scoring):
+    monkeypatch.setitem(app.config, 'LOGIN_EVENTS_MODE', 'inline')
+    pipeline = LoginEventPipeline()
+    assert pipeline.submit(_event('mallory')) is True
+    assert _activity(db) == [('mallory', True)]
+    assert scoring == ['mallory']
+
+
+def test_full_queue_drops_when_configured(app, db, monkeypatch, full_queue):
+    monkeypatch.setitem(app.config, 'LOGIN_EVENTS_OVERFLOW', 'drop')
+    assert full_queue.submit(_event()) is None
+    assert full_queue.counters['dropped'] == 1
+    assert _activity(db) == []
+
+
+def test_full_queue_overflows_inline(app, db, monkeypatch, full_queue):
+    monkeypatch.setitem(app.config, 'LOGIN_EVENTS_OVERFLOW', 'inline')
+    assert full_queue.submit(_event()) is False
+    assert full_queue.counters['overflow_inline'] == 1
+    assert full_queue.counters['dropped'] == 0
+    assert _activity(db) == [('alice', False)]
+
+
+def test_full_queue_blocks_then_overflows(app, db, monkeypatch, full_queue):
+    monkeypatch.setitem(app.config, 'LOGIN_EVENTS_OVERFLOW', 'block')
+    monkeypatch.setitem(app.config, 'LOGIN_EVENTS_BLOCK_TIMEOUT', 0.01)
+    assert full_queue.submit(_event()) is False
+    assert full_queue.counters['overflow_inline'] == 1
+
+
+def test_worker_mode_defers_scoring_to_process_pending(app, db, monkeypatch, scoring):
+    monkeypatch.setitem(app.config, 'LOGIN_EVENTS_MODE', 'worker')
+    db.session.add(User(username='mallory', email='mallory@example.com', password='x'))
+    db.session.commit()
+    pipeline = LoginEventPipeline()
+    assert pipeline.submit(_event('alice')) is None
+    assert pipeline.submit(_event('mallory')) is None
+    assert _activity(db) == [('alice', None), ('mallory', None)]
+
+    assert process_pending() == 2
+    assert _activity(db) == [('alice', False), ('mallory', True)]
+    assert scoring == ['mallory']
+    assert process_pending() == 0
@@ -0,0 +1,58 @@
+import threading
+import time
+
+import pytest
+
+from app import export
+from app.export import ExportsBusy, start_pdf_export
+from app.models import User
+
+
+@pytest.fixture
+def blocked_renders(app, monkeypatch, tmp_path):
+    # Renders wait on the event instead of running wkhtmltopdf.
+    release = threading.Event()
+    started = []
+
+    def render(app, job_id, filters):
+        started.append(job_id)
+        release.wait(10)
+
+    monkeypatch.setattr(export, '_render_pdf', render)
+    monkeypatch.setattr(export, '_pdf_renders', export._PdfRenders())
+    monkeypatch.setitem(app.config, 'EXPORT_DIR', str(tmp_path))
+    monkeypatch.setitem(app.config, 'EXPORT_PDF_WORKERS', 1)
+    yield release, started
+    release.set()
+
+
+def test_renders_are_capped_and_reused(app, blocked_renders):
+    release, started = blocked_renders
+    with app.app_context():
+        job_id = start_pdf_export({'username': 'alice'})
+        assert start_pdf_export({'username': 'alice'}) == job_id
+        with pytest.raises(ExportsBusy):
+            start_pdf_export({'username': 'bob'})
+
+        release.set()
+        deadline = time.monotonic() + 5
+        while export._pdf_renders._running and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert start_pdf_export({'username': 'bob'}) != job_id
+    export._pdf_renders._executor.shutdown(wait=True)
+    assert len(started) == 2
+
+
+def test_busy_export_answers_429(app, db, blocked_renders):
+    user = User(username='admin', email='a@example.com', password='x', is_admin=True)
+    db.session.add(user)
+    db.session.commit()
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user.id)
+        session['_fresh'] = True
+
+    assert client.get('/activity_log/export.pdf?username=alice').status_code == 302
+    response = client.get('/activity_log/export.pdf?username=bob')
+    assert response.status_code == 429
+    assert response.headers['Retry-After'] == '30'
@@ -0,0 +1,46 @@
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from app.hashing import HashingOverloaded, PasswordHasher
+
+
+def _slow_job(seconds):
+    started = time.time()
+    time.sleep(seconds)
+    return seconds, started, time.time()
+
+
+def _hasher(**config):
+    hasher = PasswordHasher()
+    hasher.init_app(SimpleNamespace(config=config, extensions={}))
+    return hasher
+
+
+def test_timed_out_job_keeps_its_slot_until_it_finishes():
+    hasher = _hasher(HASH_WORKERS=1, HASH_QUEUE_SIZE=0, HASH_TIMEOUT=30)
+    try:
+        assert hasher._run('hashes', _slow_job, 0.0) == 0.0  # starts the pool process
+        hasher.timeout = 0.2
+        with pytest.raises(HashingOverloaded, match='longer than'):
+            hasher._run('hashes', _slow_job, 1.0)
+        # The timed-out job is still running, so there is no room for another.
+        with pytest.raises(HashingOverloaded, match='queue is full'):
+            hasher._run('hashes', _slow_job, 0.0)
+        assert hasher.stats()['in_flight'] == 1
+
+        deadline = time.monotonic() + 5
+        while hasher.stats()['in_flight'] and time.monotonic() < deadline:
+            time.sleep(0.05)
+        assert hasher.stats()['in_flight'] == 0
+        assert hasher._run('hashes', _slow_job, 0.0) == 0.0
+    finally:
+        hasher._executor.shutdown()
+
+
+def test_inline_hashing_releases_its_slot():
+    hasher = _hasher(HASH_WORKERS=0, HASH_QUEUE_SIZE=0)
+    for _ in range(3):
+        assert hasher.verify(hasher.hash('secret'), 'secret')
+    assert hasher.stats()['in_flight'] == 0
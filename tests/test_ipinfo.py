@@ -0,0 +1,94 @@
+import logging
+import os
+
+import pytest
+from sklearn.ensemble import IsolationForest
+
+from app.ai.features import FeatureEncoder
+from app.ai.ipinfo import IPRangeDB, build_ip_ranges, ip_ranges
+from app.ai.model_registry import ModelRegistry
+from app.ai.train_model import save_artifact
+
+
+def _build(tmp_path, name, rows):
+    source = tmp_path / f'{name}.csv'
+    source.write_text('network,asn,country,datacenter\n' + ''.join(f'{row}\n' for row in rows))
+    output = str(tmp_path / f'{name}.npz')
+    build_ip_ranges(str(source), output)
+    return output
+
+
+def _replace(path, new_path):
+    # Same file name, new content and a later mtime, as a deploy would leave it.
+    stat = os.stat(path)
+    os.replace(new_path, path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+
+@pytest.fixture
+def global_table(app):
+    # The registry checks the process-wide table; put it back afterwards.
+    path, interval = ip_ranges.path, ip_ranges.check_interval
+    ip_ranges.check_interval = 0
+    yield ip_ranges
+    ip_ranges.check_interval = interval
+    ip_ranges.load(path)
+
+
+def test_table_is_reloaded_when_the_file_changes(tmp_path):
+    path = _build(tmp_path, 'ranges', ['8.8.8.0/24,15169,US,1'])
+    table = IPRangeDB(check_interval=0)
+    table.load(path)
+    assert table.lookup('8.8.8.8').asn == 15169
+
+    _replace(path, _build(tmp_path, 'next', ['8.8.8.0/24,64500,NL,0']))
+    assert table.lookup('8.8.8.8').asn == 64500
+    assert table.features_many(['8.8.8.8'])[0, 2] == 64500
+
+
+def test_broken_replacement_keeps_the_old_table(tmp_path):
+    path = _build(tmp_path, 'ranges', ['8.8.8.0/24,15169,US,1'])
+    table = IPRangeDB(check_interval=0)
+    table.load(path)
+    broken = tmp_path / 'broken.npz'
+    broken.write_bytes(b'not a range file')
+    _replace(path, str(broken))
+    assert table.lookup('8.8.8.8').asn == 15169
+
+
+def _errors(caplog):
+    return [record for record in caplog.records if record.name == 'app.ai.model_registry']
+
+
+def _publish_model(tmp_path, ipinfo):
+    ips = ['8.8.8.8', '1.1.1.1', '10.0.0.1'] * 10
+    encoder = FeatureEncoder.fit(['alice', 'bob'], use_ipinfo=True)
+    model = IsolationForest(n_estimators=5, random_state=0).fit(encoder.encode_many(['alice'] * len(ips), ips))
+    model_dir = tmp_path / 'model'
+    save_artifact(model, encoder, {'version': 'test', 'ipinfo': ipinfo}, str(model_dir))
+    return ModelRegistry(str(model_dir / 'model.pkl'), check_interval=0)
+
+
+def test_model_needing_ranges_is_refused_without_a_table(tmp_path, global_table):
+    global_table.load(str(tmp_path / 'missing.npz'))
+    registry = _publish_model(tmp_path, ipinfo=None)
+    with pytest.raises(ValueError, match='no IP range file'):
+        registry.get()
+
+
+def test_table_mismatch_is_logged_and_reported(tmp_path, global_table, caplog):
+    path = _build(tmp_path, 'ranges', ['8.8.8.0/24,15169,US,1'])
+    global_table.load(path)
+    registry = _publish_model(tmp_path, ipinfo=global_table.info())
+    with caplog.at_level(logging.ERROR, logger='app.ai.model_registry'):
+        registry.get()
+    assert registry.info()['ipinfo_problem'] is None
+    assert not _errors(caplog)
+
+    _replace(path, _build(tmp_path, 'next', ['8.8.8.0/24,64500,NL,0']))
+    global_table.lookup('8.8.8.8')  # any lookup notices the new file
+    with caplog.at_level(logging.ERROR, logger='app.ai.model_registry'):
+        registry.get()
+        registry.get()
+    assert 'was trained with IP ranges' in registry.info()['ipinfo_problem']
+    assert len(_errors(caplog)) == 1
@@ -0,0 +1,44 @@
+import pytest
+
+from app.models import User
+
+
+@pytest.fixture
+def client(app, db):
+    return app.test_client()
+
+
+def _login(client, db, is_admin):
+    user = User(username='admin' if is_admin else 'user', email='a@example.com', password='x', is_admin=is_admin)
+    db.session.add(user)
+    db.session.commit()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user.id)
+        session['_fresh'] = True
+
+
+def test_anonymous_scrape_is_refused(client):
+    assert client.get('/metrics').status_code == 401
+
+
+def test_bearer_token(client, app, monkeypatch):
+    monkeypatch.setitem(app.config, 'METRICS_TOKEN', 's3cret')
+    assert client.get('/metrics', headers={'Authorization': 'Bearer wrong'}).status_code == 401
+    response = client.get('/metrics', headers={'Authorization': 'Bearer s3cret'})
+    assert response.status_code == 200
+    assert b'# TYPE' in response.data
+
+
+def test_admin_session(client, db):
+    _login(client, db, is_admin=True)
+    assert client.get('/metrics').status_code == 200
+
+
+def test_non_admin_session_is_refused(client, db):
+    _login(client, db, is_admin=False)
+    assert client.get('/metrics').status_code == 401
+
+
+def test_public_opt_in(client, app, monkeypatch):
+    monkeypatch.setitem(app.config, 'METRICS_PUBLIC', True)
+    assert client.get('/metrics').status_code == 200
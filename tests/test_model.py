@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+
+from app.ai.batch_score import rescore_login_activity
+from app.ai.detect_anomaly import score_batch
+from app.ai.features import FeatureEncoder
+from app.ai.model_registry import DEFAULT_MODEL_PATH, ModelRegistry
+
+
+def test_unknown_users_share_a_code_inside_the_trained_range():
+    encoder = FeatureEncoder.fit(['admin', 'bob', 'carol', 'dave', 'erin'])
+    assert [encoder.encode_user(name) for name in ('admin', 'erin')] == [0.0, 4.0]
+    assert encoder.encode_user('zoe') == encoder.encode_user('alice') == 2.0
+    assert FeatureEncoder().encode_user('zoe') == 0.0
+
+
+def test_encoders_saved_with_hash_buckets_still_load():
+    encoder = FeatureEncoder.from_dict({'format_version': 1, 'user_vocab': {'admin': 0}, 'hash_buckets': 1024})
+    assert encoder.encode_user('admin') == 0.0
+
+
+@pytest.fixture
+def shipped_model(app, monkeypatch):
+    from app.ai import batch_score
+
+    registry = ModelRegistry(DEFAULT_MODEL_PATH)
+    monkeypatch.setattr(batch_score, 'model_registry', registry)
+    return registry.get()
+
+
+def test_shipped_dummy_model_is_observe_only(shipped_model):
+    assert shipped_model.observe_only
+    flags, scores = score_batch(['alice', 'bob', 'hacker'], ['10.0.0.1', '8.8.8.8', '45.67.89.123'],
+                                shipped_model, return_scores=True)
+    assert len(scores) == 3
+    assert not flags.any()
+
+
+def test_rescore_refuses_an_observe_only_model(db, shipped_model):
+    with pytest.raises(ValueError, match='dummy data'):
+        rescore_login_activity()
@@ -0,0 +1,93 @@
+import os
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+from app.ai.online import ONLINE_FEATURE_NAMES, HalfSpaceTrees, OnlineDetector
+
+WINDOW = 200
+
+
+@pytest.fixture
+def detector(app, tmp_path):
+    detector = OnlineDetector()
+    detector.mode = 'replace'
+    detector.path = str(tmp_path / 'online.npz')
+    detector.window_size = WINDOW
+    detector._model = HalfSpaceTrees(len(ONLINE_FEATURE_NAMES), n_trees=25, depth=8, window_size=WINDOW, seed=0)
+    detector._pid = os.getpid()
+    detector._next_checkpoint = float('inf')
+    return detector
+
+
+def _office_hours(n, start, seed=0):
+    # Logins from one office network during the working day.
+    rng = np.random.default_rng(seed)
+    ips = [f'10.1.{rng.integers(256)}.{rng.integers(1, 255)}' for _ in range(n)]
+    times = [start + timedelta(hours=int(rng.integers(9, 17)), minutes=int(rng.integers(60))) for _ in range(n)]
+    return ips, times
+
+
+def _learn_windows(detector, windows, start, seed=0):
+    for i in range(windows):
+        ips, times = _office_hours(WINDOW, start + timedelta(days=i), seed + i)
+        detector.score_learn(ips, times)
+
+
+def test_no_flags_before_a_threshold_exists(detector):
+    start = datetime(2026, 1, 5)
+    _learn_windows(detector, 1, start)
+    flags, scores = detector.score_learn(['203.0.113.7'], [start.replace(hour=3)])
+    assert np.isnan(scores).all() and not flags.any()
+
+
+def test_novel_range_and_hour_are_flagged_until_they_become_common(detector):
+    start = datetime(2026, 1, 5)
+    _learn_windows(detector, 3, start)
+    normal_ips, normal_times = _office_hours(100, start + timedelta(days=3), seed=99)
+    flags, _ = detector.score_learn(normal_ips, normal_times)
+    assert flags.mean() < 0.2  # about the quantile; noisy with windows this small
+
+    night = start + timedelta(days=4, hours=3)
+    flags, _ = detector.score_learn(['203.0.113.7', '10.1.2.3'], [night, night])
+    assert flags.all()
+
+    # A new night shift from a new network: two windows later it is normal traffic.
+    for i in range(2):
+        ips, times = _office_hours(WINDOW // 2, start + timedelta(days=5 + i), seed=50 + i)
+        ips += [f'203.0.113.{n % 250 + 1}' for n in range(WINDOW // 2)]
+        times += [night + timedelta(days=1 + i, minutes=n % 60) for n in range(WINDOW // 2)]
+        detector.score_learn(ips, times)
+    flags, _ = detector.score_learn(['203.0.113.7'], [night + timedelta(days=3)])
+    assert not flags.any()
+
+
+def test_confirm_keeps_forest_flags_the_online_model_agrees_with(detector):
+    detector.mode = 'confirm'
+    start = datetime(2026, 1, 5)
+    _learn_windows(detector, 3, start)
+    ips, times = _office_hours(20, start + timedelta(days=3), seed=7)
+    online = detector.score_learn(ips + ['203.0.113.7'], times + [start + timedelta(days=3, hours=3)])
+    online_flags = online[0]
+    assert online_flags[-1]
+    normal = int(np.argmin(online_flags))  # a login the online model finds normal
+
+    forest_flags = np.zeros(21, dtype=bool)
+    forest_flags[[normal, -1]] = True
+    combined = detector.combine(forest_flags, online)
+    assert combined[-1] and not combined[normal]
+    assert combined.tolist() == (forest_flags & online_flags).tolist()
+    # Before the online model has a threshold the forest's flags stand.
+    assert detector.combine(forest_flags, (np.zeros(21, dtype=bool), np.full(21, np.nan))).tolist() == \
+        forest_flags.tolist()
+
+
+def test_threshold_survives_a_checkpoint(detector):
+    _learn_windows(detector, 3, datetime(2026, 1, 5))
+    threshold = detector._model.threshold(detector.quantile)
+    detector.checkpoint()
+    restored = OnlineDetector()
+    restored.path, restored.window_size = detector.path, WINDOW
+    restored.depth = 8
+    assert restored.load().threshold(detector.quantile) == threshold
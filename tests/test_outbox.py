@@ -0,0 +1,134 @@
+import socket
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+from aiosmtpd.controller import Controller
+from sqlalchemy import func, select, update
+
+from app.models import OutboxMessage
+from app.outbox import deliver_pending, enqueue_email
+
+
+class Recorder:
+    # aiosmtpd handler: keeps every message, refuses the addresses in `refuse`.
+    def __init__(self):
+        self.messages = []
+        self.refuse = set()
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if address in self.refuse:
+            return '550 mailbox unavailable'
+        envelope.rcpt_tos.append(address)
+        return '250 OK'
+
+    async def handle_DATA(self, server, session, envelope):
+        self.messages.append(envelope)
+        return '250 Message accepted for delivery'
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture
+def smtp(app, monkeypatch):
+    recorder = Recorder()
+    controller = Controller(recorder, hostname='127.0.0.1', port=_free_port())
+    controller.start()
+    state = app.extensions['mail']
+    for name, value in (('server', '127.0.0.1'), ('port', controller.port), ('use_tls', False),
+                        ('use_ssl', False), ('username', None), ('suppress', False)):
+        monkeypatch.setattr(state, name, value)
+    for name, value in (('OUTBOX_MAX_ATTEMPTS', 3), ('OUTBOX_BACKOFF_SECONDS', 30),
+                        ('OUTBOX_BACKOFF_MAX_SECONDS', 3600)):
+        monkeypatch.setitem(app.config, name, value)
+    yield recorder, controller
+    controller.stop()
+
+
+def _make_due(db):
+    db.session.execute(update(OutboxMessage).values(next_attempt_at=datetime.utcnow() - timedelta(seconds=1)))
+    db.session.commit()
+
+
+def test_batch_is_delivered_over_smtp(db, smtp):
+    recorder, _ = smtp
+    for i in range(3):
+        enqueue_email(f'user{i}@example.com', f'subject {i}', 'body')
+
+    assert deliver_pending() == 3
+    assert sorted(envelope.rcpt_tos[0] for envelope in recorder.messages) == [
+        'user0@example.com', 'user1@example.com', 'user2@example.com']
+    assert db.session.scalars(select(OutboxMessage.status)).all() == ['sent'] * 3
+    assert deliver_pending() == 0
+
+
+def test_refused_recipient_is_retried_with_backoff(db, smtp):
+    recorder, _ = smtp
+    recorder.refuse.add('bounce@example.com')
+    enqueue_email('bounce@example.com', 'subject', 'body')
+    enqueue_email('ok@example.com', 'subject', 'body')
+
+    started = datetime.utcnow()
+    assert deliver_pending() == 2
+    failed = db.session.scalar(select(OutboxMessage).where(OutboxMessage.recipient == 'bounce@example.com'))
+    assert (failed.status, failed.attempts) == ('pending', 1)
+    assert failed.next_attempt_at >= started + timedelta(seconds=30)
+    assert deliver_pending() == 0  # not due yet
+
+    _make_due(db)
+    assert deliver_pending() == 1
+    assert db.session.get(OutboxMessage, failed.id).next_attempt_at >= datetime.utcnow() + timedelta(seconds=59)
+
+    recorder.refuse.clear()
+    _make_due(db)
+    assert deliver_pending() == 1
+    assert db.session.get(OutboxMessage, failed.id).status == 'sent'
+    assert len(recorder.messages) == 2
+
+
+def test_connection_failure_gives_up_after_max_attempts(app, db, smtp, monkeypatch):
+    monkeypatch.setattr(app.extensions['mail'], 'port', _free_port())  # nothing listening
+    enqueue_email('user@example.com', 'subject', 'body')
+    for _ in range(3):
+        assert deliver_pending() == 1
+        _make_due(db)
+    message = db.session.scalar(select(OutboxMessage))
+    assert (message.status, message.attempts) == ('failed', 3)
+
+
+def test_dedupe_key_queues_once_per_window(db):
+    first = enqueue_email('a@example.com', 'alert', 'body', dedupe_key='alert:a:1.2.3.4')
+    assert first is not None
+    assert enqueue_email('a@example.com', 'alert', 'body', dedupe_key='alert:a:1.2.3.4') is None
+
+    db.session.execute(update(OutboxMessage).values(created_at=datetime.utcnow() - timedelta(hours=1)))
+    db.session.commit()
+    second = enqueue_email('a@example.com', 'alert', 'body', dedupe_key='alert:a:1.2.3.4', dedupe_window=600)
+    assert second is not None and second != first
+    assert db.session.get(OutboxMessage, first).dedupe_key is None
+    assert enqueue_email('b@example.com', 'no key', 'body') is not None
+    assert db.session.scalar(select(func.count()).select_from(OutboxMessage)) == 3
+
+
+def test_concurrent_dedupe_queues_once(app, db):
+    # Requests racing on the same key: the unique index lets exactly one insert.
+    barrier = threading.Barrier(4)
+    results = []
+
+    def request():
+        with app.app_context():
+            barrier.wait()
+            results.append(enqueue_email('a@example.com', 'alert', 'body', dedupe_key='alert:race'))
+            db.session.remove()
+
+    threads = [threading.Thread(target=request) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sum(result is not None for result in results) == 1
+    assert db.session.scalar(select(func.count()).select_from(OutboxMessage)) == 1
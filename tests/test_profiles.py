@@ -0,0 +1,94 @@
+import threading
+from datetime import datetime, timedelta
+
+from app.models import UserProfile
+from app.profiles import ProfileStore
+
+
+def test_store_invalidate_rereads_the_row(db):
+    store = ProfileStore()
+    store.record('alice', '10.0.0.1', datetime(2026, 1, 1, 9))
+    db.session.commit()
+    assert store.get('alice').login_count == 1
+
+    db.session.execute(UserProfile.__table__.update().values(login_count=7))
+    db.session.commit()
+    assert store.get('alice').login_count == 1  # still cached
+    store.invalidate('alice')
+    assert store.get('alice').login_count == 7
+
+    db.session.execute(UserProfile.__table__.update().values(login_count=8))
+    db.session.commit()
+    store.invalidate()
+    assert store.get('alice').login_count == 8
+
+
+def test_record_many_describes_each_login_by_the_history_before_it(db):
+    store = ProfileStore()
+    start = datetime(2026, 1, 1, 9)
+    features = store.record_many(['bob', 'bob', 'carol'], ['10.0.0.1', '10.0.0.1', '10.0.0.2'],
+                                 [start, start + timedelta(minutes=1), start])
+    db.session.commit()
+    assert features[0][0] == 0.0  # first login: no known IPs yet
+    assert features[1][0] == 1.0  # second login from the same IP
+    assert db.session.get(UserProfile, 'bob').login_count == 2
+    assert db.session.get(UserProfile, 'carol').login_count == 1
+
+
+def test_stale_caches_in_two_workers_lose_no_updates(db):
+    # Two workers with their own caches, both warmed before either writes.
+    first, second = ProfileStore(), ProfileStore()
+    first.get('dave'), second.get('dave')
+    start = datetime(2026, 1, 1, 9)
+    for i, store in enumerate([first, second, first, second]):
+        store.record('dave', f'10.0.{i}.1', start + timedelta(minutes=i))
+        db.session.commit()
+
+    row = db.session.get(UserProfile, 'dave')
+    assert row.login_count == 4
+    assert set(row.known_ips.split(',')) == {'10.0.0.1', '10.0.1.1', '10.0.2.1', '10.0.3.1'}
+
+
+def test_concurrent_writers_lose_no_updates(app, db):
+    stores = [ProfileStore(), ProfileStore()]
+    start = datetime(2026, 1, 1, 9)
+    barrier = threading.Barrier(len(stores))
+    errors = []
+
+    def worker(n, store):
+        try:
+            with app.app_context():
+                barrier.wait()
+                for i in range(10):
+                    store.record('erin', f'10.{n}.{i}.1', start + timedelta(seconds=i))
+                    db.session.commit()
+                db.session.remove()
+        except Exception as e:  # surfaced by the assertion below
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker, args=(n, store)) for n, store in enumerate(stores)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    db.session.expire_all()
+    assert db.session.get(UserProfile, 'erin').login_count == 20
+
+
+def test_rolled_back_profiles_are_not_cached(db):
+    store = ProfileStore()
+    store.record('erin', '10.0.0.1', datetime(2026, 1, 1, 9))
+    db.session.commit()
+    store.record('erin', '10.0.0.2', datetime(2026, 1, 1, 10))
+    assert store.get('erin').login_count == 1  # uncommitted: the cache keeps the committed state
+    db.session.rollback()
+    assert store.get('erin').login_count == 1
+    assert db.session.get(UserProfile, 'erin').login_count == 1
+
+    store.record('erin', '10.0.0.3', datetime(2026, 1, 1, 11))
+    db.session.commit()
+    db.session.execute(UserProfile.__table__.update().values(login_count=9))
+    db.session.commit()
+    assert store.get('erin').login_count == 2  # cached on commit
@@ -0,0 +1,58 @@
+import pytest
+from sqlalchemy import func, select
+
+from app.models import RateLimitBucket
+from app.ratelimit import MemoryBackend, Rate, SQLBackend
+
+
+def _count(db):
+    return db.session.scalar(select(func.count()).select_from(RateLimitBucket))
+
+
+@pytest.fixture
+def backend(db):
+    backend = SQLBackend(prune_every=0)
+    backend.rules = {'login_ip': Rate('3/60'), 'reset_email': Rate('3/3600')}
+    return backend
+
+
+def test_sql_bucket_empties_and_refills(backend):
+    rate = backend.rules['login_ip']
+    assert [backend.consume('login_ip:1.2.3.4', rate, now=100.0)[0] for _ in range(4)] == [True, True, True, False]
+    allowed, retry_after = backend.consume('login_ip:1.2.3.4', rate, now=100.0)
+    assert not allowed and retry_after == pytest.approx(20.0)
+    assert backend.consume('login_ip:1.2.3.4', rate, now=120.0)[0]
+
+
+def test_prune_deletes_only_refilled_buckets(backend, db):
+    backend.consume('login_ip:1.1.1.1', backend.rules['login_ip'], now=0.0)
+    backend.consume('login_ip:2.2.2.2', backend.rules['login_ip'], now=50.0)
+    backend.consume('reset_email:a@example.com', backend.rules['reset_email'], now=0.0)
+    assert _count(db) == 3
+
+    # At t=100 only the first IP bucket has had its full 60s to refill.
+    assert backend.prune(now=100.0) == 1
+    assert db.session.scalars(select(RateLimitBucket.key).order_by(RateLimitBucket.key)).all() == [
+        'login_ip:2.2.2.2', 'reset_email:a@example.com']
+    assert backend.prune(now=4000.0) == 2
+
+
+def test_inserts_prune_when_sampled(backend, db):
+    backend.prune_every = 1
+    for i in range(5):
+        backend.consume(f'login_ip:10.0.0.{i}', backend.rules['login_ip'], now=i * 100.0)
+    assert _count(db) == 1
+
+
+def test_database_errors_are_not_reported_as_rate_limited(backend, db):
+    db.drop_all()
+    with pytest.raises(Exception, match='rate_limit_bucket'):
+        backend.consume('login_ip:1.2.3.4', backend.rules['login_ip'])
+    db.create_all()
+
+
+def test_memory_backend_is_bounded():
+    backend = MemoryBackend(max_keys=2)
+    for i in range(5):
+        backend.consume(f'login_ip:10.0.0.{i}', Rate('3/60'), now=0.0)
+    assert len(backend) == 2
@@ -0,0 +1,69 @@
+from datetime import datetime
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from app.ai import detect_anomaly as detection
+from app.ai.shadow import ShadowJob, ShadowModels
+from app.models import ShadowVerdict
+
+
+class _Encoder:
+    def __init__(self, use_profile):
+        self.use_profile = use_profile
+        self.profiles = []
+
+    def encode(self, username, ip_address, profile):
+        self.profiles.append(profile)
+        return np.zeros((1, 1))
+
+    def encode_many(self, usernames, ip_addresses, profiles):
+        self.profiles.append(profiles)
+        return np.zeros((len(usernames), 1))
+
+
+def _loaded(use_profile, version='v1'):
+    model = SimpleNamespace(decision_function=lambda features: np.ones(len(features)))
+    return SimpleNamespace(encoder=_Encoder(use_profile), model=model, version=version, observe_only=False)
+
+
+@pytest.fixture
+def profile_reads(monkeypatch):
+    reads = []
+
+    def get(username):
+        reads.append(username)
+        return SimpleNamespace(features=lambda ip: ('profile', username, ip))
+
+    monkeypatch.setattr(detection.profile_store, 'get', get)
+    return reads
+
+
+def test_request_path_skips_profile_the_primary_does_not_use(app, monkeypatch, profile_reads):
+    shadows = ShadowModels()
+    shadows.registries = {'candidate': None}
+    submitted = []
+    monkeypatch.setattr(shadows, 'submit', lambda *args: submitted.append(args))
+    monkeypatch.setattr(detection, 'shadow_models', shadows)
+    monkeypatch.setattr(detection.model_registry, 'get', lambda: _loaded(use_profile=False))
+
+    with app.app_context():
+        assert detection.detect_anomaly('alice', '10.0.0.1') is False
+    assert profile_reads == []
+    assert submitted[0][2] == [None]
+
+
+def test_shadow_thread_loads_missing_profiles(app, db, profile_reads):
+    shadows = ShadowModels()
+    with_profile, without_profile = _loaded(use_profile=True, version='s1'), _loaded(use_profile=False, version='s2')
+    shadows.registries = {'history': SimpleNamespace(get=lambda: with_profile),
+                          'plain': SimpleNamespace(get=lambda: without_profile)}
+    job = ShadowJob(['alice', 'bob'], ['10.0.0.1', '10.0.0.2'], [None, ('cached',)], 'p1',
+                    np.array([0.5, -0.5]), datetime.utcnow())
+
+    assert shadows.score_jobs([job]) == 4
+    assert profile_reads == ['alice']
+    assert with_profile.encoder.profiles == [[('profile', 'alice', '10.0.0.1'), ('cached',)]]
+    assert without_profile.encoder.profiles == [None]
+    assert db.session.query(ShadowVerdict).count() == 4
@@ -0,0 +1,47 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert, select
+
+from app.events import process_pending
+from app.models import ActivityRollup, ActivityTopKey, LoginActivity
+from app.stats import HOUR, MINUTE, compact_stats, record_activity
+
+
+def _logins(db, granularity, bucket):
+    return db.session.scalar(select(ActivityRollup.logins).where(
+        (ActivityRollup.granularity == granularity) & (ActivityRollup.bucket == bucket)))
+
+
+def test_pending_rows_are_counted_once(db):
+    # Worker mode: the request inserted the row, scoring hasn't happened yet.
+    when = (datetime.utcnow() - timedelta(minutes=5)).replace(second=0, microsecond=0)
+    db.session.execute(insert(LoginActivity).values(username='alice', ip_address='10.0.0.1', timestamp=when,
+                                                    is_suspicious=None))
+    db.session.commit()
+
+    compact_stats(hours=1)
+    assert _logins(db, MINUTE, when) is None
+    assert db.session.scalar(select(ActivityTopKey.logins).where(ActivityTopKey.key == 'alice')) is None
+
+    assert process_pending() == 1
+    assert _logins(db, MINUTE, when) == 1
+
+    compact_stats(hours=1)
+    assert _logins(db, MINUTE, when) == 1
+
+
+def test_compaction_replaces_live_counts_with_exact_ones(db):
+    now = datetime(2026, 1, 1, 12, 30)
+    hour = datetime(2026, 1, 1, 11)
+    times = [hour + timedelta(minutes=m) for m in (1, 1, 2)]
+    db.session.add_all(LoginActivity(username='bob', ip_address='10.0.0.2', timestamp=t, is_suspicious=(i == 0))
+                       for i, t in enumerate(times))
+    record_activity(times + times, [False] * 6)  # double-counted live increments
+    db.session.commit()
+
+    compact_stats(hours=2, now=now)
+    assert _logins(db, HOUR, hour) == 3
+    assert _logins(db, MINUTE, hour + timedelta(minutes=1)) == 2
+    top = db.session.execute(select(ActivityTopKey.logins, ActivityTopKey.suspicious_logins)
+                             .where((ActivityTopKey.kind == 'username') & (ActivityTopKey.key == 'bob'))).one()
+    assert tuple(top) == (3, 1)
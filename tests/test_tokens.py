@@ -0,0 +1,125 @@
+import threading
+
+import pytest
+from sqlalchemy import event
+
+from app import routes
+from app.models import User
+from app.ratelimit import MemoryBackend, Rate, limiter
+from app.tokens import ResetTokens, reset_tokens
+
+
+@pytest.fixture
+def user(db):
+    user = User(username='alice', email='alice@example.com', password='scrypt:32768:8:1$salt$old')
+    db.session.add(user)
+    db.session.commit()
+    return user
+
+
+@pytest.fixture
+def queries(db):
+    statements = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    engine = db.engine
+    event.listen(engine, 'before_cursor_execute', count)
+    yield statements
+    event.remove(engine, 'before_cursor_execute', count)
+
+
+def test_token_stops_verifying_once_consumed(db, user):
+    token = reset_tokens.issue(user)
+    assert reset_tokens.verify(token).id == user.id
+
+    assert reset_tokens.consume(token, 'scrypt:32768:8:1$salt$new') is not None
+    assert reset_tokens.verify(token) is None
+    assert reset_tokens.consume(token, 'scrypt:32768:8:1$salt$newer') is None
+    assert db.session.get(User, user.id).password == 'scrypt:32768:8:1$salt$new'
+
+
+def test_concurrent_consumes_succeed_once(app, user, monkeypatch):
+    token = reset_tokens.issue(user)
+    verify = reset_tokens.verify
+    barrier = threading.Barrier(2)
+
+    def verify_together(token):
+        # Both requests see the old password before either one writes.
+        found = verify(token)
+        barrier.wait(5)
+        return found
+
+    monkeypatch.setattr(reset_tokens, 'verify', verify_together)
+    results, errors = [], []
+
+    def consume(n):
+        try:
+            with app.app_context():
+                results.append(reset_tokens.consume(token, f'scrypt:32768:8:1$salt${n}') is not None)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=consume, args=(n,)) for n in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert sorted(results) == [False, True]
+
+
+def test_tampered_and_expired_tokens_need_no_query(app, db, user, queries):
+    token = reset_tokens.issue(user)
+    expired = ResetTokens()
+    expired.max_age = -1
+    db.session.expunge_all()
+    queries.clear()
+
+    assert reset_tokens.verify(token[:-2] + ('AA' if not token.endswith('AA') else 'BB')) is None
+    assert reset_tokens.verify('not-a-token') is None
+    assert expired.verify(token) is None
+    assert queries == []
+    assert reset_tokens.verify(token) is not None
+    assert len(queries) == 1
+
+
+@pytest.fixture
+def limits(monkeypatch):
+    monkeypatch.setattr(limiter, 'enabled', True)
+    monkeypatch.setattr(limiter, 'backend', MemoryBackend(1000))
+    monkeypatch.setitem(limiter.rules, 'reset_ip', Rate('3/300'))
+    monkeypatch.setitem(limiter.rules, 'reset_email', Rate('1/3600'))
+    monkeypatch.setitem(limiter.rules, 'reset_verify_ip', Rate('2/300'))
+
+
+@pytest.fixture
+def sent(monkeypatch):
+    emails = []
+    monkeypatch.setattr(routes, 'enqueue_email', lambda **message: emails.append(message))
+    return emails
+
+
+def test_reset_verify_is_limited_per_ip(app, user, limits):
+    client = app.test_client()
+    assert client.get('/reset_password/not-a-token').status_code == 302
+    assert client.get('/reset_password/not-a-token').status_code == 302
+    response = client.get('/reset_password/not-a-token')
+    assert response.status_code == 429
+    assert int(response.headers['Retry-After']) >= 1
+
+
+def test_reset_request_stops_sending_then_answers_429(app, user, limits, sent):
+    client = app.test_client()
+    for _ in range(2):
+        response = client.post('/reset_password_request', data={'email': user.email})
+        assert response.status_code == 302
+    # The address's bucket allows one email; the second answer looks the same but sends nothing.
+    assert [message['recipient'] for message in sent] == [user.email]
+
+    response = client.post('/reset_password_request', data={'email': 'bob@example.com'})
+    assert response.status_code == 302
+    response = client.post('/reset_password_request', data={'email': user.email})
+    assert response.status_code == 429
+    assert len(sent) == 1
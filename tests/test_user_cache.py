@@ -0,0 +1,71 @@
+import pytest
+from sqlalchemy import update
+from sqlalchemy.orm import Session
+
+from app.models import User
+from app.user_cache import user_cache
+
+
+@pytest.fixture
+def admin(db):
+    user = User(username='root', email='root@example.com', password='x', is_admin=True)
+    db.session.add(user)
+    db.session.commit()
+    user_id = user.id
+    db.session.remove()  # start from an empty identity map, like a new request
+    assert user_cache.load(user_id).is_admin
+    assert user_cache.cache.get(user_id) is not None
+    return user_id
+
+
+def test_cache_hit_needs_no_query(admin, db):
+    db.session.remove()
+    assert user_cache.load(admin).username == 'root'
+    assert user_cache.cache.hits >= 1
+
+
+def test_demotion_is_seen_at_once(admin, db):
+    db.session.get(User, admin).is_admin = False
+    db.session.commit()
+    db.session.remove()
+    assert user_cache.load(admin).is_admin is False
+
+
+def test_deletion_is_seen_at_once(admin, db):
+    db.session.delete(db.session.get(User, admin))
+    db.session.commit()
+    db.session.remove()
+    assert user_cache.load(admin) is None
+
+
+def test_update_committed_from_another_session(admin, db):
+    with Session(db.engine) as other:
+        other.get(User, admin).email = 'new@example.com'
+        other.commit()
+    db.session.remove()
+    assert user_cache.load(admin).email == 'new@example.com'
+
+
+def test_old_row_recached_before_commit_is_dropped(admin, db):
+    # Flushing the demotion drops the entry; a concurrent request that reads
+    # the still-committed old row re-caches it; the commit drops it again.
+    db.session.get(User, admin).is_admin = False
+    db.session.flush()
+    assert user_cache.cache.get(admin) is None
+    with Session(db.engine) as other:
+        old = other.get(User, admin)
+        user_cache.cache.put(admin, {'id': old.id, 'username': old.username, 'email': old.email,
+                                     'password': old.password, 'is_admin': old.is_admin})
+    db.session.commit()
+    db.session.remove()
+    assert user_cache.load(admin).is_admin is False
+
+
+def test_role_check_ignores_a_stale_entry(admin, db):
+    # Bulk UPDATEs (and other workers) don't invalidate this cache until the
+    # TTL; is_admin() asks the database, so demotion still takes effect.
+    db.session.execute(update(User).where(User.id == admin).values(is_admin=False))
+    db.session.commit()
+    db.session.remove()
+    assert user_cache.load(admin).is_admin is True
+    assert user_cache.is_admin(admin) is False